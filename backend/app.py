@@ -1,123 +1,295 @@
-from flask import Flask, jsonify, request, send_from_directory
-from flask_socketio import SocketIO, emit, join_room
+"""
+WebWatch backend entry point.
+
+create_app(config) builds the Flask app and its Socket.IO server
+(app.extensions['socketio']). The core is always there: connection limits,
+pooled SQLite, and the connect / disconnect lifecycle (sockets/basic.py).
+Everything else is a subsystem, enabled by name in config.SUBSYSTEMS:
+
+    metrics     /metrics, HTTP request timing
+    events      event log (joins, disconnects, uploads, motion, deletions), /api/events
+    auth        bearer tokens on routes and sockets, /api/auth, /login
+    camera      camera registry, heartbeats, /api/camera
+    recordings  uploads, recordings list / delete, playback
+    rooms       pairing codes, join_room / leave_room
+    signaling   offer / answer / ice-candidate relay
+    snapshots   JPEG snapshot relay: one camera upload, many viewers, /api/snapshots
+    jobs        background worker pool, /api/jobs, job_update pushes
+    analysis    motion detection of new recordings
+    thumbnails  posters / sprites of new recordings
+    timeline    per-camera timeline index, seek, clip export
+    transcode   lower-bitrate renditions of new recordings (if TRANSCODE is on)
+    storage     retention thread, /api/storage
+    ingest      streamed recordings over Socket.IO, /api/segments
+
+A subsystem's modules are imported only when it is enabled, so a
+signaling-only process never loads the job pool, numpy or the media code.
+Subsystems that need another one pull it in (timeline needs jobs).
+
+Background threads and pools do not start in create_app() (tests and the
+benchmark build apps without them): start(app) / stop(app) do that, see
+__main__. The config object only decides what create_app() wires in; the
+services themselves read config.Config.
+"""
+
+# Before anything imports socket / threading: green-thread modes patch them (services/concurrency.py)
+from services import concurrency
+concurrency.select()
+
+import logging
+
+from flask import Flask
 from flask_cors import CORS
-from routes.auth import auth_bp
-import os
-import sqlite3
-import random
-from datetime import datetime
-
-# Initialize App
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'secret!'
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB Limit
-
-# ✅ ENABLE CORS FOR EVERYTHING (Fixes "Server Error")
-CORS(app, resources={r"/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-
-# Register Login Route
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-
-# --- 🔑 CODE GENERATION ROUTE ---
-@app.route('/api/code/generate', methods=['GET'])
-def generate_code_route():
-    code = str(random.randint(100000, 999999))
-    return jsonify({"code": code, "success": True}), 200
-
-# --- 📹 VIDEO MANAGEMENT ROUTES ---
-
-# 1. Upload Video
-@app.route('/api/upload', methods=['POST'])
-def upload_recording():
-    if 'video' not in request.files:
-        return jsonify({"error": "No video file"}), 400
-        
-    file = request.files['video']
-    camera_name = request.form.get('camera_name', 'Unknown Camera')
-    
-    if file:
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"rec_{timestamp}.webm"
-        
-        save_path = os.path.join('recordings', filename)
-        file.save(save_path)
-        
-        conn = sqlite3.connect('webwatch.db')
-        conn.execute('INSERT INTO recordings (filename, camera_name) VALUES (?, ?)', (filename, camera_name))
-        conn.commit()
-        conn.close()
-
-        return jsonify({"message": "Saved", "filename": filename}), 200
-
-# 2. Get List of Recordings
-@app.route('/api/recordings', methods=['GET'])
-def get_recordings():
-    conn = sqlite3.connect('webwatch.db')
-    conn.row_factory = sqlite3.Row
-    rows = conn.execute("SELECT * FROM recordings ORDER BY timestamp DESC").fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in rows]), 200
-
-# 3. Play Video
-@app.route('/recordings/<path:filename>')
-def serve_video(filename):
-    return send_from_directory('recordings', filename)
-
-# 4. 🗑️ DELETE RECORDING (The New Feature)
-@app.route('/api/recordings/<int:id>', methods=['DELETE'])
-def delete_recording(id):
-    try:
-        conn = sqlite3.connect('webwatch.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get filename to delete from disk
-        row = cursor.execute("SELECT filename FROM recordings WHERE id = ?", (id,)).fetchone()
-        
-        if row:
-            filename = row['filename']
-            file_path = os.path.join('recordings', filename)
-            
-            # Delete File
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            
-            # Delete DB Entry
-            cursor.execute("DELETE FROM recordings WHERE id = ?", (id,))
-            conn.commit()
-            conn.close()
-            return jsonify({"success": True}), 200
-        else:
-            conn.close()
-            return jsonify({"error": "Not found"}), 404
-            
-    except Exception as e:
-        print(f"Error deleting: {e}")
-        return jsonify({"error": str(e)}), 500
-
-# --- 🔌 WEBRTC SIGNALING ---
-
-@socketio.on('join_room')
-def handle_join(data):
-    room = str(data.get('code'))
-    join_room(room)
-    emit('join_room_success', room=room)
-
-@socketio.on('offer')
-def handle_offer(data):
-    emit('offer', data, room=data['room_code'], include_self=False)
-
-@socketio.on('answer')
-def handle_answer(data):
-    emit('answer', data, room=data['room_code'], include_self=False)
-
-@socketio.on('ice-candidate')
-def handle_ice(data):
-    emit('ice-candidate', data, room=data['room_code'], include_self=False)
+
+from config import Config
+from services import db, ratelimit
+from sockets import basic
+
+logging.basicConfig(level=Config.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+if Config.ASYNC_MODE.lower() not in ('auto', concurrency.mode):
+    logger.warning("ASYNC_MODE=%s is not installed, falling back to %s", Config.ASYNC_MODE, concurrency.mode)
+
+
+# --- subsystems: register(app, socketio, lifecycle) ---
+
+def _metrics(app, socketio, lifecycle):
+    from routes.metrics import metrics_bp
+    from services import metrics
+    # Before auth: 401s are timed too
+    metrics.init_app(app)
+    app.register_blueprint(metrics_bp)
+
+
+def _events(app, socketio, lifecycle):
+    from routes.events import events_bp
+    from services import events
+    app.register_blueprint(events_bp, url_prefix='/api/events')
+    # Events are queued in memory and written in batches on their own thread.
+    # Started first and stopped last, so the other subsystems' events get written
+    lifecycle['start'].append(events.start)
+    lifecycle['stop'].append(events.stop)
+
+
+def _auth(app, socketio, lifecycle):
+    from routes.auth import auth_bp
+    from routes.login import login_bp
+    from services import auth
+    # Bearer token check before every route except login
+    auth.init_app(app)
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(login_bp)
+    # Same signed token on sockets: io(url, {auth: {token}}) or ?token=
+    basic.on_connect(auth.authenticate_socket)
+
+
+def _camera(app, socketio, lifecycle):
+    from routes.camera import camera_bp
+    from services import camera_service
+    from sockets.camera import register_camera_events
+    app.register_blueprint(camera_bp, url_prefix='/api/camera')
+    register_camera_events(socketio)
+    basic.on_disconnect(camera_service.registry.disconnected)
+    # Heartbeat state is flushed to the DB in batches on its own thread
+    lifecycle['start'].append(camera_service.start)
+    lifecycle['stop'].append(camera_service.stop)
+
+
+def _recordings(app, socketio, lifecycle):
+    from routes.playback import playback_bp
+    from routes.recordings import recordings_bp
+    from routes.upload import upload_bp
+    from services import renditions, retention
+    app.register_blueprint(upload_bp, url_prefix='/api/upload')
+    app.register_blueprint(recordings_bp, url_prefix='/api/recordings')
+    # /recordings/<filename>, original or a transcoded rendition
+    app.register_blueprint(playback_bp)
+    # Renditions go with their original, whether or not transcoding is enabled now
+    retention.on_unlink(renditions.remove)
+
+
+def _rooms(app, socketio, lifecycle):
+    from routes.code import code_bp
+    from services import room_registry
+    from sockets import rooms
+    app.register_blueprint(code_bp, url_prefix='/api/code')
+    rooms.register_room_events(socketio)
+    # O(rooms this socket was in), via the registry's reverse index
+    basic.on_disconnect(rooms.cleanup_sid)
+    # Shared (sqlite) room state: a lease per worker, so a crashed worker's rows expire
+    lifecycle['start'].append(room_registry.start)
+    lifecycle['stop'].append(room_registry.stop)
+
+
+def _signaling(app, socketio, lifecycle):
+    from sockets.signaling import forget_peer, register_signaling_events
+    register_signaling_events(socketio)
+    basic.on_disconnect(forget_peer)
+
+
+def _snapshots(app, socketio, lifecycle):
+    from routes.snapshots import snapshots_bp
+    from services.snapshots import relay
+    from sockets.snapshots import register_snapshot_events
+    app.register_blueprint(snapshots_bp, url_prefix='/api/snapshots')
+    register_snapshot_events(socketio)
+    # The camera's ring goes with it; open MJPEG streams end
+    basic.on_disconnect(relay.forget)
+
+
+def _jobs(app, socketio, lifecycle):
+    from routes.jobs import jobs_bp
+    from services import jobs
+    from sockets.jobs import register_job_events
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+    register_job_events(socketio)
+    lifecycle['start'].append(lambda: jobs.start(socketio))
+    # Running jobs finish, queued ones stay queued for the next start
+    lifecycle['stop'].append(jobs.stop)
+
+
+def _analysis(app, socketio, lifecycle):
+    from services import motion, upload_service
+    upload_service.on_recording(motion.submit)
+
+
+def _thumbnails(app, socketio, lifecycle):
+    from routes.thumbnails import thumbnails_bp
+    from services import retention, thumbnails, upload_service
+    # /api/recordings/<id>/thumbnail
+    app.register_blueprint(thumbnails_bp, url_prefix='/api/recordings')
+    upload_service.on_recording(thumbnails.submit)
+    retention.on_evict(thumbnails.invalidate)
+
+
+def _timeline(app, socketio, lifecycle):
+    from routes.timeline import timeline_bp
+    from services import timeline, upload_service
+    app.register_blueprint(timeline_bp, url_prefix='/api/timeline')
+    upload_service.on_recording(timeline.submit)
+    # Recordings from before the timeline index get probed once
+    lifecycle['start'].append(timeline.backfill)
+
+
+def _transcode(app, socketio, lifecycle):
+    from services import transcode, upload_service
+    # Only queues work when TRANSCODE is on
+    upload_service.on_recording(transcode.submit)
+
+
+def _storage(app, socketio, lifecycle):
+    from routes.storage import storage_bp
+    from services import retention
+    app.register_blueprint(storage_bp, url_prefix='/api/storage')
+    # Quota / max-age eviction on its own thread
+    lifecycle['start'].append(retention.start)
+    lifecycle['stop'].append(retention.stop)
+
+
+def _ingest(app, socketio, lifecycle):
+    from routes.segments import segments_bp
+    from services.ingest import ingest, recover as recover_segments
+    from sockets.ingest import register_ingest_events
+    app.register_blueprint(segments_bp, url_prefix='/api/segments')
+    register_ingest_events(socketio)
+    # Finish the socket's streamed recording, if any (buffered chunks are still written)
+    basic.on_disconnect(ingest.close)
+    # Segments a crash left open are closed with what reached the disk
+    lifecycle['start'].append(recover_segments)
+    lifecycle['stop'].append(ingest.stop)
+
+
+# name -> (register, required subsystems), in registration order. Stops run
+# in reverse: stream buffers are flushed before retention and the job pool stop
+SUBSYSTEMS = {
+    'metrics': (_metrics, ()),
+    'events': (_events, ()),
+    'auth': (_auth, ()),
+    'camera': (_camera, ()),
+    'recordings': (_recordings, ()),
+    'rooms': (_rooms, ()),
+    'signaling': (_signaling, ('rooms',)),
+    'snapshots': (_snapshots, ('rooms',)),
+    'jobs': (_jobs, ()),
+    'analysis': (_analysis, ('jobs',)),
+    'thumbnails': (_thumbnails, ('jobs',)),
+    'timeline': (_timeline, ('jobs',)),
+    'transcode': (_transcode, ('jobs', 'recordings')),
+    'storage': (_storage, ()),
+    'ingest': (_ingest, ()),
+}
+
+
+def resolve_subsystems(names):
+    """Enabled subsystem names in registration order, requirements included."""
+    wanted = set(SUBSYSTEMS) if 'all' in names else set(names)
+    unknown = wanted - SUBSYSTEMS.keys()
+    if unknown:
+        raise ValueError(f"Unknown subsystem(s) {', '.join(sorted(unknown))}, expected {', '.join(SUBSYSTEMS)}")
+    pending = list(wanted)
+    while pending:
+        name = pending.pop()
+        for required in SUBSYSTEMS[name][1]:
+            if required not in wanted:
+                logger.info("Subsystem %s needs %s, enabling it", name, required)
+                wanted.add(required)
+                pending.append(required)
+    return [name for name in SUBSYSTEMS if name in wanted]
+
+
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = config.SECRET_KEY
+    app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB Limit
+
+    # ✅ ENABLE CORS FOR EVERYTHING (Fixes "Server Error")
+    CORS(app, resources={r"/*": {"origins": config.CORS_ORIGINS}},
+         expose_headers=["X-Next-Cursor", "X-Total-Count", "Link", "Upload-Offset"])
+    socketio = basic.init_socketio(app, config)
+
+    # Connection limits and shutdown draining first: a refused request costs nothing else
+    concurrency.init_app(app)
+    # Pooled SQLite connections, handed back at the end of every request
+    db.init_app(app)
+    # connect / disconnect / ping; subsystems hook into connect and disconnect
+    basic.register_basic_events(socketio)
+    # Token buckets on socket events and upload / login routes; a socket's go with it
+    basic.on_disconnect(ratelimit.limiter.forget)
+
+    lifecycle = {'start': [], 'stop': []}
+    enabled = resolve_subsystems(config.SUBSYSTEMS)
+    for name in enabled:
+        SUBSYSTEMS[name][0](app, socketio, lifecycle)
+    app.extensions['webwatch'] = {'subsystems': enabled, **lifecycle}
+    logger.debug("Subsystems: %s", ', '.join(enabled))
+    return app
+
+
+def start(app):
+    """Bring the database up to date and start the enabled subsystems' background work."""
+    from setup_db import init_db
+    # Creates recordings/ and brings tables & indexes up to date
+    init_db()
+    for fn in app.extensions['webwatch']['start']:
+        fn()
+
+
+def stop(app):
+    for fn in reversed(app.extensions['webwatch']['stop']):
+        fn()
+    db.close_all()
+
 
 if __name__ == '__main__':
-    if not os.path.exists('recordings'):
-        os.makedirs('recordings')
-        
-    socketio.run(app, host='0.0.0.0', port=5000, ssl_context=('cert.pem', 'key.pem'))
\ No newline at end of file
+    app = create_app()
+    socketio = app.extensions['socketio']
+    start(app)
+
+    # SIGTERM / SIGINT drain in-flight requests and clients, then run() returns
+    concurrency.install_shutdown(socketio)
+    logger.info("Serving in %s mode", concurrency.mode)
+    socketio.run(app, host='0.0.0.0', port=5000, **concurrency.server_options('cert.pem', 'key.pem'))
+
+    # Buffered stream chunks are written out, running jobs finish, connections close
+    stop(app)
+    logger.info("Shutdown complete")
@@ -0,0 +1,403 @@
+"""
+In-process benchmark / load test for the signaling and recording endpoints.
+
+Runs the real app (same handlers, same SQLite settings) against a throwaway
+directory, with Flask's and Flask-SocketIO's test clients, so it needs no
+server, ports, certificates or extra packages:
+
+    cd backend
+    python benchmarks/bench.py                      # all scenarios, compare to baseline
+    python benchmarks/bench.py --clients 5000 signaling
+    python benchmarks/bench.py --save-baseline      # record this machine's numbers
+    python benchmarks/bench.py --check              # exit 1 on a regression
+    python benchmarks/bench.py --async-mode gevent  # handlers under green threads
+
+Each scenario runs --runs times (default 3) and the best figures are kept,
+which filters out most scheduler noise; compare runs made with the same
+sizing arguments on the same machine (--check refuses a baseline recorded
+with different ones).
+
+Scenarios:
+- signaling:  N socket clients paired camera/viewer: connect, join_room,
+              offer, answer, ICE candidates, disconnect
+- upload:     /api/upload (multipart) and the chunked sessions API with
+              realistic clip sizes
+- recordings: keyset-paginated /api/recordings over a seeded table, with
+              and without a camera filter
+- playback:   serve_video full downloads and Range seeks
+
+For every operation it reports throughput, p50 / p99 latency, the RSS
+growth of each scenario and the process's peak RSS. Results are compared with benchmarks/baseline.json;
+a p99 or throughput change worse than --tolerance (default 25%) is flagged.
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MB = 1024 * 1024
+# Arguments that change what is measured: a baseline only compares under the same ones
+SIZING = ('async_mode', 'runs', 'clients', 'concurrency', 'uploads', 'upload_mb', 'seed_rows', 'pages',
+          'playback_mb', 'requests')
+
+
+def rss_bytes():
+    """Current resident set size (Linux /proc; 0 elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss_bytes():
+    """Highest resident set size of the process so far (0 where getrusage is missing)."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Recorder:
+    """Latency samples per operation name."""
+
+    def __init__(self):
+        self.samples = {}
+        self.wall = {}
+
+    def time(self, op, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples.setdefault(op, []).append(time.perf_counter() - start)
+        return result
+
+    def summary(self, scenario):
+        rows = {}
+        for op, samples in self.samples.items():
+            samples.sort()
+            wall = self.wall.get(op) or sum(samples)
+            rows[f'{scenario}.{op}'] = {
+                'count': len(samples),
+                'throughput': round(len(samples) / wall, 1) if wall else 0.0,
+                'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+                'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+                'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+            }
+        return rows
+
+
+def setup_environment(workdir):
+    """Point the app at `workdir` before it is imported."""
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(workdir, 'webwatch.db'),
+        'RECORDINGS_DIR': os.path.join(workdir, 'recordings'),
+        'ROOM_STATE_BACKEND': 'memory',
+        'MOTION_ANALYSIS': 'False',
+        # Analysis / thumbnail / index jobs are queued only if these exist
+        'FFMPEG_BIN': 'ffmpeg-disabled-for-benchmark',
+        'FFPROBE_BIN': 'ffprobe-disabled-for-benchmark',
+        'LOG_LEVEL': 'WARNING',
+        'AUTH_REQUIRED': 'True',
+        # Every simulated client comes from 127.0.0.1: the limiter would measure its own 429s
+        'RATE_LIMIT': 'False',
+    })
+    # The legacy upload route and setup_db use paths relative to the cwd
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def login(client):
+    res = client.post('/api/auth/login', json={'username': 'admin', 'password': '123'})
+    return res.get_json()['token']
+
+
+# --- scenarios ---
+
+def bench_signaling(app, socketio, token, clients, concurrency):
+    rec = Recorder()
+    pairs = clients // 2
+
+    def one_pair(i):
+        code = str(100000 + i)
+        camera = rec.time('connect', socketio.test_client, app, auth={'token': token})
+        viewer = rec.time('connect', socketio.test_client, app, auth={'token': token})
+        rec.time('join_room', viewer.emit, 'join_room', {'code': code, 'type': 'viewer'})
+        rec.time('join_room', camera.emit, 'join_room', {'code': code, 'type': 'camera'})
+        sdp = 'v=0\r\n' + 'a=candidate:x\r\n' * 40
+        rec.time('offer', viewer.emit, 'offer', {'room_code': code, 'sdp': sdp, 'type': 'offer'})
+        rec.time('answer', camera.emit, 'answer', {'room_code': code, 'sdp': sdp, 'type': 'answer'})
+        for n in range(5):
+            candidate = {'room_code': code, 'candidate': f'candidate:{n} 1 udp 2122260223 10.0.0.{n} 5000{n} typ host'}
+            rec.time('ice_candidate', camera.emit, 'ice-candidate', candidate)
+            rec.time('ice_candidate', viewer.emit, 'ice-candidate', candidate)
+        camera.get_received()
+        viewer.get_received()
+        rec.time('disconnect', camera.disconnect)
+        rec.time('disconnect', viewer.disconnect)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one_pair, range(pairs)))
+    total = time.perf_counter() - start
+    # Throughput over the whole run (all threads), not per-thread latency sums
+    for op in rec.samples:
+        rec.wall[op] = total
+    return rec
+
+
+def bench_upload(client, token, uploads, size_mb, concurrency):
+    rec = Recorder()
+    headers = {'Authorization': f'Bearer {token}'}
+    payload = os.urandom(size_mb * MB)
+    chunk = 1 * MB
+
+    def unique(data):
+        # Uploads are content-addressed: identical bodies would only be stored once
+        return uuid.uuid4().bytes + data[16:]
+
+    def legacy(i):
+        data = {'video': (io.BytesIO(unique(payload)), 'clip.webm'), 'camera_name': f'Bench Cam {i % 4}'}
+        res = rec.time('legacy_upload', client.post, '/api/upload', data=data, headers=headers,
+                       content_type='multipart/form-data')
+        assert res.status_code == 200, res.status_code
+
+    def session(i):
+        body = unique(payload)
+        res = rec.time('session_open', client.post, '/api/upload/sessions',
+                       json={'camera_name': f'Bench Cam {i % 4}', 'total_size': len(body)}, headers=headers)
+        session_id = res.get_json()['session_id']
+        for offset in range(0, len(body), chunk):
+            res = rec.time('session_chunk', client.put, f'/api/upload/sessions/{session_id}',
+                           data=body[offset:offset + chunk], headers=dict(headers, **{'Upload-Offset': str(offset)}))
+            assert res.status_code == 200, res.status_code
+        res = rec.time('session_commit', client.post, f'/api/upload/sessions/{session_id}/commit', headers=headers)
+        assert res.status_code == 200, res.status_code
+
+    for name, fn in (('legacy_upload', legacy), ('session', session)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(fn, range(uploads)))
+        total = time.perf_counter() - start
+        for op in rec.samples:
+            if op.startswith(name):
+                rec.wall[op] = total
+    mb = uploads * size_mb
+    rec.extra = {
+        'legacy_mb_per_s': round(mb / rec.wall['legacy_upload'], 1),
+        'session_mb_per_s': round(mb / rec.wall['session_chunk'], 1),
+    }
+    return rec
+
+
+def seed_recordings(rows):
+    from services import db
+
+    db.executemany(
+        "INSERT INTO recordings (filename, camera_name, timestamp, size_bytes) "
+        "VALUES (?, ?, datetime('2024-01-01', '+' || ? || ' seconds'), ?)",
+        [(f'seed_{i}.webm', f'Seed Cam {i % 8}', i * 30, 5 * MB) for i in range(rows)],
+    )
+    db.release_connection()
+
+
+def bench_recordings(client, token, pages):
+    rec = Recorder()
+    headers = {'Authorization': f'Bearer {token}'}
+    # Warm SQLite's page cache and the statement cache first
+    for _ in range(20):
+        client.get('/api/recordings?limit=50&count=1', headers=headers)
+    for op, query in (('list_page', ''), ('list_page_camera', '&camera_name=Seed+Cam+3')):
+        cursor = None
+        for _ in range(pages):
+            url = f'/api/recordings?limit=50{query}' + (f'&cursor={cursor}' if cursor else '')
+            res = rec.time(op, client.get, url, headers=headers)
+            assert res.status_code == 200, res.status_code
+            cursor = res.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+    for _ in range(pages // 4 or 1):
+        rec.time('list_count', client.get, '/api/recordings?limit=50&count=1', headers=headers)
+    return rec
+
+
+def bench_playback(client, token, requests, size_mb, recordings_dir):
+    rec = Recorder()
+    filename = 'bench_playback.webm'
+    with open(os.path.join(recordings_dir, filename), 'wb') as f:
+        f.write(os.urandom(size_mb * MB))
+    url = f'/recordings/{filename}?token={token}'
+    size = size_mb * MB
+    for i in range(requests):
+        res = rec.time('full_get', lambda: b''.join(client.get(url).response))
+        start = (i * 7919 * 4096) % (size - MB)
+        res = rec.time('range_seek', lambda: client.get(url, headers={'Range': f'bytes={start}-{start + MB - 1}'}))
+        assert res.status_code == 206, res.status_code
+        b''.join(res.response)
+    res = client.get(url)
+    etag = res.headers['ETag']
+    res.close()
+    for _ in range(requests):
+        res = rec.time('conditional_304', client.get, url, headers={'If-None-Match': etag})
+        assert res.status_code == 304, res.status_code
+    return rec
+
+
+SCENARIOS = {
+    'signaling': lambda app, socketio, client, token, args, config:
+        bench_signaling(app, socketio, token, args.clients, args.concurrency),
+    'upload': lambda app, socketio, client, token, args, config:
+        bench_upload(client, token, args.uploads, args.upload_mb, args.concurrency),
+    'recordings': lambda app, socketio, client, token, args, config:
+        bench_recordings(client, token, args.pages),
+    'playback': lambda app, socketio, client, token, args, config:
+        bench_playback(client, token, args.requests, args.playback_mb, config.RECORDINGS_DIR),
+}
+
+
+# --- reporting ---
+
+def best_of(summaries):
+    """Per operation: lowest latencies and highest throughput over several runs."""
+    best = {}
+    for summary in summaries:
+        for key, row in summary.items():
+            if key not in best:
+                best[key] = dict(row)
+                continue
+            for field in ('p50_ms', 'p99_ms', 'mean_ms'):
+                best[key][field] = min(best[key][field], row[field])
+            best[key]['throughput'] = max(best[key]['throughput'], row['throughput'])
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Print each op next to its baseline; return the list of regressions."""
+    regressions = []
+    print(f"\n{'operation':42} {'count':>7} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9}   vs baseline")
+    for key, row in sorted(results.items()):
+        if not isinstance(row, dict) or 'p99_ms' not in row:
+            continue
+        base = baseline.get(key)
+        note = ''
+        if base:
+            p99_change = (row['p99_ms'] - base['p99_ms']) / base['p99_ms'] if base['p99_ms'] else 0
+            tput_change = (row['throughput'] - base['throughput']) / base['throughput'] if base['throughput'] else 0
+            note = f"p99 {p99_change:+.0%}, ops/s {tput_change:+.0%}"
+            if p99_change > tolerance or tput_change < -tolerance:
+                note += '  << REGRESSION'
+                regressions.append(key)
+        print(f"{key:42} {row['count']:>7} {row['throughput']:>10} {row['p50_ms']:>9} {row['p99_ms']:>9}   {note}")
+    for key, value in sorted(results.items()):
+        if not isinstance(value, dict) or 'p99_ms' not in value:
+            print(f"{key:42} {value}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*', default=['signaling', 'upload', 'recordings', 'playback'])
+    parser.add_argument('--clients', type=int, default=2000, help='simulated socket clients (signaling)')
+    parser.add_argument('--concurrency', type=int, default=8, help='driver threads')
+    parser.add_argument('--uploads', type=int, default=20, help='uploads per upload kind')
+    parser.add_argument('--upload-mb', type=int, default=8, help='size of each uploaded clip')
+    parser.add_argument('--seed-rows', type=int, default=50000, help='recordings rows for the listing scenario')
+    parser.add_argument('--pages', type=int, default=200, help='pages walked per listing query')
+    parser.add_argument('--playback-mb', type=int, default=32, help='size of the served recording')
+    parser.add_argument('--requests', type=int, default=50, help='requests per playback operation')
+    parser.add_argument('--async-mode', default='threading', help='ASYNC_MODE to run the handlers under')
+    parser.add_argument('--runs', type=int, default=3, help='repeat each scenario, keep the best')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p99 / throughput change')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='exit 1 if anything regressed')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    # Read first: a --check against numbers from other sizing is refused before anything runs
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored.get('results', {})
+        changed = [k for k in SIZING if stored.get('args', {}).get(k) != getattr(args, k)]
+        if changed and args.check:
+            parser.error(f"--check: the baseline was recorded with different {', '.join(changed)}; "
+                         f"rerun with the baseline's arguments or --save-baseline")
+        if changed:
+            print(f"[INFO] Baseline was recorded with different {', '.join(changed)}; expect differences")
+
+    workdir = tempfile.mkdtemp(prefix='webwatch-bench-')
+    cwd = os.getcwd()
+    try:
+        setup_environment(workdir)
+        # Green modes patch the standard library, before setup_db / app import it
+        from services import concurrency
+        concurrency.select(args.async_mode)
+        # The app's own [INFO] prints would drown the report
+        with redirect_stdout(io.StringIO()):
+            import setup_db
+            setup_db.init_db()
+            from app import create_app
+            app = create_app()
+            socketio = app.extensions['socketio']
+            from config import Config
+
+            client = app.test_client()
+            token = login(client)
+            results = {}
+            for scenario in args.scenarios:
+                if scenario not in SCENARIOS:
+                    parser.error(f"unknown scenario {scenario}")
+                if scenario == 'recordings':
+                    seed_recordings(args.seed_rows)
+                rss_before = rss_bytes()
+                started = time.perf_counter()
+                # Best of --runs: scheduler noise only ever makes a run slower
+                runs = []
+                for _ in range(args.runs):
+                    rec = SCENARIOS[scenario](app, socketio, client, token, args, Config)
+                    runs.append((rec.summary(scenario), getattr(rec, 'extra', {})))
+                results.update(best_of([summary for summary, _ in runs]))
+                for key in runs[0][1]:
+                    results[f'{scenario}.{key}'] = max(extra[key] for _, extra in runs)
+                results[f'{scenario}.rss_growth_mb'] = round((rss_bytes() - rss_before) / MB, 1)
+                results[f'{scenario}.seconds'] = round(time.perf_counter() - started, 2)
+                print(f"[INFO] {scenario} done in {results[f'{scenario}.seconds']}s", file=sys.stderr)
+            results['peak_rss_mb'] = round(peak_rss_bytes() / MB, 1)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'cpus': os.cpu_count(),
+                       'args': {k: v for k, v in vars(args).items() if k != 'baseline'},
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\n[SUCCESS] Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n[ERROR] {len(regressions)} operation(s) regressed beyond {args.tolerance:.0%}")
+    return 1 if (args.check and regressions) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,16 @@
+import json
 import os
 
+
+def _rate_limits(defaults):
+    """`defaults` with the RATE_LIMITS JSON override on top; a rate of 0 would never refill."""
+    rules = dict(defaults, **json.loads(os.getenv("RATE_LIMITS") or "{}"))
+    for rule, (rate, burst) in rules.items():
+        if not rate > 0 or not burst >= 1:
+            raise ValueError(f"RATE_LIMITS {rule}: rate must be > 0 and burst >= 1, got [{rate}, {burst}]")
+    return rules
+
+
 class Config:
     DEBUG = os.getenv("FLASK_DEBUG", "True") == "True"
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key")
@@ -7,3 +18,190 @@ class Config:
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*")
     # Backend base url for docs (used by frontend team)
     BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:5000")
+
+    # Auth (services/auth.py): signed bearer tokens on every route except login
+    AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "True") == "True"
+    AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", 12 * 60 * 60))  # seconds
+    # werkzeug hash method; cost is tunable, old hashes are upgraded on next login
+    AUTH_PASSWORD_METHOD = os.getenv("AUTH_PASSWORD_METHOD", "scrypt:32768:8:1")
+    AUTH_KDF_WORKERS = int(os.getenv("AUTH_KDF_WORKERS", 2))  # concurrent password hashes
+    AUTH_REVOCATION_CACHE_SIZE = 10000
+    # How stale this process's view of other processes' logouts / password changes may get
+    AUTH_REVOCATION_REFRESH = float(os.getenv("AUTH_REVOCATION_REFRESH", 5))  # seconds
+
+    # /metrics without a token (for a Prometheus scraper on a trusted network)
+    METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "False") == "True"
+
+    # DEBUG logs every relayed signaling message (never SDP bodies)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+    # Storage locations (relative paths are resolved from the backend folder)
+    DATABASE_PATH = os.getenv("DATABASE_PATH", "webwatch.db")
+    RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "recordings")
+
+    # SQLite tuning (see services/db.py)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 16))
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", 5000))
+    DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", 8 * 1024))
+    DB_MMAP_BYTES = int(os.getenv("DB_MMAP_BYTES", 64 * 1024 * 1024))
+    DB_STATEMENT_CACHE = 256
+
+    # Chunked uploads: partial files are kept inside the recordings folder so
+    # that committing a session is a rename on the same filesystem, not a copy
+    UPLOAD_PARTIAL_DIR = os.getenv("UPLOAD_PARTIAL_DIR", os.path.join(RECORDINGS_DIR, ".partial"))
+    UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 2GB per recording
+    UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 60 * 60))  # seconds
+    UPLOAD_COPY_BUFFER = 256 * 1024
+
+    # Room state: "memory" (single process) or "sqlite" (shared by several
+    # worker processes on one host, see services/room_registry.py)
+    ROOM_STATE_BACKEND = os.getenv("ROOM_STATE_BACKEND", "memory")
+    ROOM_STATE_PATH = os.getenv("ROOM_STATE_PATH", "rooms.db")
+    # sqlite backend: workers renew a lease this often (seconds); the rooms of a
+    # worker that missed it for ROOM_WORKER_TTL seconds (crashed) are dropped
+    ROOM_WORKER_HEARTBEAT = float(os.getenv("ROOM_WORKER_HEARTBEAT", 10))
+    ROOM_WORKER_TTL = float(os.getenv("ROOM_WORKER_TTL", 60))
+    # Socket.IO message queue for multi-worker fan-out, e.g. "redis://localhost:6379/0"
+    # (needs the redis or kombu package). Empty = single process, no queue
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE") or None
+    # With several workers only the above is shared: room membership and issued
+    # pairing codes (sqlite backend) and emits (message queue). The rest is per
+    # process: camera presence (services/camera_service.py), rate limit buckets
+    # (services/ratelimit.py, so each worker grants the full rate), snapshot rings
+    # (services/snapshots.py, frames are served by the camera's worker only) and
+    # metrics (/metrics reports the worker that answers)
+
+    # Subsystems create_app() wires in (app.py), comma separated, e.g.
+    # "rooms,signaling" for a signaling-only relay. Requirements are added automatically
+    SUBSYSTEMS = [name.strip() for name in os.getenv("SUBSYSTEMS", "all").split(",") if name.strip()]
+
+    # Serving mode (services/concurrency.py): "auto" (gevent, else eventlet, else
+    # threading), "eventlet", "gevent" or "threading" (one OS thread per client)
+    ASYNC_MODE = os.getenv("ASYNC_MODE", "auto")
+    # OS threads for blocking work (SQLite, fsync, hashing) in the green modes
+    BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", 16))
+    # Connection limits, 0 = unlimited. Refused requests get 503 + Retry-After
+    SOCKETIO_MAX_CONNECTIONS = int(os.getenv("SOCKETIO_MAX_CONNECTIONS", 0))
+    HTTP_MAX_CONCURRENT = int(os.getenv("HTTP_MAX_CONCURRENT", 0))
+    SERVER_MAX_CONNECTIONS = int(os.getenv("SERVER_MAX_CONNECTIONS", 2000))  # open sockets, green modes
+    BUSY_RETRY_AFTER = 1  # seconds
+    # SIGTERM / SIGINT: how long in-flight requests may finish before the server stops
+    SHUTDOWN_GRACE = int(os.getenv("SHUTDOWN_GRACE", 15))
+
+    # Rate limits (services/ratelimit.py): rule -> [tokens per second, burst].
+    # Socket rules are per socket, socket_ip is every socket of one address
+    # together, room_relay everything relayed into one room; HTTP rules are per
+    # address. Override some as JSON, e.g. RATE_LIMITS='{"ice": [100, 200]}'
+    RATE_LIMIT = os.getenv("RATE_LIMIT", "True") == "True"
+    RATE_LIMITS = _rate_limits({
+        'socket_ip': [500, 1000],
+        'room_relay': [200, 400],
+        'signaling': [10, 30],       # offer / answer
+        'ice': [50, 100],
+        'message': [5, 20],
+        'room': [2, 10],             # join_room / leave_room
+        'room_status': [2, 5],
+        'heartbeat': [1, 5],
+        'upload': [2, 10],           # new uploads / upload sessions
+        'upload_chunk': [20, 60],
+        'ingest_chunk': [20, 60],    # streamed MediaRecorder chunks, resends included
+        'ingest_bytes': [1000000, 4000000],  # bytes/s: an 8 Mbit/s camera, 4 s of burst
+        'snapshot_http': [20, 60],   # snapshot reads over HTTP (polls of several rooms together)
+        'login': [0.2, 5],
+    })
+    RATE_LIMIT_EVICT_INTERVAL = 60  # seconds between sweeps of idle buckets
+
+    # Trickle ICE candidates are coalesced for this long for clients that opt in
+    ICE_BATCH_WINDOW_MS = int(os.getenv("ICE_BATCH_WINDOW_MS", 20))
+
+    # Snapshot relay (services/snapshots.py): frames kept per room, largest
+    # accepted frame, fastest accepted push rate per camera, and how long an
+    # MJPEG stream waits for the next frame before it ends
+    SNAPSHOT_RING_SIZE = int(os.getenv("SNAPSHOT_RING_SIZE", 8))
+    SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_BYTES", 512 * 1024))
+    SNAPSHOT_MIN_INTERVAL_MS = int(os.getenv("SNAPSHOT_MIN_INTERVAL_MS", 100))
+    SNAPSHOT_STREAM_IDLE_TIMEOUT = int(os.getenv("SNAPSHOT_STREAM_IDLE_TIMEOUT", 15))
+
+    # Camera presence (services/camera_service.py): phones heartbeat every
+    # INTERVAL seconds and are offline after TIMEOUT seconds of silence; state
+    # is written to the DB every FLUSH_INTERVAL seconds
+    CAMERA_HEARTBEAT_INTERVAL = int(os.getenv("CAMERA_HEARTBEAT_INTERVAL", 10))
+    CAMERA_HEARTBEAT_TIMEOUT = int(os.getenv("CAMERA_HEARTBEAT_TIMEOUT", 30))
+    CAMERA_FLUSH_INTERVAL = float(os.getenv("CAMERA_FLUSH_INTERVAL", 5))
+
+    # Pairing codes that are issued but never used to open a room expire after this
+    PAIRING_CODE_TTL = int(os.getenv("PAIRING_CODE_TTL", 10 * 60))  # seconds
+
+    # /api/recordings page size
+    RECORDINGS_PAGE_SIZE = int(os.getenv("RECORDINGS_PAGE_SIZE", 50))
+    RECORDINGS_MAX_PAGE_SIZE = 500
+
+    # Event log (services/events.py): events are written in batches every
+    # FLUSH_INTERVAL seconds; at most MAX_PENDING wait in memory (more are
+    # dropped and counted). Events older than MAX_AGE_DAYS are pruned, 0 = keep
+    EVENTS_FLUSH_INTERVAL = float(os.getenv("EVENTS_FLUSH_INTERVAL", 1))
+    EVENTS_MAX_PENDING = int(os.getenv("EVENTS_MAX_PENDING", 10000))
+    EVENTS_MAX_AGE_DAYS = int(os.getenv("EVENTS_MAX_AGE_DAYS", 90))
+
+    # External tools used for analysis / thumbnails
+    FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+    FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+
+    # Transcoding ladder for low-bandwidth playback (services/transcode.py; needs
+    # ffmpeg with libvpx-vp9 / libopus). Off by default: every new recording costs
+    # a CPU-only re-encode per rung on the job workers
+    TRANSCODE = os.getenv("TRANSCODE", "False") == "True"
+    # name:height:video_kbps per rung, best first
+    TRANSCODE_LADDER = os.getenv("TRANSCODE_LADDER", "540p:540:1000,360p:360:500,240p:240:250")
+    TRANSCODE_AUDIO_KBPS = 48
+    TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", 2))  # per ffmpeg run
+    TRANSCODE_TIMEOUT = int(os.getenv("TRANSCODE_TIMEOUT", 30 * 60))  # seconds per ffmpeg run
+
+    # Background jobs (services/jobs.py): worker processes and retry policy
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", 5))  # seconds, doubled per attempt
+    JOB_POLL_INTERVAL = 5  # seconds; enqueue() wakes the dispatcher immediately anyway
+
+    # Motion analysis of new recordings (services/motion.py; needs numpy + ffmpeg)
+    MOTION_ANALYSIS = os.getenv("MOTION_ANALYSIS", "True") == "True"
+    MOTION_FPS = 2
+    MOTION_WIDTH = 160
+    MOTION_HEIGHT = 90
+    MOTION_PIXEL_DELTA = 25      # brightness change (0-255) that counts as "changed"
+    MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", 0.02))  # fraction of changed pixels
+    MOTION_MAX_GAP = 2           # quiet seconds bridged inside one interval
+
+    # Thumbnails: size-bounded LRU cache of poster / sprite images
+    THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join(RECORDINGS_DIR, ".cache", "thumbs"))
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    THUMBNAIL_MAX_AGE = 24 * 60 * 60
+    SPRITE_COLUMNS = 10
+    SPRITE_ROWS = 2
+
+    # Streaming ingest over Socket.IO (services/ingest.py)
+    SEGMENTS_DIR = os.getenv("SEGMENTS_DIR", os.path.join(RECORDINGS_DIR, "segments"))
+    INGEST_SEGMENT_SECONDS = int(os.getenv("INGEST_SEGMENT_SECONDS", 6))
+    INGEST_MAX_BUFFER_BYTES = int(os.getenv("INGEST_MAX_BUFFER_BYTES", 8 * 1024 * 1024))  # per camera
+    INGEST_RETRY_AFTER_MS = 250
+    INGEST_FSYNC_INTERVAL = 1.0  # seconds; footage on disk and indexed within this
+    # Socket.IO message size limit (one MediaRecorder chunk must fit)
+    SOCKETIO_MAX_BUFFER = int(os.getenv("SOCKETIO_MAX_BUFFER", 10 * 1000 * 1000))
+
+    # Clip export (services/timeline.py): longest window one request may stitch
+    EXPORT_MAX_SECONDS = int(os.getenv("EXPORT_MAX_SECONDS", 60 * 60))
+
+    # Retention (services/retention.py): 0 = no limit. Oldest recordings go first.
+    # The byte quotas count uploaded recordings only: streamed segments expire by
+    # RETENTION_MAX_AGE_DAYS alone, and renditions are deleted with their recording
+    # but their bytes are not counted, so leave headroom on the disk for both
+    RETENTION_MAX_BYTES = int(os.getenv("RETENTION_MAX_BYTES", 0))  # all cameras together
+    RETENTION_CAMERA_MAX_BYTES = int(os.getenv("RETENTION_CAMERA_MAX_BYTES", 0))  # default per camera
+    # Per-camera overrides as JSON, e.g. '{"Front Door": 10737418240}'
+    RETENTION_CAMERA_QUOTAS = json.loads(os.getenv("RETENTION_CAMERA_QUOTAS") or "{}")
+    RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", 0))
+    RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 10 * 60))  # seconds between passes
+    RETENTION_BATCH_SIZE = 200  # recordings deleted per transaction
+
+    # Playback: how long browsers may reuse a recording before revalidating
+    PLAYBACK_MAX_AGE = int(os.getenv("PLAYBACK_MAX_AGE", 3600))
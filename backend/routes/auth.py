@@ -1,24 +1,56 @@
-import sqlite3
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, g, request, jsonify
 
-auth_bp = Blueprint("auth", __name__)
+from config import Config
+from services import auth
+from services.ratelimit import limit_route
 
-def get_db_connection():
-    conn = sqlite3.connect('webwatch.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+auth_bp = Blueprint("auth", __name__)
 
+# Per address: password guessing gets 429s long before it gets anywhere
 @auth_bp.route("/login", methods=["POST"])
+@limit_route("login")
 def login():
     data = request.json or {}
     username = data.get("username", "")
     password = data.get("password", "")
 
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-    conn.close()
+    # Hash check runs on the auth KDF pool (see services/auth.py)
+    user = auth.authenticate(username, password)
 
-    if user and user['password'] == password:
-        return jsonify({"status": "ok", "message": "Login successful"}), 200
+    if user:
+        return jsonify({
+            "status": "ok",
+            "message": "Login successful",
+            "token": auth.issue_token(user),
+            "expires_in": Config.AUTH_TOKEN_TTL,
+        }), 200
     else:
-        return jsonify({"status": "error", "message": "Invalid credentials"}), 401
\ No newline at end of file
+        return jsonify({"status": "error", "message": "Invalid credentials"}), 401
+
+# Revokes the token used for this request
+@auth_bp.route("/logout", methods=["POST"])
+def logout():
+    if g.user is None:
+        return jsonify({"status": "error", "message": "Not logged in"}), 401
+    auth.revoke(g.user)
+    return jsonify({"status": "ok"}), 200
+
+@auth_bp.route("/me", methods=["GET"])
+def me():
+    if g.user is None:
+        return jsonify({"status": "error", "message": "Not logged in"}), 401
+    return jsonify({"status": "ok", "user_id": g.user["uid"], "username": g.user["u"], "expires_at": g.user["exp"]}), 200
+
+@auth_bp.route("/password", methods=["POST"])
+def change_password():
+    if g.user is None:
+        return jsonify({"status": "error", "message": "Not logged in"}), 401
+    data = request.json or {}
+    if not auth.authenticate(g.user["u"], data.get("current_password", "")):
+        return jsonify({"status": "error", "message": "Invalid credentials"}), 401
+    new_password = data.get("new_password", "")
+    if len(new_password) < 6:
+        return jsonify({"status": "error", "message": "Password must be at least 6 characters"}), 400
+    # Every existing token of the user stops working, this one included
+    user = auth.set_password(g.user["uid"], new_password)
+    return jsonify({"status": "ok", "token": auth.issue_token(user), "expires_in": Config.AUTH_TOKEN_TTL}), 200
@@ -1,16 +1,30 @@
 from flask import Blueprint, jsonify, request
 
+from services.camera_service import registry
+
 camera_bp = Blueprint("camera", __name__)
 
-# Example: register camera (mobile client can POST stream info)
+# Register a camera (mobile client can POST its name and stats); it shows up
+# offline until its first camera_heartbeat (sockets/camera.py)
 @camera_bp.route("/register", methods=["POST"])
 def register_camera():
     body = request.json or {}
-    camera_name = body.get("name")
-    # just echo for now
-    return jsonify({"status": "ok", "camera": camera_name}), 201
+    camera_name = str(body.get("name") or "").strip()
+    if not camera_name:
+        return jsonify({"error": "name required"}), 400
+    camera = registry.register(camera_name[:100], body)
+    return jsonify({"status": "ok", "camera": camera}), 201
 
-# Example: get status
+# Every known camera with its live state; ?online=1 for the online ones only
 @camera_bp.route("/status", methods=["GET"])
 def camera_status():
-    return jsonify({"status": "ok", "message": "no active streams"})
+    online = request.args.get("online")
+    cameras = registry.list(online=online in ("1", "true") if online else None)
+    return jsonify({"status": "ok", "online": registry.online_count(), "cameras": cameras})
+
+@camera_bp.route("/<path:name>", methods=["GET"])
+def get_camera(name):
+    camera = registry.get(name)
+    if camera is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(camera)
@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify
-import random
+
+from config import Config
+from services.code_allocator import CodesExhausted, allocator
 
 code_bp = Blueprint("code", __name__)
 
@@ -8,10 +10,13 @@ code_bp = Blueprint("code", __name__)
 @code_bp.route("/generate", methods=["GET"])
 def generate_code():
     """
-    Generate a random 6-digit code
-    random.randint(100000, 999999) generates number between 100000 and 999999
-    This ensures code is always exactly 6 digits
+    Generate a unique 6-digit pairing code (100000 - 999999)
+    The shared allocator never returns a code that is already issued or
+    used by a live room; unclaimed codes expire after PAIRING_CODE_TTL
     """
-    code = random.randint(100000, 999999)
-    return jsonify({"code": str(code)})
+    try:
+        code = allocator.allocate()
+    except CodesExhausted:
+        return jsonify({"error": "No pairing codes available, try again later", "success": False}), 503
+    return jsonify({"code": code, "success": True, "expires_in": Config.PAIRING_CODE_TTL}), 200
 
@@ -0,0 +1,48 @@
+from flask import Blueprint, jsonify, request, url_for
+
+from config import Config
+from services.events import list_events
+from services.recordings import InvalidQuery
+from services.timeline import parse_epoch
+
+events_bp = Blueprint("events", __name__)
+
+
+# Event log, newest first:
+#    ?kind=motion,upload&camera_name=...&recording_id=...&since=...&until=...
+#    &q=garage night&limit=50&cursor=<X-Next-Cursor>
+# since / until are epoch seconds or ISO 8601; q searches the recordings'
+# camera name, tags and notes and keeps the events of the matching ones
+@events_bp.route("", methods=["GET"])
+def get_events():
+    try:
+        since = parse_epoch(request.args.get("since"))
+        until = parse_epoch(request.args.get("until"))
+        limit = max(1, min(int(request.args.get("limit", Config.RECORDINGS_PAGE_SIZE)),
+                           Config.RECORDINGS_MAX_PAGE_SIZE))
+        recording_id = request.args.get("recording_id")
+        recording_id = int(recording_id) if recording_id else None
+    except ValueError:
+        return jsonify({"error": "since/until must be epoch seconds or ISO 8601, limit and recording_id numbers"}), 400
+    kind = request.args.get("kind")
+    try:
+        rows, next_cursor = list_events(
+            limit,
+            cursor=request.args.get("cursor"),
+            kind=[k for k in kind.split(",") if k] if kind else None,
+            camera_name=request.args.get("camera_name"),
+            recording_id=recording_id,
+            since=since,
+            until=until,
+            q=request.args.get("q"),
+        )
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        args = request.args.to_dict()
+        args.update(cursor=next_cursor, limit=limit)
+        headers["Link"] = f'<{url_for(".get_events", **args)}>; rel="next"'
+    return jsonify(rows), 200, headers
@@ -0,0 +1,33 @@
+from flask import Blueprint, jsonify, request
+
+from services import jobs
+
+jobs_bp = Blueprint("jobs", __name__)
+
+# Background job status (live updates: join the "jobs" socket room with
+# the `subscribe_jobs` event and listen for `job_update`)
+
+@jobs_bp.route("", methods=["GET"])
+def list_jobs():
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    return jsonify(jobs.list_jobs(request.args.get("status"), request.args.get("kind"), limit)), 200
+
+
+@jobs_bp.route("/<int:job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(job), 200
+
+
+@jobs_bp.route("/<int:job_id>/retry", methods=["POST"])
+def retry_job(job_id):
+    if jobs.get_job(job_id) is None:
+        return jsonify({"error": "Not found"}), 404
+    if not jobs.retry(job_id):
+        return jsonify({"error": "Only failed jobs can be retried"}), 409
+    return jsonify(jobs.get_job(job_id)), 200
@@ -1,9 +1,9 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint
 
-login_bp = Blueprint("login", __name__)
+from routes.auth import login as auth_login
 
-# Fake Login API - No logic yet, just returns status
-@login_bp.route("/login", methods=["POST"])
-def login():
-    return jsonify({"status": "ok"})
+login_bp = Blueprint("login", __name__)
 
+# Old path of the login API (it used to be a stub that accepted anyone):
+# same handler, same token response as POST /api/auth/login
+login_bp.add_url_rule("/login", "login", auth_login, methods=["POST"])
@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+
+from services import metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+# Prometheus text format; scrape with a bearer token, or set METRICS_PUBLIC
+@metrics_bp.route("/metrics", methods=["GET"])
+def scrape():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
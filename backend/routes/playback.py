@@ -0,0 +1,60 @@
+import os
+
+from flask import Blueprint, abort, redirect, request, url_for
+from werkzeug.security import safe_join
+
+from config import Config
+from services import renditions
+from services.media import send_media
+
+playback_bp = Blueprint("playback", __name__)
+
+
+def _budget_kbps():
+    """Bitrate budget from ?max_kbps, else the Downlink / Save-Data client hints, else None."""
+    try:
+        return max(0, int(request.args['max_kbps']))
+    except (KeyError, ValueError):
+        pass
+    if request.headers.get('Save-Data', '').lower() == 'on':
+        return 0
+    try:
+        # Downlink is in Mbps
+        return int(float(request.headers['Downlink']) * 1000 * renditions.DOWNLINK_HEADROOM)
+    except (KeyError, ValueError):
+        return None
+
+
+# Play Video: supports Range (single and multi-range), ETag / Last-Modified
+# and conditional GETs, so the dashboard can seek without re-downloading.
+# ?rendition=auto|original|faststart|360p|... or ?max_kbps=N picks a
+# transcoded rendition (services/renditions.py)
+@playback_bp.route("/recordings/<path:filename>", methods=["GET", "HEAD"])
+def serve_video(filename):
+    # Never expose in-progress uploads or other hidden bookkeeping files
+    if any(part.startswith('.') for part in filename.split('/')):
+        abort(404)
+
+    path = safe_join(Config.RECORDINGS_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    wanted = request.args.get('rendition')
+    if wanted is None and 'max_kbps' not in request.args:
+        return send_media(path, max_age=Config.PLAYBACK_MAX_AGE)
+
+    if wanted not in (None, renditions.AUTO, renditions.ORIGINAL) and wanted in renditions.available(path):
+        resp = send_media(renditions.rendition_path(path, wanted), max_age=Config.PLAYBACK_MAX_AGE)
+    elif wanted == renditions.ORIGINAL:
+        resp = send_media(path, max_age=Config.PLAYBACK_MAX_AGE)
+    else:
+        # auto, a budget, or a rendition that isn't there (yet): redirect to a
+        # fixed choice so the range requests that follow all get the same file
+        args = request.args.to_dict()
+        args.pop('max_kbps', None)
+        args['rendition'] = renditions.choose(path, _budget_kbps())
+        resp = redirect(url_for('.serve_video', filename=filename, **args))
+        resp.headers['Cache-Control'] = 'no-store'
+        resp.headers['Vary'] = 'Downlink, Save-Data'
+    resp.headers['Accept-CH'] = 'Downlink, Save-Data'
+    return resp
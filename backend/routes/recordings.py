@@ -0,0 +1,108 @@
+import logging
+import os
+
+from flask import Blueprint, jsonify, request, url_for
+
+from config import Config
+from services import db, renditions, retention
+from services.recordings import InvalidQuery, list_recordings, motion_intervals, update_metadata
+
+recordings_bp = Blueprint("recordings", __name__)
+logger = logging.getLogger(__name__)
+
+
+def _parse_flag(value):
+    if value is None or value == '':
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _recording(row):
+    recording = dict(row)
+    recording['tags'] = row['tags'].split(',') if row['tags'] else []
+    return recording
+
+# Get List of Recordings (one page, newest first)
+#    ?limit=50&cursor=<X-Next-Cursor>&camera_name=...&since=ISO&until=ISO&motion=1&count=1
+#    &q=garage night  (full-text: camera name, tags, notes; every word, prefix match)
+#    Body stays a plain list; the next page cursor and total come back as headers
+@recordings_bp.route('', methods=['GET'])
+def get_recordings():
+    try:
+        limit = int(request.args.get('limit', Config.RECORDINGS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    limit = max(1, min(limit, Config.RECORDINGS_MAX_PAGE_SIZE))
+
+    try:
+        rows, next_cursor, total = list_recordings(
+            limit,
+            cursor=request.args.get('cursor'),
+            camera_name=request.args.get('camera_name'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            motion=_parse_flag(request.args.get('motion')),
+            with_count=request.args.get('count') in ('1', 'true'),
+            q=request.args.get('q'),
+        )
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+
+    headers = {}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+        args = request.args.to_dict()
+        args.update(cursor=next_cursor, limit=limit)
+        args.pop('count', None)
+        headers['Link'] = f'<{url_for(".get_recordings", **args)}>; rel="next"'
+    if total is not None:
+        headers['X-Total-Count'] = str(total)
+    return jsonify([_recording(row) for row in rows]), 200, headers
+
+# Tags and notes (searchable with ?q=): {"tags": ["car", "night"], "notes": "..."}
+@recordings_bp.route('/<int:id>', methods=['PATCH'])
+def update_recording(id):
+    body = request.get_json(silent=True) or {}
+    try:
+        found = update_metadata(id, tags=body.get('tags'), notes=body.get('notes'))
+    except InvalidQuery as e:
+        return jsonify({"error": str(e)}), 400
+    if not found:
+        return jsonify({"error": "Not found"}), 404
+    row = db.query_one("SELECT * FROM recordings WHERE id = ?", (id,))
+    return jsonify(_recording(row)), 200
+
+# Motion intervals detected in one recording (seconds from the start)
+@recordings_bp.route('/<int:id>/motion', methods=['GET'])
+def get_recording_motion(id):
+    if db.query_one("SELECT 1 FROM recordings WHERE id = ?", (id,)) is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify([dict(row) for row in motion_intervals(id)]), 200
+
+# Transcoded renditions of one recording (services/transcode.py), best first;
+# play one with /recordings/<filename>?rendition=<name>
+@recordings_bp.route('/<int:id>/renditions', methods=['GET'])
+def get_recording_renditions(id):
+    row = db.query_one("SELECT filename FROM recordings WHERE id = ?", (id,))
+    if row is None:
+        return jsonify({"error": "Not found"}), 404
+    path = os.path.join(Config.RECORDINGS_DIR, row['filename'])
+    found = renditions.available(path)
+    listed = [dict(info, name=name) for name, info in found.items()]
+    listed.sort(key=lambda info: -(info.get('kbps') or float('inf')))
+    return jsonify({"filename": row['filename'], "renditions": listed}), 200
+
+# 🗑️ DELETE RECORDING
+@recordings_bp.route('/<int:id>', methods=['DELETE'])
+def delete_recording(id):
+    try:
+        # Removes the file, the DB entry (motion intervals cascade), cached
+        # thumbnails, and keeps the retention size index in step
+        if retention.delete_recording(id):
+            return jsonify({"success": True}), 200
+        else:
+            return jsonify({"error": "Not found"}), 404
+
+    except Exception:
+        logger.exception("Deleting recording %s failed", id)
+        return jsonify({"error": "Could not delete the recording"}), 500
@@ -0,0 +1,39 @@
+import os
+
+from flask import Blueprint, abort, jsonify, request
+
+from config import Config
+from services import db
+from services.ingest import list_segments
+from services.timeline import parse_epoch
+from services.media import send_media
+
+segments_bp = Blueprint("segments", __name__)
+
+
+# Time index of streamed footage: ?camera_name=...&since=...&until=...&limit=500
+# Each segment plays on its own (it starts with the stream's init header)
+@segments_bp.route("", methods=["GET"])
+def get_segments():
+    try:
+        since = parse_epoch(request.args.get("since"))
+        until = parse_epoch(request.args.get("until"))
+        limit = max(1, min(int(request.args.get("limit", 500)), 5000))
+    except ValueError:
+        return jsonify({"error": "since/until must be epoch seconds or ISO 8601, limit a number"}), 400
+    rows = list_segments(request.args.get("camera_name"), since, until, limit)
+    return jsonify([dict(row) for row in rows]), 200
+
+
+@segments_bp.route("/<int:segment_id>", methods=["GET", "HEAD"])
+def serve_segment(segment_id):
+    row = db.query_one("SELECT filename, status FROM segments WHERE id = ?", (segment_id,))
+    if row is None:
+        abort(404)
+    path = os.path.join(Config.SEGMENTS_DIR, row["filename"])
+    if not os.path.isfile(path):
+        abort(404)
+    mimetype = "video/mp4" if path.endswith(".mp4") else "video/webm"
+    # The open segment is still growing, so it must always be revalidated
+    max_age = Config.PLAYBACK_MAX_AGE if row["status"] == "closed" else 0
+    return send_media(path, mimetype=mimetype, max_age=max_age)
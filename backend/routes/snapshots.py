@@ -0,0 +1,88 @@
+from flask import Blueprint, Response, jsonify, request
+from werkzeug.http import http_date
+
+from config import Config
+from services import concurrency
+from services.code_allocator import parse_code
+from services.ratelimit import limit_route
+from services.snapshots import MIME_TYPE, SNAPSHOT_BYTES_OUT, relay
+
+snapshots_bp = Blueprint("snapshots", __name__)
+
+BOUNDARY = 'frame'
+
+# Who may read a room's frames: anyone who could join the room as a viewer.
+# join_room lets any authenticated socket in with just the code, so the
+# signed token (checked for every route by services/auth.py) plus the code
+# is the same grant; an HTTP request has no socket id to look up in the
+# registry. These routes are not more exposed than the room itself: with
+# AUTH_REQUIRED off, both are open to whoever has the code. Like join_room,
+# they are rate limited per address, so codes can't be tried in bulk here.
+
+
+def _code(code):
+    parsed = parse_code(code)
+    return str(parsed) if parsed is not None else None
+
+
+# Snapshot feed of a room: whether its camera is pushing, and the frames in the ring
+@snapshots_bp.route("/<code>", methods=["GET"])
+@limit_route("snapshot_http")
+def snapshot_status(code):
+    code = _code(code)
+    if code is None:
+        return jsonify({"error": "Invalid room code"}), 400
+    frames = relay.recent(code)
+    return jsonify({"room_code": code, "active": relay.is_active(code),
+                    "frames": [frame.info() for frame in frames]}), 200
+
+
+# Newest frame; poll with If-None-Match and get 304 until the camera sends a new one
+@snapshots_bp.route("/<code>/latest", methods=["GET", "HEAD"])
+@limit_route("snapshot_http")
+def latest_snapshot(code):
+    code = _code(code)
+    frame = relay.latest(code) if code is not None else None
+    if frame is None:
+        return jsonify({"error": "No snapshot"}), 404
+    headers = {
+        'ETag': f'"{frame.etag}"',
+        'Last-Modified': http_date(frame.timestamp),
+        'Cache-Control': 'no-cache',
+        'X-Snapshot-Seq': str(frame.seq),
+    }
+    if request.if_none_match.contains(frame.etag):
+        return Response(status=304, headers=headers)
+    if request.method == 'HEAD':
+        return Response(status=200, mimetype=MIME_TYPE,
+                        headers=dict(headers, **{'Content-Length': str(len(frame.data))}))
+    SNAPSHOT_BYTES_OUT.inc(len(frame.data), 'http')
+    # The ring's bytes object itself, not a copy
+    return Response(frame.data, mimetype=MIME_TYPE, headers=headers)
+
+
+def _mjpeg(code):
+    seq = 0
+    while not concurrency.draining():
+        # A slow client just gets the newest frame when it is ready again
+        frame = relay.wait(code, seq, Config.SNAPSHOT_STREAM_IDLE_TIMEOUT)
+        if frame is None:
+            # Camera gone, or silent for SNAPSHOT_STREAM_IDLE_TIMEOUT: the <img> reconnects
+            return
+        seq = frame.seq
+        yield (f'--{BOUNDARY}\r\nContent-Type: {MIME_TYPE}\r\n'
+               f'Content-Length: {len(frame.data)}\r\nX-Snapshot-Seq: {seq}\r\n\r\n').encode()
+        yield frame.data
+        yield b'\r\n'
+        SNAPSHOT_BYTES_OUT.inc(len(frame.data), 'mjpeg')
+
+
+# MJPEG stream of the room's frames (multipart/x-mixed-replace), for <img src="...?token=">
+@snapshots_bp.route("/<code>/stream", methods=["GET"])
+@limit_route("snapshot_http")
+def stream_snapshots(code):
+    code = _code(code)
+    if code is None or not relay.is_active(code):
+        return jsonify({"error": "No snapshot feed"}), 404
+    return Response(_mjpeg(code), mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}',
+                    headers={'Cache-Control': 'no-store'}, direct_passthrough=True)
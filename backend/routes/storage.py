@@ -0,0 +1,17 @@
+from flask import Blueprint, jsonify
+
+from services import retention
+
+storage_bp = Blueprint("storage", __name__)
+
+# Disk usage per camera and the retention policy in force
+
+@storage_bp.route("", methods=["GET"])
+def get_usage():
+    return jsonify(retention.usage()), 200
+
+
+# Run a retention pass now instead of waiting for the scheduler
+@storage_bp.route("/retention/run", methods=["POST"])
+def run_retention():
+    return jsonify(retention.run_now()), 200
@@ -0,0 +1,37 @@
+import os
+
+from flask import Blueprint, jsonify, request
+
+from config import Config
+from services import db, thumbnails
+from services.media import send_media
+from services.thumbnails import ThumbnailError
+
+thumbnails_bp = Blueprint("thumbnails", __name__)
+
+# Poster / sprite images for the recordings list. The cache key includes the
+# recording's mtime, so the image can be cached by the browser for a long time
+# and revalidated with ETag (304) after that
+@thumbnails_bp.route("/<int:id>/thumbnail", methods=["GET", "HEAD"])
+def get_thumbnail(id):
+    kind = request.args.get("kind", "poster")
+    if kind not in thumbnails.KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(thumbnails.KINDS)}"}), 400
+
+    row = db.query_one("SELECT filename FROM recordings WHERE id = ?", (id,))
+    if row is None:
+        return jsonify({"error": "Not found"}), 404
+    video_path = os.path.join(Config.RECORDINGS_DIR, row['filename'])
+    if not os.path.isfile(video_path):
+        return jsonify({"error": "Recording file missing"}), 404
+
+    try:
+        path = thumbnails.get_thumbnail(id, video_path, kind)
+    except ThumbnailError as e:
+        return jsonify({"error": str(e)}), 503
+
+    resp = send_media(path, mimetype="image/jpeg", max_age=Config.THUMBNAIL_MAX_AGE)
+    if kind == "sprite":
+        resp.headers["X-Sprite-Columns"] = str(Config.SPRITE_COLUMNS)
+        resp.headers["X-Sprite-Rows"] = str(Config.SPRITE_ROWS)
+    return resp
@@ -0,0 +1,65 @@
+import re
+
+from flask import Blueprint, Response, jsonify, request
+
+from services import timeline
+
+timeline_bp = Blueprint("timeline", __name__)
+
+
+def _window_args():
+    camera_name = request.args.get("camera_name")
+    if not camera_name:
+        raise timeline.TimelineError("camera_name is required")
+    try:
+        start = timeline.parse_epoch(request.args.get("start") or request.args.get("since"))
+        end = timeline.parse_epoch(request.args.get("end") or request.args.get("until"))
+    except ValueError:
+        raise timeline.TimelineError("start/end must be epoch seconds or ISO 8601")
+    if start is None or end is None:
+        raise timeline.TimelineError("start and end are required")
+    return camera_name, start, end
+
+
+@timeline_bp.errorhandler(timeline.TimelineError)
+def handle_timeline_error(e):
+    return jsonify({"error": e.message}), e.status
+
+
+# Files covering a window: ?camera_name=...&start=...&end=... (epoch or ISO 8601)
+@timeline_bp.route("", methods=["GET"])
+def get_timeline():
+    camera_name, start, end = _window_args()
+    return jsonify([
+        {"kind": s["kind"], "id": s["id"], "filename": s["filename"],
+         "start_time": s["start_time"], "end_time": s["end_time"]}
+        for s in timeline.sources(camera_name, start, end)
+    ]), 200
+
+
+# Which file / offset / byte holds ?camera_name=...&at=...
+@timeline_bp.route("/seek", methods=["GET"])
+def seek():
+    camera_name = request.args.get("camera_name")
+    try:
+        at = timeline.parse_epoch(request.args.get("at"))
+    except ValueError:
+        at = None
+    if not camera_name or at is None:
+        return jsonify({"error": "camera_name and at are required"}), 400
+    found = timeline.seek(camera_name, at)
+    if found is None:
+        return jsonify({"error": "No footage at that time"}), 404
+    return jsonify(found), 200
+
+
+# Download ?camera_name=...&start=...&end=... as one .mkv (stream copy, no re-encode)
+@timeline_bp.route("/export", methods=["GET"])
+def export():
+    camera_name, start, end = _window_args()
+    body = timeline.export(camera_name, start, end)
+    safe_name = re.sub(r'[^A-Za-z0-9_-]+', '_', camera_name)
+    return Response(body, mimetype="video/x-matroska", headers={
+        "Content-Disposition": f'attachment; filename="{safe_name}_{int(start)}-{int(end)}.mkv"',
+        "Cache-Control": "no-store",
+    })
@@ -0,0 +1,122 @@
+import os
+
+from flask import Blueprint, jsonify, request
+
+from services import blobs, upload_service
+from services.metrics import UPLOAD_BYTES, UPLOAD_SECONDS
+from services.ratelimit import limit_route
+from services.upload_service import UploadError
+
+upload_bp = Blueprint("upload", __name__)
+
+# Single-request upload and chunked / resumable upload API
+#
+#   POST   /api/upload                        -> whole clip as multipart "video" (short clips),
+#                                                optional header X-Content-SHA256 to verify
+#   POST   /api/upload/sessions               -> open session {camera_name, total_size?, sha256?,
+#                                                started_at?}
+#                                                (200 + the recording if that clip is already stored)
+#   GET    /api/upload/sessions/<id>          -> current offset (resume point)
+#   PUT    /api/upload/sessions/<id>          -> append raw bytes, header Upload-Offset
+#   POST   /api/upload/sessions/<id>/commit   -> finish, file moves into recordings/
+#   DELETE /api/upload/sessions/<id>          -> abort
+#
+# Uploads are stored by content hash (services/blobs.py); saving a clip the
+# camera already uploaded answers with the existing recording, "duplicate": true
+#
+# started_at (epoch seconds, form field or session body) places the clip on the
+# camera's timeline; without it a session uses its first chunk's arrival
+#
+# Rate limited per address (services/ratelimit.py): 429 + Retry-After
+
+
+@upload_bp.errorhandler(UploadError)
+def handle_upload_error(e):
+    body = {"error": e.message}
+    body.update(e.extra)
+    return jsonify(body), e.status
+
+
+@upload_bp.route("", methods=["POST"])
+@limit_route("upload")
+def upload_recording():
+    if 'video' not in request.files:
+        return jsonify({"error": "No video file"}), 400
+
+    file = request.files['video']
+    camera_name = request.form.get('camera_name', 'Unknown Camera')
+
+    if not file:
+        return jsonify({"error": "No video file"}), 400
+
+    declared = request.headers.get("X-Content-SHA256")
+    started_at = upload_service.parse_started_at(request.form.get("started_at"))
+    tmp_path = upload_service.temp_path()
+    try:
+        with UPLOAD_SECONDS.time('legacy'):
+            # Hashed on the way to disk, no second read
+            digest, size = blobs.copy_hashed(file.stream, tmp_path)
+        UPLOAD_BYTES.inc(size, 'legacy')
+        if size == 0:
+            return jsonify({"error": "Empty video file"}), 400
+        if declared and declared.lower() != digest:
+            return jsonify({"error": "Upload does not match the declared sha256", "sha256": digest}), 422
+        result = upload_service.store_upload(tmp_path, digest, size, camera_name, started_at)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return jsonify(dict(result, message="Saved")), 200
+
+
+@upload_bp.route("/sessions", methods=["POST"])
+@limit_route("upload")
+def open_session():
+    body = request.get_json(silent=True) or request.form
+    camera_name = body.get("camera_name", "Unknown Camera")
+    total_size = body.get("total_size")
+    sha256 = body.get("sha256")
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        # Retry of a clip that is already stored: nothing to send
+        existing = upload_service.find_duplicate(sha256, camera_name)
+        if existing is not None:
+            return jsonify({"message": "Saved", "id": existing["id"], "filename": existing["filename"],
+                            "sha256": sha256, "duplicate": True}), 200
+    try:
+        session = upload_service.create_session(camera_name, total_size, sha256, body.get("started_at"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "total_size must be a number"}), 400
+    return jsonify(session), 201
+
+
+@upload_bp.route("/sessions/<session_id>", methods=["GET"])
+def session_status(session_id):
+    session = upload_service.get_session(session_id)
+    return jsonify(session), 200, {"Upload-Offset": str(session["offset"])}
+
+
+@upload_bp.route("/sessions/<session_id>", methods=["PUT", "PATCH"])
+@limit_route("upload_chunk")
+def append_chunk(session_id):
+    offset = request.headers.get("Upload-Offset", request.args.get("offset"))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Upload-Offset header required"}), 400
+
+    # request.stream is the raw body: nothing is parsed or spooled to disk first
+    new_offset = upload_service.append_chunk(session_id, offset, request.stream, request.content_length)
+    return jsonify({"session_id": session_id, "offset": new_offset}), 200, {"Upload-Offset": str(new_offset)}
+
+
+@upload_bp.route("/sessions/<session_id>/commit", methods=["POST"])
+def commit_session(session_id):
+    result = upload_service.commit_session(session_id)
+    return jsonify(dict(result, message="Saved")), 200
+
+
+@upload_bp.route("/sessions/<session_id>", methods=["DELETE"])
+def abort_session(session_id):
+    upload_service.abort_session(session_id)
+    return jsonify({"success": True}), 200
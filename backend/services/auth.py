@@ -0,0 +1,291 @@
+"""
+Password hashing and signed session tokens.
+
+- Passwords are stored as werkzeug hashes (AUTH_PASSWORD_METHOD, scrypt by
+  default; the cost parameters are part of the method string, so raising them
+  only needs a config change: older hashes are upgraded on the next login).
+  The KDF runs through concurrency.blocking() (a real OS thread in the
+  green-thread serving modes, see services/concurrency.py), at most
+  AUTH_KDF_WORKERS at a time, so a burst of logins can never tie up more
+  than that many cores.
+- A successful login returns a token signed with SECRET_KEY (itsdangerous,
+  which ships with Flask). It carries the user id, name, the user's token
+  version and a random jti, and expires after AUTH_TOKEN_TTL.
+- Logout revokes the jti: it is written to revoked_tokens and kept in an
+  in-process LRU (AUTH_REVOCATION_CACHE_SIZE entries). A password change
+  bumps users.token_version, which revokes every token issued before it.
+- Checking a token is an HMAC plus lookups in that in-process cache, no DB
+  round trip. The cache also holds every user's token_version and pulls
+  what other worker processes revoked every AUTH_REVOCATION_REFRESH
+  seconds. So a logout or password change takes effect at once in the
+  process that handled it, and within AUTH_REVOCATION_REFRESH (+1) seconds
+  everywhere else; that is the staleness window. The DB is only consulted
+  per token once the LRU has had to drop entries, or for a token newer
+  than the cached token_version (a password just changed elsewhere).
+
+init_app(app) makes every route except the ones in PUBLIC_PATHS require
+`Authorization: Bearer <token>` (or ?token=... for <video>/<img> URLs) when
+AUTH_REQUIRED is on. Socket.IO clients pass the token in the connect `auth`
+payload ({"token": ...}) or the ?token= query string, checked by
+authenticate_socket() (a sockets/basic.py connect hook).
+"""
+
+import hmac
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import g, jsonify, request, session
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config import Config
+from services import db
+from services.concurrency import blocking
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_PATHS = {'/api/auth/login', '/login'}
+if Config.METRICS_PUBLIC:
+    PUBLIC_PATHS.add('/metrics')
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+_kdf_slots = threading.BoundedSemaphore(Config.AUTH_KDF_WORKERS)
+_serializer = URLSafeTimedSerializer(Config.SECRET_KEY, salt='webwatch-auth-token')
+# Compared against when the user does not exist, so both cases cost the same
+_dummy_hash = None
+
+
+class AuthError(Exception):
+    pass
+
+
+# --- passwords ---
+
+def hash_password(password):
+    return generate_password_hash(password, method=Config.AUTH_PASSWORD_METHOD)
+
+
+def is_hashed(stored):
+    return stored.startswith(HASH_PREFIXES)
+
+
+def needs_rehash(stored):
+    return not is_hashed(stored) or stored.split('$', 1)[0] != Config.AUTH_PASSWORD_METHOD
+
+
+def _check(stored, password):
+    if not is_hashed(stored):
+        # Plaintext left over from before hashing; upgraded after this login
+        return hmac.compare_digest(stored.encode(), password.encode())
+    return check_password_hash(stored, password)
+
+
+def _dummy():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(uuid.uuid4().hex)
+    return _dummy_hash
+
+
+def verify_password(stored, password):
+    """Run the KDF on the auth pool; `stored` may be None (unknown user)."""
+    with _kdf_slots:
+        matches = blocking(_check, stored if stored is not None else _dummy(), password)
+    return matches and stored is not None
+
+
+def _rehash(user_id, password):
+    try:
+        with _kdf_slots:
+            hashed = blocking(hash_password, password)
+        db.execute('UPDATE users SET password = ? WHERE id = ?', (hashed, user_id))
+    except Exception:
+        logger.exception("Password rehash failed for user %s", user_id)
+    finally:
+        db.release_connection()
+
+
+def authenticate(username, password):
+    """Return the user row for valid credentials, else None."""
+    user = db.query_one('SELECT id, username, password, token_version FROM users WHERE username = ?', (username,))
+    if not verify_password(user['password'] if user else None, password):
+        return None
+    if needs_rehash(user['password']):
+        # Off the request path: the response does not wait for the new hash
+        threading.Thread(target=_rehash, args=(user['id'], password), name='rehash', daemon=True).start()
+    return user
+
+
+def set_password(user_id, password):
+    """Change the password and revoke the user's tokens. Returns the user row, for a new token."""
+    with _kdf_slots:
+        hashed = blocking(hash_password, password)
+    db.execute('UPDATE users SET password = ?, token_version = token_version + 1 WHERE id = ?', (hashed, user_id))
+    user = db.query_one('SELECT id, username, token_version FROM users WHERE id = ?', (user_id,))
+    # This process rejects the old tokens right away; the others at their next refresh
+    revocations.set_version(user_id, user['token_version'])
+    return user
+
+
+# --- tokens ---
+
+class RevocationCache:
+    """
+    What this process knows about revoked tokens: an LRU of revoked ids
+    (jti -> expiry) and every user's token_version. Refreshed from the DB
+    every AUTH_REVOCATION_REFRESH seconds by whichever verify comes next,
+    reading only the revocations made since the last refresh.
+    """
+
+    def __init__(self, size, refresh):
+        self.size = size
+        self.refresh_interval = refresh
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}  # user id -> token_version
+        self.loaded = False
+        # True while every unexpired revocation is in memory (nothing evicted yet)
+        self.complete = True
+        self._synced_at = 0.0
+        self._next_refresh = 0.0
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._entries[jti] = expires_at
+            self._entries.move_to_end(jti)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.complete = False
+
+    def contains(self, jti):
+        with self._lock:
+            if jti in self._entries:
+                self._entries.move_to_end(jti)
+                return True
+            return False
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id)
+
+    def set_version(self, user_id, version):
+        with self._lock:
+            self._versions[user_id] = version
+
+    def refresh(self):
+        """Pull the revocations and password changes of other processes, if a refresh is due."""
+        if time.monotonic() < self._next_refresh:
+            return
+        with self._refresh_lock:
+            if time.monotonic() < self._next_refresh:
+                return  # another thread just did it
+            now = time.time()
+            if not self.loaded:
+                db.execute('DELETE FROM revoked_tokens WHERE expires_at < ?', (now,))
+                rows = db.query('SELECT jti, expires_at FROM revoked_tokens ORDER BY expires_at')
+            else:
+                # A second of slack for revocations whose transaction committed late
+                rows = db.query('SELECT jti, expires_at FROM revoked_tokens WHERE revoked_at >= ? '
+                                'ORDER BY expires_at', (self._synced_at - 1,))
+            for row in rows:
+                self.add(row['jti'], row['expires_at'])
+            versions = {row['id']: row['token_version'] for row in db.query('SELECT id, token_version FROM users')}
+            with self._lock:
+                self._versions = versions
+            self._synced_at = now
+            self.loaded = True
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+
+revocations = RevocationCache(Config.AUTH_REVOCATION_CACHE_SIZE, Config.AUTH_REVOCATION_REFRESH)
+
+
+def issue_token(user):
+    return _serializer.dumps({'uid': user['id'], 'u': user['username'], 'v': user['token_version'],
+                              'jti': uuid.uuid4().hex})
+
+
+def _token_version(user_id, claimed):
+    """The user's current token_version, from the cache unless the token is newer than it."""
+    version = revocations.version(user_id)
+    if version is None or claimed > version:
+        # New user, or a password change in another process since the last refresh
+        row = db.query_one('SELECT token_version FROM users WHERE id = ?', (user_id,))
+        if row is None:
+            return None
+        version = row['token_version']
+        revocations.set_version(user_id, version)
+    return version
+
+
+def verify_token(token):
+    """Return the token's claims, or raise AuthError."""
+    if not token:
+        raise AuthError("Missing token")
+    try:
+        claims, issued_at = _serializer.loads(token, max_age=Config.AUTH_TOKEN_TTL, return_timestamp=True)
+    except SignatureExpired:
+        raise AuthError("Token expired")
+    except BadSignature:
+        raise AuthError("Invalid token")
+    jti = claims.get('jti')
+    revocations.refresh()
+    if revocations.contains(jti):
+        raise AuthError("Token revoked")
+    if not revocations.complete and db.query_one('SELECT 1 FROM revoked_tokens WHERE jti = ?', (jti,)):
+        raise AuthError("Token revoked")
+    claimed = claims.get('v', 0)
+    if _token_version(claims.get('uid'), claimed) != claimed:
+        raise AuthError("Token revoked")
+    claims['exp'] = issued_at.timestamp() + Config.AUTH_TOKEN_TTL
+    return claims
+
+
+def revoke(claims):
+    db.execute('INSERT OR IGNORE INTO revoked_tokens (jti, expires_at, revoked_at) VALUES (?, ?, ?)',
+               (claims['jti'], claims['exp'], time.time()))
+    revocations.add(claims['jti'], claims['exp'])
+
+
+def token_from_request(auth=None):
+    """Bearer header, then ?token=, then (Socket.IO) the connect auth payload."""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    if request.args.get('token'):
+        return request.args['token']
+    if isinstance(auth, dict):
+        return auth.get('token')
+    return None
+
+
+def authenticate_socket(auth_data=None):
+    """Socket.IO connect: same signed token as the HTTP routes, claims kept in the socket session."""
+    if not Config.AUTH_REQUIRED:
+        return
+    try:
+        session['user'] = verify_token(token_from_request(auth_data))
+    except AuthError as e:
+        raise ConnectionRefusedError(str(e))
+
+
+def init_app(app):
+    @app.before_request
+    def require_token():
+        g.user = None
+        if request.method == 'OPTIONS' or request.path in PUBLIC_PATHS:
+            return None
+        token = token_from_request()
+        if token is None and not Config.AUTH_REQUIRED:
+            return None
+        try:
+            g.user = verify_token(token)
+        except AuthError as e:
+            if not Config.AUTH_REQUIRED:
+                return None
+            return jsonify({"error": str(e)}), 401, {'WWW-Authenticate': 'Bearer'}
+        return None
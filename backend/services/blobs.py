@@ -0,0 +1,124 @@
+"""
+Content-addressed storage for recordings.
+
+Uploads are hashed (SHA-256) while they stream in and stored once per
+content, at RECORDINGS_DIR/blobs/<first 2 hex>/<sha256>.webm. The `blobs`
+table (setup_db.py) is the hash index: hash -> filename, size, and the
+number of recordings rows that reference it. recordings.blob_hash points at
+the blob and recordings.filename is the blob's path relative to
+RECORDINGS_DIR, so playback, thumbnails and analysis read it like any other
+recording.
+
+- Same content from the same camera (a phone retrying after a timeout): no
+  new row, the existing recording is returned (upload_service.store_upload).
+  A client that sends the hash when it opens an upload session doesn't even
+  send the bytes again.
+- Same content from another camera: a new row on the same blob (refcount + 1).
+- Deleting or evicting a recording decrements the refcount; the file is
+  unlinked only when nothing references it any more.
+
+Recordings stored before this (rec_<timestamp>.webm, blob_hash NULL) own
+their file outright and are deleted as before.
+
+References are added and dropped under `lock`, file placement / unlinking
+included, so a blob that is being removed is never re-referenced halfway.
+The UNIQUE (blob_hash, camera_name) index keeps retries idempotent across
+worker processes too.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+from config import Config
+from services import db
+
+BLOB_DIR = 'blobs'
+BLOB_EXT = '.webm'
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+lock = threading.Lock()
+
+
+def new_hasher():
+    return hashlib.sha256()
+
+
+def is_digest(value):
+    return isinstance(value, str) and bool(_DIGEST_RE.match(value))
+
+
+def blob_filename(digest):
+    """Path of a blob relative to RECORDINGS_DIR (also its /recordings/<filename> URL)."""
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}{BLOB_EXT}'
+
+
+def hash_file(path):
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(Config.UPLOAD_COPY_BUFFER)
+            if not block:
+                return hasher.hexdigest()
+            hasher.update(block)
+
+
+def copy_hashed(stream, dest_path):
+    """Copy `stream` into a new file at `dest_path`, hashing on the way. Returns (digest, size)."""
+    hasher = new_hasher()
+    size = 0
+    with open(dest_path, 'wb') as f:
+        while True:
+            block = stream.read(Config.UPLOAD_COPY_BUFFER)
+            if not block:
+                break
+            f.write(block)
+            hasher.update(block)
+            size += len(block)
+    return hasher.hexdigest(), size
+
+
+def find(digest):
+    return db.query_one('SELECT hash, filename, size_bytes, refcount FROM blobs WHERE hash = ?', (digest,))
+
+
+def add_reference(digest, size, tmp_path):
+    """
+    Reference blob `digest`, creating it from the file at `tmp_path` if it is
+    new (otherwise that file is dropped). Call under `lock` inside a
+    db.transaction(). Returns the blob's filename.
+    """
+    filename = blob_filename(digest)
+    db.execute(
+        'INSERT INTO blobs (hash, filename, size_bytes, refcount, created_at) VALUES (?, ?, ?, 1, ?) '
+        'ON CONFLICT (hash) DO UPDATE SET refcount = refcount + 1',
+        (digest, filename, size, time.time()),
+    )
+    path = os.path.join(Config.RECORDINGS_DIR, filename)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return filename
+
+
+def release(digests):
+    """
+    Drop one reference per entry of `digests` (a blob may appear several
+    times). Call under `lock` inside a db.transaction(). Returns the paths of
+    blobs nothing references any more; their rows are gone, the caller
+    unlinks the files before releasing `lock`.
+    """
+    if not digests:
+        return []
+    db.executemany('UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?', [(d,) for d in digests])
+    unique = sorted(set(digests))
+    placeholders = ','.join('?' * len(unique))
+    rows = db.query(f'SELECT hash, filename FROM blobs WHERE hash IN ({placeholders}) AND refcount <= 0', unique)
+    if rows:
+        db.executemany('DELETE FROM blobs WHERE hash = ?', [(row['hash'],) for row in rows])
+    return [os.path.join(Config.RECORDINGS_DIR, row['filename']) for row in rows]
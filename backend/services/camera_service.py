@@ -1,4 +1,299 @@
-# implement camera logic here: save stream info, recording, etc.
-def save_camera_info(data):
-    # stub for future
-    return True
+"""
+Live camera registry: which cameras are online, which room they are in,
+whether they record, and the battery / bitrate stats their phones report.
+
+Cameras are identified by name (the camera_name recordings and segments
+use). A phone sends a `camera_heartbeat` every CAMERA_HEARTBEAT_INTERVAL
+seconds (sockets/camera.py); one that stays silent for CAMERA_HEARTBEAT_TIMEOUT
+seconds, or whose socket disconnects, is offline.
+
+State is kept in memory. A heartbeat is a dict update under one lock with no
+DB write: the camera is marked dirty, and a background thread writes all
+dirty cameras to the `cameras` table (setup_db.py) every
+CAMERA_FLUSH_INTERVAL seconds in one transaction. The table holds the
+registered cameras and their last known state across restarts.
+
+Expiry: heartbeat deadlines are kept in an OrderedDict in deadline order (the
+timeout is fixed, so a heartbeat moves its camera to the end). Expiring pops
+from the front until a deadline lies in the future: O(expired cameras), not
+O(cameras). It runs on every heartbeat and on every flush.
+
+Dashboards join Socket.IO room "cameras" (`subscribe_cameras`) and get a
+`camera_update` with the camera's state whenever it changes. Online /
+offline, room and recording changes go out at once; stats-only changes go
+out at the next flush, so stats cost at most one push per camera per
+CAMERA_FLUSH_INTERVAL.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+from services import db
+from services.metrics import gauge
+from services.room_registry import registry as rooms
+
+logger = logging.getLogger(__name__)
+
+CAMERAS_ROOM = 'cameras'
+
+# Stats a phone may report, and their types; anything else is dropped so a
+# heartbeat cannot grow the registry
+STAT_FIELDS = {
+    'battery': (int, float),     # percent
+    'charging': (bool,),
+    'bitrate': (int, float),     # bits per second
+    'fps': (int, float),
+    'resolution': (str,),        # "1280x720"
+    'network': (str,),           # "wifi", "4g", ...
+}
+MAX_STAT_LENGTH = 32
+
+
+def clean_stats(data):
+    """The known stats in `data`, type-checked."""
+    stats = {}
+    for key, types in STAT_FIELDS.items():
+        value = data.get(key)
+        if value is None:
+            continue
+        # bool is an int: only accept it where a bool is expected
+        if isinstance(value, bool) and bool not in types:
+            continue
+        if not isinstance(value, types):
+            continue
+        if isinstance(value, str):
+            value = value[:MAX_STAT_LENGTH]
+        stats[key] = value
+    return stats
+
+
+class CameraRegistry:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.socketio = None  # set by register_camera_events(); None = no pushes
+        self._lock = threading.Lock()
+        self._cameras = {}               # name -> state
+        self._sids = {}                  # socket id -> name
+        self._deadlines = OrderedDict()  # name -> heartbeat deadline (monotonic), oldest first
+        self._dirty = set()              # names to write at the next flush
+        self._stats_changed = set()      # names with a stats push pending
+
+    def _state(self, name):
+        state = self._cameras.get(name)
+        if state is None:
+            state = self._cameras[name] = {
+                'name': name, 'online': False, 'socket_id': None, 'room_code': None,
+                'recording': False, 'last_heartbeat': None, 'stats': {},
+                'registered_at': time.time(),
+            }
+        return state
+
+    @staticmethod
+    def _snapshot(state):
+        return dict(state, stats=dict(state['stats']))
+
+    def _go_offline(self, state):
+        self._sids.pop(state['socket_id'], None)
+        state.update(online=False, socket_id=None, room_code=None, recording=False)
+        self._deadlines.pop(state['name'], None)
+        self._stats_changed.discard(state['name'])
+        self._dirty.add(state['name'])
+
+    def _expire(self, now):
+        # Deadlines are in order, so stop at the first one still in the future
+        expired = []
+        while self._deadlines:
+            name, deadline = next(iter(self._deadlines.items()))
+            if deadline > now:
+                break
+            state = self._cameras[name]
+            self._go_offline(state)
+            expired.append(self._snapshot(state))
+        return expired
+
+    def _publish(self, states):
+        if self.socketio is None:
+            return
+        for state in states:
+            self.socketio.emit('camera_update', state, room=CAMERAS_ROOM)
+
+    def register(self, name, stats=None):
+        """Add a camera (or update its stats) without marking it online. Returns its state."""
+        with self._lock:
+            state = self._state(name)
+            state['stats'].update(clean_stats(stats or {}))
+            self._dirty.add(name)
+            return self._snapshot(state)
+
+    def heartbeat(self, sid, name, room_code=None, recording=None, stats=None):
+        """Mark `name` online on socket `sid` until the next deadline. Returns its state."""
+        if room_code is None:
+            # The room this socket joined as a camera (sockets/rooms.py)
+            room_code = next((code for code in sorted(rooms.rooms_of(sid))
+                              if rooms.role_of(code, sid) == 'camera'), None)
+        stats = clean_stats(stats or {})
+        with self._lock:
+            publish = self._expire(time.monotonic())
+            state = self._state(name)
+            other = self._sids.get(sid)
+            if other is not None and other != name:
+                # The phone was renamed: the old name is offline now
+                self._go_offline(self._cameras[other])
+                publish.append(self._snapshot(self._cameras[other]))
+            if state['socket_id'] not in (None, sid):
+                self._sids.pop(state['socket_id'], None)
+            changed = (not state['online'] or state['socket_id'] != sid or state['room_code'] != room_code
+                       or (recording is not None and bool(recording) != state['recording']))
+            state.update(online=True, socket_id=sid, room_code=room_code, last_heartbeat=time.time())
+            if recording is not None:
+                state['recording'] = bool(recording)
+            if any(state['stats'].get(key) != value for key, value in stats.items()):
+                state['stats'].update(stats)
+                if not changed:
+                    self._stats_changed.add(name)
+            self._sids[sid] = name
+            self._deadlines[name] = time.monotonic() + self.timeout
+            self._deadlines.move_to_end(name)
+            self._dirty.add(name)
+            snapshot = self._snapshot(state)
+            if changed:
+                self._stats_changed.discard(name)
+                publish.append(snapshot)
+        self._publish(publish)
+        return snapshot
+
+    def disconnected(self, sid):
+        """Socket `sid` went away: its camera is offline at once (disconnect hook)."""
+        with self._lock:
+            name = self._sids.get(sid)
+            if name is None:
+                return
+            state = self._cameras[name]
+            self._go_offline(state)
+            snapshot = self._snapshot(state)
+        self._publish([snapshot])
+
+    def expire(self):
+        with self._lock:
+            expired = self._expire(time.monotonic())
+        self._publish(expired)
+        return len(expired)
+
+    def get(self, name):
+        with self._lock:
+            state = self._cameras.get(name)
+            return self._snapshot(state) if state else None
+
+    def list(self, online=None):
+        with self._lock:
+            return [self._snapshot(state) for name, state in sorted(self._cameras.items())
+                    if online is None or state['online'] == online]
+
+    def online_count(self):
+        with self._lock:
+            return len(self._deadlines)
+
+    def offline_all(self):
+        """Mark every camera offline (shutdown); written at the next flush."""
+        with self._lock:
+            for state in self._cameras.values():
+                if state['online']:
+                    self._go_offline(state)
+
+    def load(self):
+        """Read the registered cameras from the DB, all offline (heartbeats don't survive a restart)."""
+        rows = db.query('SELECT name, stats, last_heartbeat, registered_at FROM cameras')
+        db.execute('UPDATE cameras SET online = 0, room_code = NULL, recording = 0 WHERE online = 1')
+        with self._lock:
+            for row in rows:
+                state = self._state(row['name'])
+                state.update(stats=json.loads(row['stats']) if row['stats'] else {},
+                             last_heartbeat=row['last_heartbeat'], registered_at=row['registered_at'])
+        return len(rows)
+
+    def flush(self):
+        """Write the dirty cameras in one transaction and push pending stats changes."""
+        with self._lock:
+            publish = self._expire(time.monotonic())
+            publish += [self._snapshot(self._cameras[name]) for name in self._stats_changed]
+            self._stats_changed.clear()
+            now = time.time()
+            rows = [(state['name'], int(state['online']), state['room_code'], int(state['recording']),
+                     state['last_heartbeat'], json.dumps(state['stats']), state['registered_at'], now)
+                    for state in map(self._cameras.get, self._dirty)]
+            self._dirty.clear()
+        self._publish(publish)
+        if rows:
+            try:
+                db.executemany(
+                    'INSERT INTO cameras (name, online, room_code, recording, last_heartbeat, stats, '
+                    'registered_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET online = excluded.online, room_code = excluded.room_code, '
+                    'recording = excluded.recording, last_heartbeat = excluded.last_heartbeat, '
+                    'stats = excluded.stats, updated_at = excluded.updated_at',
+                    rows)
+            except Exception:
+                # Written again at the next flush
+                with self._lock:
+                    self._dirty.update(row[0] for row in rows)
+                raise
+        return len(rows)
+
+
+class Flusher:
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='camera-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop:
+            self._wake.wait(self.interval)
+            try:
+                registry.flush()
+            except Exception:
+                logger.exception("Camera state flush failed")
+            finally:
+                db.release_connection()
+
+
+registry = CameraRegistry(Config.CAMERA_HEARTBEAT_TIMEOUT)
+gauge('webwatch_cameras_online', 'Cameras with a live heartbeat', fn=registry.online_count)
+
+_flusher = None
+
+
+def start():
+    global _flusher
+    if _flusher is None:
+        loaded = registry.load()
+        db.release_connection()
+        _flusher = Flusher(Config.CAMERA_FLUSH_INTERVAL)
+        _flusher.start()
+        logger.info("Camera registry started (%d registered camera(s))", loaded)
+    return _flusher
+
+
+def stop():
+    """Stop the flusher; every camera is written offline one last time."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.stop()
+        _flusher = None
+    registry.offline_all()
+    registry.flush()
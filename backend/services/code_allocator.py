@@ -0,0 +1,170 @@
+"""
+Pairing code allocator.
+
+Hands out 6-digit room codes that are guaranteed not to clash with a code
+that is already issued or in use by a live room.
+
+- Never-issued codes are drawn from a lazily built random permutation of the
+  whole 100000-999999 space (sparse Fisher-Yates: only displaced slots are
+  stored), so a draw is O(1) no matter how many codes are taken.
+- Codes come back into a free pool when their room closes, or when an issued
+  code is never claimed within PAIRING_CODE_TTL seconds.
+- Each draw picks uniformly from "fresh + pooled", so codes stay unguessable.
+
+Lifecycle:  allocate() -> pending --claim()--> live --release()--> pool
+                              \\--- TTL expiry ---------------------> pool
+
+With the sqlite room backend every worker has its own allocator, so a drawn
+code is also reserved in the shared room store (`shared`, see
+SqliteRoomStore.reserve_code) before it is handed out. A code another worker
+has issued, or whose room is open there, is put back in the pool and
+another one is drawn.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+class CodesExhausted(Exception):
+    pass
+
+
+# Draws that clash with another worker's codes before allocate() gives up
+MAX_SHARED_CLASHES = 100
+
+
+def parse_code(value, low=100000, high=999999):
+    """Return the int code for a 6-digit string/int, or None if it is not one."""
+    value = str(value).strip()
+    if len(value) != 6 or not value.isdigit():
+        return None
+    code = int(value)
+    return code if low <= code <= high else None
+
+
+class CodeAllocator:
+    def __init__(self, low=100000, high=999999, ttl=600):
+        self.low = low
+        self.high = high
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        self._fresh = high - low + 1   # codes never handed out yet
+        self._swap = {}                # sparse permutation: slot -> offset
+        self._pool = []                # released codes (list for O(1) random pop)
+        self._pooled = set()
+        self._pending = OrderedDict()  # issued, not claimed yet: code -> expires_at (oldest first)
+        self._live = set()             # codes with a live room
+        self.shared = None             # cross-process reservations (sqlite room store), if any
+
+    def _draw_fresh(self):
+        i = secrets.randbelow(self._fresh)
+        last = self._fresh - 1
+        offset = self._swap.pop(i, i)
+        if i != last:
+            self._swap[i] = self._swap.pop(last, last)
+        self._fresh -= 1
+        return self.low + offset
+
+    def _draw_pooled(self):
+        i = secrets.randbelow(len(self._pool))
+        self._pool[i], self._pool[-1] = self._pool[-1], self._pool[i]
+        code = self._pool.pop()
+        self._pooled.discard(code)
+        return code
+
+    def _to_pool(self, code):
+        if code not in self._pooled:
+            self._pool.append(code)
+            self._pooled.add(code)
+
+    def _expire(self, now):
+        # TTL is fixed, so the oldest pending code is always first
+        while self._pending:
+            code, expires_at = next(iter(self._pending.items()))
+            if expires_at > now:
+                break
+            self._pending.popitem(last=False)
+            self._to_pool(code)
+
+    def allocate(self):
+        """Return a new unique code as a 6-digit string."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            clashes = 0
+            while True:
+                available = self._fresh + len(self._pool)
+                if available == 0:
+                    raise CodesExhausted("No pairing codes left")
+                if secrets.randbelow(available) < self._fresh:
+                    code = self._draw_fresh()
+                else:
+                    code = self._draw_pooled()
+                # A room may have been opened with this code without allocate()
+                # (e.g. from before a restart); it re-enters the pool on release()
+                if code in self._live or code in self._pending:
+                    continue
+                if self.shared is not None and not self.shared.reserve_code(str(code), self.ttl):
+                    # Taken by another worker; it may be free again later
+                    self._to_pool(code)
+                    clashes += 1
+                    if clashes >= MAX_SHARED_CLASHES:
+                        raise CodesExhausted("No pairing codes left")
+                    continue
+                self._pending[code] = now + self.ttl
+                return str(code)
+
+    def claim(self, value):
+        """Mark a code as in use by a live room (called when the room is created)."""
+        code = parse_code(value, self.low, self.high)
+        if code is None:
+            return
+        with self._lock:
+            self._expire(time.monotonic())
+            self._pending.pop(code, None)
+            self._live.add(code)
+        if self.shared is not None:
+            # The room's member rows hold the code from now on
+            self.shared.claim_code(str(code))
+
+    def release(self, value):
+        """The room for this code closed: recycle the code."""
+        code = parse_code(value, self.low, self.high)
+        if code is None:
+            return
+        with self._lock:
+            if code in self._live:
+                self._live.discard(code)
+                self._to_pool(code)
+
+    def is_live(self, value):
+        code = parse_code(value, self.low, self.high)
+        with self._lock:
+            return code in self._live
+
+    def is_issued(self, value):
+        """True while the code is pending (handed out, not expired) or has a live room."""
+        code = parse_code(value, self.low, self.high)
+        with self._lock:
+            self._expire(time.monotonic())
+            if code in self._pending or code in self._live:
+                return True
+        return code is not None and self.shared is not None and self.shared.code_issued(str(code))
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                'live': len(self._live),
+                'pending': len(self._pending),
+                'available': self._fresh + len(self._pool),
+            }
+
+
+# Shared instance used by the code routes and the room registry
+allocator = CodeAllocator(ttl=Config.PAIRING_CODE_TTL)
@@ -0,0 +1,223 @@
+"""
+Serving mode, blocking-work executor, connection limits and graceful shutdown.
+
+ASYNC_MODE picks how connections are served:
+
+- "threading": werkzeug's threaded server, one OS thread per HTTP request
+  and per Socket.IO client. The original mode, and the fallback.
+- "eventlet" / "gevent": green threads. A handful of OS threads multiplex
+  every long-poll and websocket client, so hundreds of cameras and viewers
+  cost a few KB each instead of a thread stack each.
+- "auto": gevent, else eventlet, else threading (whichever is installed;
+  gevent is in requirements.txt, eventlet is in maintenance mode upstream).
+
+select() has to run before anything else imports socket or threading (it is
+the first thing app.py does): it monkey-patches the standard library, so the
+existing locks, Events, background threads and subprocess calls cooperate
+with the green scheduler unchanged.
+
+Green threads only switch on I/O they know about. Work that blocks the whole
+process (SQLite statements, fsync, unlinking large files, password hashing)
+goes through blocking(), which runs it on a bounded pool of real OS threads
+(BLOCKING_WORKERS) while the calling green thread waits. In threading mode
+blocking() is a plain call: the caller already is an OS thread.
+
+Limits (0 = unlimited): SOCKETIO_MAX_CONNECTIONS connected Socket.IO clients
+and HTTP_MAX_CONCURRENT in-flight HTTP requests. Beyond them a connection is
+refused and a request gets 503 + Retry-After. SERVER_MAX_CONNECTIONS caps the
+open sockets of the green servers.
+
+On SIGTERM / SIGINT the server drains: new requests and connections are
+refused, in-flight requests get up to SHUTDOWN_GRACE seconds, clients get a
+"server_shutdown" event and are disconnected (their disconnect handlers run),
+then socketio.run() returns so the caller can flush and close. A second
+signal stops at once.
+"""
+
+import importlib.util
+import logging
+import signal
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MODES = ('threading', 'eventlet', 'gevent')
+
+mode = None
+_offload = None  # fn(callable, *args, **kwargs) running it on the OS thread pool
+_draining = False
+
+
+def _available(name):
+    return importlib.util.find_spec(name) is not None
+
+
+def select(requested=None):
+    """Choose the serving mode and patch the standard library for it. Idempotent; returns the mode."""
+    global mode, _offload
+    if mode is not None:
+        return mode
+    requested = (requested or Config.ASYNC_MODE).lower()
+    if requested not in MODES + ('auto',):
+        raise ValueError(f"Unknown ASYNC_MODE {requested!r}, expected auto, {', '.join(MODES)}")
+    if requested == 'auto':
+        chosen = next((name for name in ('gevent', 'eventlet') if _available(name)), 'threading')
+    elif requested != 'threading' and not _available(requested):
+        # Logging is not configured yet this early; app.py reports the fallback
+        chosen = 'threading'
+    else:
+        chosen = requested
+
+    if chosen == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+        from eventlet import tpool
+        tpool.set_num_threads(Config.BLOCKING_WORKERS)
+        tpool.QUIET = True  # exceptions are re-raised in the caller, no need to print them too
+        _offload = tpool.execute
+    elif chosen == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+        from gevent.threadpool import ThreadPool
+        pool = ThreadPool(Config.BLOCKING_WORKERS)
+        _offload = lambda fn, *args, **kwargs: pool.apply(fn, args, kwargs)  # noqa: E731
+    mode = chosen
+    return mode
+
+
+def blocking(fn, *args, **kwargs):
+    """Run `fn` where it cannot stall other clients, and return its result (exceptions propagate)."""
+    if _offload is None:
+        return fn(*args, **kwargs)
+    return _offload(fn, *args, **kwargs)
+
+
+def server_options(certfile, keyfile):
+    """Keyword arguments for socketio.run() in the selected mode."""
+    if mode in (None, 'threading'):
+        # Threading is a supported mode now, not only a dev server
+        return {'ssl_context': (certfile, keyfile), 'allow_unsafe_werkzeug': True}
+    options = {'certfile': certfile, 'keyfile': keyfile}
+    if mode == 'eventlet':
+        options['max_size'] = Config.SERVER_MAX_CONNECTIONS
+    else:
+        from gevent.pool import Pool
+        options['spawn'] = Pool(Config.SERVER_MAX_CONNECTIONS)
+    return options
+
+
+# --- limits ---
+
+class Limiter:
+    """Counts active connections / requests against a cap (0 = unlimited)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot. False when full or while shutting down."""
+        with self._lock:
+            if _draining or (self.limit and self.active >= self.limit):
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+sockets = Limiter(Config.SOCKETIO_MAX_CONNECTIONS)
+http_requests = Limiter(Config.HTTP_MAX_CONCURRENT)
+
+
+def draining():
+    return _draining
+
+
+def init_app(app):
+    """Refuse HTTP requests beyond HTTP_MAX_CONCURRENT, and all new ones while shutting down."""
+    from flask import g, jsonify
+
+    @app.before_request
+    def limit_requests():
+        if not http_requests.acquire():
+            message = "Server is shutting down" if _draining else "Server busy, try again shortly"
+            return jsonify({"error": message}), 503, {'Retry-After': str(Config.BUSY_RETRY_AFTER)}
+        g.request_slot = True
+        return None
+
+    @app.teardown_request
+    def release_request(exc=None):
+        if g.pop('request_slot', False):
+            http_requests.release()
+
+
+# --- shutdown ---
+
+def _drain(socketio, grace):
+    global _draining
+    _draining = True
+    logger.info("Shutting down: %d request(s) in flight, %d socket(s) connected",
+                http_requests.active, sockets.active)
+    deadline = time.monotonic() + grace
+    while http_requests.active and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if http_requests.active:
+        logger.warning("%d request(s) still running after %ss", http_requests.active, grace)
+    socketio.emit('server_shutdown', {'retry_after': Config.BUSY_RETRY_AFTER})
+    time.sleep(0.2)  # let the event go out before the transports close
+    # Every local client's disconnect handler runs (registry cleanup, ingest streams closed);
+    # ignore_queue: clients of other worker processes are not ours to drop
+    for sid, _ in list(socketio.server.manager.get_participants('/', None)):
+        socketio.server.disconnect(sid, ignore_queue=True)
+    socketio.server.shutdown()
+
+
+def install_shutdown(socketio, grace=None):
+    """Handle SIGTERM / SIGINT: drain, then make socketio.run() return. Call from the main thread."""
+    grace = Config.SHUTDOWN_GRACE if grace is None else grace
+
+    if mode == 'gevent':
+        import gevent
+
+        def on_signal():
+            if not _draining:
+                _drain(socketio, grace)
+            socketio.wsgi_server.stop(timeout=1)
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            gevent.signal_handler(signum, on_signal)
+
+    elif mode == 'eventlet':
+        import eventlet
+        import greenlet
+        main = greenlet.getcurrent()  # the green thread that will sit in socketio.run()
+
+        def stop():
+            if not _draining:
+                _drain(socketio, grace)
+            main.throw(SystemExit)  # eventlet.wsgi.server treats this as "stop accepting"
+
+        def on_signal(signum, frame):
+            # Handlers may run inside the hub, which cannot block: drain on a green thread
+            eventlet.spawn(stop)
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, on_signal)
+
+    else:
+        def on_signal(signum, frame):
+            # Runs on the main thread, which stops accepting while it drains;
+            # werkzeug's serve_forever() returns on KeyboardInterrupt
+            if not _draining:
+                _drain(socketio, grace)
+            raise KeyboardInterrupt
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, on_signal)
@@ -0,0 +1,149 @@
+"""
+Shared SQLite access layer.
+
+Every thread borrows one connection from a small pool and keeps it until the
+request (app context) ends, so a handler never pays for connect() or for
+re-preparing its statements. Connections are opened in WAL mode, which lets
+readers (listing recordings) run while a writer (an upload) commits.
+
+Usage:
+    from services import db
+
+    rows = db.query("SELECT * FROM recordings WHERE id = ?", (rid,))
+    row = db.query_one("SELECT ...", params)
+    cur = db.execute("INSERT ...", params)          # autocommits
+    db.executemany("DELETE FROM t WHERE id = ?", ids)  # one transaction
+    with db.transaction() as conn:                  # BEGIN IMMEDIATE ... COMMIT
+        conn.execute(...)
+
+In the green-thread serving modes the statements run on the blocking-work
+thread pool (services/concurrency.py), so a slow query or a commit's fsync
+does not stall every other client. Inside transaction(), BEGIN (which may wait
+for the write lock) and COMMIT go there; the statements in between are plain
+calls on the already-locked connection.
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import Config
+from services.concurrency import blocking
+from services.metrics import DB_QUERY
+
+_local = threading.local()
+_pool = queue.LifoQueue(maxsize=Config.DB_POOL_SIZE)
+
+
+def connect(path=None):
+    """Open a new connection with the tuned pragmas. Prefer get_db()."""
+    conn = sqlite3.connect(
+        path or Config.DATABASE_PATH,
+        timeout=Config.DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,  # autocommit; transaction() opens explicit ones
+        check_same_thread=False,  # a pooled connection moves between threads (never shared)
+        cached_statements=Config.DB_STATEMENT_CACHE,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{Config.DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size={Config.DB_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def get_db():
+    """Connection bound to the current thread (borrowed from the pool on first use)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = connect()
+        _local.conn = conn
+    return conn
+
+
+def release_connection(exc=None):
+    """Give this thread's connection back to the pool (called on app teardown)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def close_all():
+    release_connection()
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def init_app(app):
+    app.teardown_appcontext(release_connection)
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+
+# The connection is looked up before handing off: it belongs to the calling thread
+def query(sql, params=()):
+    conn = get_db()
+    with DB_QUERY.time('query'):
+        return blocking(_fetchall, conn, sql, params)
+
+
+def query_one(sql, params=()):
+    conn = get_db()
+    with DB_QUERY.time('query_one'):
+        return blocking(_fetchone, conn, sql, params)
+
+
+def execute(sql, params=()):
+    conn = get_db()
+    with DB_QUERY.time('execute'):
+        return blocking(conn.execute, sql, params)
+
+
+def executemany(sql, seq_of_params):
+    """Run a batch of writes in a single transaction (one fsync, not one per row)."""
+    with DB_QUERY.time('executemany'), transaction() as conn:
+        return blocking(conn.executemany, sql, seq_of_params)
+
+
+@contextmanager
+def transaction():
+    """
+    Explicit write transaction. BEGIN IMMEDIATE takes the write lock up front,
+    so two writers wait on busy_timeout instead of failing halfway through.
+    Nested use just joins the outer transaction.
+    """
+    conn = get_db()
+    if conn.in_transaction:
+        yield conn
+        return
+    blocking(conn.execute, "BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        blocking(conn.commit)
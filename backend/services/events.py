@@ -0,0 +1,239 @@
+"""
+Event log.
+
+What happened, when, to which camera: room joins, leaves and disconnects,
+uploads, motion detected by analysis, deletions and evictions. Rows go into
+the `events` table (setup_db.py):
+
+    (time epoch, kind, camera_name, room_code, recording_id, detail JSON)
+
+record() is called from where things happen (sockets/rooms.py,
+upload_service, motion, retention) and only appends a tuple to an in-memory
+list; a background thread writes the list every EVENTS_FLUSH_INTERVAL seconds
+with one executemany, like the camera registry's heartbeats. Until start()
+(the `events` subsystem) record() does nothing.
+
+Queries (list_events, /api/events) are keyset pages, newest first, on
+(time, id). Every filter has an index behind it: time alone, camera_name +
+time, kind + time, recording_id. `q` keeps the events of recordings whose
+camera name, tags or notes match (recordings_fts, services/recordings.py). Events keep their
+recording_id after the recording is deleted, so deletions stay queryable.
+"""
+
+import base64
+import json
+import logging
+import threading
+import time
+
+from config import Config
+from services import db
+from services.metrics import counter
+from services.recordings import InvalidQuery, search_clause
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('join', 'leave', 'disconnect', 'upload', 'motion', 'delete')
+
+EVENTS_DROPPED = counter('webwatch_events_dropped_total', 'Events dropped because the write buffer was full')
+
+_COLUMNS = ('e.id, e.time, e.kind, e.camera_name, e.room_code, e.recording_id, e.detail, '
+            'r.filename, r.timestamp AS recording_timestamp, r.tags, r.notes')
+
+
+class EventLog:
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._pending = []
+        self._camera_sids = {}  # socket id -> camera name given at join, for its disconnect event
+
+    def record(self, kind, camera_name=None, recording_id=None, room_code=None, sid=None, **detail):
+        """Queue an event. Cheap: no I/O, safe on socket handlers."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if sid is not None:
+                detail['sid'] = sid
+                if kind == 'join' and camera_name:
+                    self._camera_sids[sid] = camera_name
+                elif camera_name is None:
+                    camera_name = self._camera_sids.get(sid)
+            if len(self._pending) >= self.max_pending:
+                EVENTS_DROPPED.inc()
+                return
+            self._pending.append((time.time(), kind, camera_name, recording_id, room_code,
+                                  recording_id, json.dumps(detail) if detail else None))
+
+    def forget(self, sid):
+        """The socket is gone (sockets/rooms.py, after its disconnect events)."""
+        with self._lock:
+            self._camera_sids.pop(sid, None)
+
+    def flush(self):
+        """Write the queued events in one transaction. Returns how many."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            # Events recorded with just a recording id get its camera name
+            db.executemany(
+                'INSERT INTO events (time, kind, camera_name, room_code, recording_id, detail) '
+                'VALUES (?, ?, COALESCE(?, (SELECT camera_name FROM recordings WHERE id = ?)), ?, ?, ?)',
+                rows)
+        except Exception:
+            with self._lock:
+                # Written again at the next flush, oldest first
+                self._pending[:0] = rows[:max(0, self.max_pending - len(self._pending))]
+            raise
+        return len(rows)
+
+    def prune(self):
+        """Delete events older than EVENTS_MAX_AGE_DAYS, a batch at a time (idx_events_time)."""
+        if not Config.EVENTS_MAX_AGE_DAYS:
+            return 0
+        cutoff = time.time() - Config.EVENTS_MAX_AGE_DAYS * 86400
+        removed = 0
+        while True:
+            cursor = db.execute(
+                'DELETE FROM events WHERE id IN (SELECT id FROM events WHERE time < ? LIMIT ?)',
+                (cutoff, Config.RETENTION_BATCH_SIZE))
+            removed += cursor.rowcount
+            if cursor.rowcount < Config.RETENTION_BATCH_SIZE:
+                return removed
+
+
+log = EventLog(Config.EVENTS_MAX_PENDING)
+record = log.record
+
+
+def encode_cursor(row):
+    raw = f"{row['time']!r}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        event_time, row_id = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+        return float(event_time), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidQuery("Invalid cursor")
+
+
+def _event(row):
+    event = {key: row[key] for key in ('id', 'time', 'kind', 'camera_name', 'room_code', 'recording_id')}
+    event['detail'] = json.loads(row['detail']) if row['detail'] else {}
+    # The recording as it is now; None once it has been deleted
+    event['recording'] = None if row['filename'] is None else {
+        'filename': row['filename'], 'timestamp': row['recording_timestamp'],
+        'tags': row['tags'].split(',') if row['tags'] else [], 'notes': row['notes'],
+    }
+    return event
+
+
+def list_events(limit, cursor=None, kind=None, camera_name=None, recording_id=None,
+                since=None, until=None, q=None):
+    """
+    One page of events, newest first, with their recordings. `since` /
+    `until` are epoch seconds, `kind` one of KINDS or a list of them.
+    Returns (events, next_cursor); next_cursor is None on the last page.
+    """
+    clauses, params = [], []
+    if kind:
+        kinds = [kind] if isinstance(kind, str) else list(kind)
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise InvalidQuery(f"Unknown kind(s) {', '.join(sorted(unknown))}, expected {', '.join(KINDS)}")
+        clauses.append(f"e.kind IN ({','.join('?' * len(kinds))})")
+        params.extend(kinds)
+    if camera_name:
+        clauses.append("e.camera_name = ?")
+        params.append(camera_name)
+    if recording_id is not None:
+        clauses.append("e.recording_id = ?")
+        params.append(recording_id)
+    if since is not None:
+        clauses.append("e.time >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("e.time < ?")
+        params.append(until)
+    if q:
+        clause, clause_params = search_clause('e.recording_id', q)
+        clauses.append(clause)
+        params.extend(clause_params)
+    if cursor:
+        clauses.append("(e.time, e.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    # One extra row tells whether there is a next page
+    rows = db.query(
+        f"SELECT {_COLUMNS} FROM events e LEFT JOIN recordings r ON r.id = e.recording_id "
+        f"{where} ORDER BY e.time DESC, e.id DESC LIMIT ?",
+        params + [limit + 1],
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return [_event(row) for row in rows], next_cursor
+
+
+class Flusher:
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        self._last_prune = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='event-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop:
+            self._wake.wait(self.interval)
+            try:
+                log.flush()
+                if time.monotonic() - self._last_prune > 3600:
+                    self._last_prune = time.monotonic()
+                    pruned = log.prune()
+                    if pruned:
+                        logger.info("Pruned %d old event(s)", pruned)
+            except Exception:
+                logger.exception("Event log flush failed")
+            finally:
+                db.release_connection()
+
+
+_flusher = None
+
+
+def start():
+    global _flusher
+    if _flusher is None:
+        log.enabled = True
+        _flusher = Flusher(Config.EVENTS_FLUSH_INTERVAL)
+        _flusher.start()
+    return _flusher
+
+
+def stop():
+    """Stop the flusher and write what is still queued."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.stop()
+        _flusher = None
+    log.enabled = False
+    log.flush()
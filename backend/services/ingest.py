@@ -0,0 +1,295 @@
+"""
+Continuous recording ingest over Socket.IO.
+
+Instead of uploading a finished clip, a camera streams its MediaRecorder
+chunks (see sockets/ingest.py). Each stream is written as a series of
+fixed-duration segment files under SEGMENTS_DIR:
+
+    segments/<stream_id>-<seq>.webm
+
+Every segment starts with the stream's init header (WebM EBML/Tracks or MP4
+ftyp/moov, taken from the first chunk), so any segment plays on its own. A
+new segment is started once INGEST_SEGMENT_SECONDS have passed, at the next
+chunk that begins a WebM Cluster / MP4 moof (or one the client flags as a
+keyframe), so segments start on a decodable boundary. Until such a chunk
+arrives the segment keeps growing: cutting anywhere else would leave the
+next segment starting mid-GOP, unplayable on its own.
+
+The `segments` table (see setup_db.py) is the time index:
+(camera_name, start_time, end_time, filename, size_bytes, status). The open
+segment's row is updated every time it is fsynced, so footage is durable and
+listed within ~INGEST_FSYNC_INTERVAL seconds.
+
+Socket handlers never touch the disk: chunks go into a bounded per-stream
+buffer (INGEST_MAX_BUFFER_BYTES) that one writer thread drains. When a
+camera's buffer is full the chunk is refused with "busy" and the camera
+resends it later (backpressure instead of unbounded memory).
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from config import Config
+from services import db
+from services.concurrency import blocking
+from services.metrics import UPLOAD_BYTES, gauge
+
+logger = logging.getLogger(__name__)
+
+WEBM_CLUSTER = b'\x1f\x43\xb6\x75'
+WEBM_EBML = b'\x1a\x45\xdf\xa3'
+
+
+class IngestError(Exception):
+    def __init__(self, message, **extra):
+        super().__init__(message)
+        self.message = message
+        self.extra = extra
+
+
+def split_init(data):
+    """Return the init header at the start of a stream's first chunk (b'' if none found)."""
+    if data.startswith(WEBM_EBML):
+        idx = data.find(WEBM_CLUSTER)
+        return data if idx < 0 else data[:idx]
+    idx = data.find(b'moof')
+    if idx >= 4 and b'moov' in data[:idx]:
+        return data[:idx - 4]  # box size precedes the type
+    return b''
+
+
+def starts_fragment(data):
+    """True if the chunk begins a WebM Cluster or an MP4 moof box."""
+    return data.startswith(WEBM_CLUSTER) or data[4:8] == b'moof'
+
+
+class Stream:
+    def __init__(self, sid, camera_name, mime_type, segment_seconds):
+        self.sid = sid
+        self.stream_id = uuid.uuid4().hex
+        self.camera_name = camera_name
+        self.ext = '.mp4' if 'mp4' in (mime_type or '') else '.webm'
+        self.segment_seconds = segment_seconds
+        self.init = None
+        self.next_seq = 0          # next chunk seq expected from the camera
+        self.pending = deque()     # (data, received_at, keyframe)
+        self.pending_bytes = 0
+        self.closing = False
+        # Writer-thread only
+        self.segment_index = 0
+        self.file = None
+        self.segment_id = None
+        self.segment_start = None
+        self.segment_end = None
+        self.segment_size = 0
+        self.last_sync = 0.0
+
+
+class Ingest:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}  # sid -> Stream
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+
+    # --- called from socket handlers ---
+
+    def open(self, sid, camera_name, mime_type=None):
+        self._ensure_writer()
+        with self._lock:
+            old = self._streams.get(sid)
+            if old is not None:
+                old.closing = True
+            stream = Stream(sid, camera_name, mime_type, Config.INGEST_SEGMENT_SECONDS)
+            self._streams[sid] = stream
+            # The old stream (if any) is finished by the writer under its own key
+            if old is not None:
+                self._streams[f"{sid}:{old.stream_id}"] = old
+        self._wake.set()
+        logger.info("Ingest stream %s opened for %s", stream.stream_id, camera_name)
+        return stream
+
+    def push(self, sid, seq, data, keyframe=False):
+        """
+        Queue one chunk. Returns the stream's buffered byte count.
+        Raises IngestError ("busy" when the buffer is full, the chunk must be resent).
+        """
+        with self._lock:
+            stream = self._streams.get(sid)
+            if stream is None or stream.closing:
+                raise IngestError("No open ingest stream")
+            if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool) or seq < 0):
+                raise IngestError("seq must be a non-negative integer", expected_seq=stream.next_seq)
+            if seq is not None and seq < stream.next_seq:
+                return stream.pending_bytes  # resend of a chunk we already have
+            if seq is not None and seq > stream.next_seq:
+                raise IngestError("Chunk out of order", expected_seq=stream.next_seq)
+            if stream.pending and stream.pending_bytes + len(data) > Config.INGEST_MAX_BUFFER_BYTES:
+                raise IngestError("busy", expected_seq=stream.next_seq, buffered=stream.pending_bytes,
+                                  retry_after_ms=Config.INGEST_RETRY_AFTER_MS)
+            stream.pending.append((data, time.time(), bool(keyframe)))
+            stream.pending_bytes += len(data)
+            stream.next_seq += 1
+            buffered = stream.pending_bytes
+        UPLOAD_BYTES.inc(len(data), 'stream')
+        self._wake.set()
+        return buffered
+
+    def close(self, sid):
+        """Finish the sid's stream (ingest_stop or disconnect); pending chunks are still written."""
+        with self._lock:
+            stream = self._streams.get(sid)
+            if stream is None:
+                return None
+            stream.closing = True
+        self._wake.set()
+        return stream.stream_id
+
+    # --- writer thread ---
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        for sid in list(self._streams):
+            self.close(sid)
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _loop(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                streams = list(self._streams.items())
+            for key, stream in streams:
+                try:
+                    self._drain(stream)
+                    if stream.closing and not stream.pending:
+                        self._close_segment(stream)
+                        with self._lock:
+                            if self._streams.get(key) is stream:
+                                del self._streams[key]
+                        logger.info("Ingest stream %s closed", stream.stream_id)
+                except Exception:
+                    logger.exception("Ingest write failed for stream %s", stream.stream_id)
+                    with self._lock:
+                        stream.pending.clear()
+                        stream.pending_bytes = 0
+            db.release_connection()
+            if self._stop and not self._streams:
+                return
+            self._wake.wait(Config.INGEST_FSYNC_INTERVAL)
+
+    def _drain(self, stream):
+        while True:
+            with self._lock:
+                if not stream.pending:
+                    break
+                data, received_at, keyframe = stream.pending.popleft()
+            self._write(stream, data, received_at, keyframe)
+            with self._lock:
+                stream.pending_bytes -= len(data)
+        if stream.file is not None and time.time() - stream.last_sync >= Config.INGEST_FSYNC_INTERVAL:
+            self._sync(stream)
+
+    def _write(self, stream, data, received_at, keyframe):
+        if stream.init is None:
+            stream.init = split_init(data)
+        elif stream.file is not None:
+            elapsed = received_at - stream.segment_start
+            # Only ever on a decodable boundary, however long the segment gets
+            if elapsed >= stream.segment_seconds and (keyframe or starts_fragment(data)):
+                self._close_segment(stream)
+
+        if stream.file is None:
+            self._open_segment(stream, received_at)
+            if stream.segment_index > 1 and stream.init:
+                stream.file.write(stream.init)
+                stream.segment_size += len(stream.init)
+        stream.file.write(data)
+        stream.segment_size += len(data)
+        stream.segment_end = received_at
+
+    def _open_segment(self, stream, started_at):
+        os.makedirs(Config.SEGMENTS_DIR, exist_ok=True)
+        stream.segment_index += 1
+        filename = f"{stream.stream_id}-{stream.segment_index:06d}{stream.ext}"
+        stream.file = open(os.path.join(Config.SEGMENTS_DIR, filename), 'wb')
+        stream.segment_start = stream.segment_end = started_at
+        stream.segment_size = 0
+        stream.last_sync = time.time()
+        cursor = db.execute(
+            'INSERT INTO segments (camera_name, stream_id, seq, filename, start_time, end_time, size_bytes, status) '
+            'VALUES (?, ?, ?, ?, ?, ?, 0, ?)',
+            (stream.camera_name, stream.stream_id, stream.segment_index, filename, started_at, started_at, 'open'),
+        )
+        stream.segment_id = cursor.lastrowid
+
+    def _sync(self, stream, status='open'):
+        stream.file.flush()
+        blocking(os.fsync, stream.file.fileno())
+        stream.last_sync = time.time()
+        db.execute('UPDATE segments SET end_time = ?, size_bytes = ?, status = ? WHERE id = ?',
+                   (stream.segment_end, stream.segment_size, status, stream.segment_id))
+
+    def _close_segment(self, stream):
+        if stream.file is None:
+            return
+        self._sync(stream, status='closed')
+        stream.file.close()
+        stream.file = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                stream.camera_name: {'stream_id': stream.stream_id, 'buffered': stream.pending_bytes}
+                for stream in self._streams.values() if not stream.closing
+            }
+
+
+ingest = Ingest()
+
+gauge('webwatch_ingest_buffered_bytes', 'Streamed chunk bytes waiting to be written, per camera', ['camera'],
+      fn=lambda: {(camera,): s['buffered'] for camera, s in ingest.stats().items()})
+
+
+def recover():
+    """At startup: segments left 'open' by a crash are closed with the size that reached disk."""
+    rows = db.query("SELECT id, filename FROM segments WHERE status = 'open'")
+    for row in rows:
+        path = os.path.join(Config.SEGMENTS_DIR, row['filename'])
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        db.execute("UPDATE segments SET status = 'closed', size_bytes = ? WHERE id = ?", (size, row['id']))
+    if rows:
+        logger.info("Closed %d segment(s) left open by the last run", len(rows))
+    db.release_connection()
+
+
+def list_segments(camera_name=None, since=None, until=None, limit=500):
+    """Segments overlapping [since, until] (epoch seconds), oldest first."""
+    clauses, params = [], []
+    if camera_name:
+        clauses.append('camera_name = ?')
+        params.append(camera_name)
+    if since is not None:
+        clauses.append('end_time >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('start_time <= ?')
+        params.append(until)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return db.query(
+        f'SELECT id, camera_name, stream_id, seq, filename, start_time, end_time, size_bytes, status '
+        f'FROM segments {where} ORDER BY start_time, id LIMIT ?',
+        params + [limit],
+    )
@@ -0,0 +1,281 @@
+"""
+Durable background jobs for post-upload processing.
+
+Jobs are rows in the `jobs` table (see setup_db.py), so nothing is lost if the
+server restarts between an upload and its processing. A single dispatcher
+thread claims due jobs and runs them in a process pool of JOB_WORKERS
+processes, so CPU-heavy work (analysis, transcoding, thumbnails) uses all the
+cores and never runs on a request thread.
+
+    jobs.register_handler('motion', motion.run_job, on_result=motion.save_job_result)
+    jobs.enqueue('motion', {'recording_id': 1, 'filename': 'rec_...webm'})
+
+- handler(payload) runs in a worker process; it must be a module-level
+  function and return something JSON-serializable.
+- on_result(payload, result) runs back in the server process (e.g. to write
+  the result to the DB).
+- A failing job is retried with exponential backoff (JOB_RETRY_BASE_DELAY * 2^n)
+  up to its max_attempts, then marked failed.
+- A worker process that dies (OOM, segfault) breaks the whole pool: it is
+  replaced, and every job that was running on it counts a failed attempt
+  (the pool can't tell which one crashed it). So a job that always kills
+  its worker is retried with backoff and then marked failed, not rebuilt
+  forever. Jobs that stop() cancels, or that never reached a worker, go
+  back to the queue without using up an attempt.
+- Every status change is pushed to Socket.IO room "jobs" as a `job_update` event.
+"""
+
+import json
+import logging
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import Config
+from services import db
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+JOBS_ROOM = 'jobs'
+
+_handlers = {}  # kind -> (handler, on_result)
+
+
+def register_handler(kind, handler, on_result=None):
+    _handlers[kind] = (handler, on_result)
+
+
+def _row_to_dict(row):
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else None
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def enqueue(kind, payload, max_attempts=None, delay=0):
+    """Persist a new job and wake the dispatcher. Returns the job id."""
+    now = time.time()
+    cursor = db.execute(
+        'INSERT INTO jobs (kind, payload, status, attempts, max_attempts, run_after, created_at, updated_at) '
+        'VALUES (?, ?, ?, 0, ?, ?, ?, ?)',
+        (kind, json.dumps(payload), QUEUED, max_attempts or Config.JOB_MAX_ATTEMPTS, now + delay, now, now),
+    )
+    if _dispatcher is not None:
+        _dispatcher.wake()
+        _dispatcher.publish(cursor.lastrowid)
+    return cursor.lastrowid
+
+
+def get_job(job_id):
+    row = db.query_one('SELECT * FROM jobs WHERE id = ?', (job_id,))
+    return _row_to_dict(row) if row else None
+
+
+def list_jobs(status=None, kind=None, limit=50):
+    clauses, params = [], []
+    if status:
+        clauses.append('status = ?')
+        params.append(status)
+    if kind:
+        clauses.append('kind = ?')
+        params.append(kind)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = db.query(f'SELECT * FROM jobs {where} ORDER BY id DESC LIMIT ?', params + [limit])
+    return [_row_to_dict(row) for row in rows]
+
+
+def retry(job_id):
+    """Put a failed job back in the queue. Returns False if it is not failed."""
+    cursor = db.execute(
+        'UPDATE jobs SET status = ?, attempts = 0, run_after = ?, updated_at = ? WHERE id = ? AND status = ?',
+        (QUEUED, time.time(), time.time(), job_id, FAILED),
+    )
+    if cursor.rowcount and _dispatcher is not None:
+        _dispatcher.wake()
+        _dispatcher.publish(job_id)
+    return bool(cursor.rowcount)
+
+
+class Dispatcher:
+    def __init__(self, socketio=None, workers=None):
+        self.socketio = socketio
+        self.workers = workers or Config.JOB_WORKERS
+        self._wake = threading.Event()
+        self._stop = False
+        self._running = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.pool = self._new_pool()
+
+    def _new_pool(self):
+        # forkserver: workers don't inherit the server's threads and sockets
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+
+    def _replace_pool(self, broken):
+        """Swap in a new pool, once, for `broken` (every job it had lands here)."""
+        with self._lock:
+            if self.pool is not broken or self._stop:
+                return
+            self.pool = self._new_pool()
+        logger.error("A job worker process died; replaced the worker pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        # Jobs that were running when the server died go back to the queue
+        db.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?', (QUEUED, time.time(), RUNNING))
+        db.release_connection()
+        self._thread = threading.Thread(target=self._loop, name='job-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+    def wake(self):
+        self._wake.set()
+
+    def publish(self, job_id):
+        if self.socketio is None:
+            return
+        job = get_job(job_id)
+        if job is not None:
+            self.socketio.emit('job_update', {
+                'id': job['id'], 'kind': job['kind'], 'status': job['status'],
+                'attempts': job['attempts'], 'last_error': job['last_error'],
+            }, room=JOBS_ROOM)
+
+    def _claim(self, limit):
+        """Atomically move up to `limit` due jobs from queued to running."""
+        now = time.time()
+        with db.transaction() as conn:
+            rows = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? AND run_after <= ? ORDER BY run_after LIMIT ?',
+                (QUEUED, now, limit),
+            ).fetchall()
+            conn.executemany(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                [(RUNNING, now, row['id']) for row in rows],
+            )
+        return rows
+
+    def _next_due_in(self):
+        row = db.query_one('SELECT MIN(run_after) FROM jobs WHERE status = ?', (QUEUED,))
+        if row[0] is None:
+            return Config.JOB_POLL_INTERVAL
+        return min(max(row[0] - time.time(), 0), Config.JOB_POLL_INTERVAL)
+
+    def _loop(self):
+        while not self._stop:
+            # Cleared before looking for work, so a wake() during this pass is not lost
+            self._wake.clear()
+            try:
+                with self._lock:
+                    free = self.workers - self._running
+                claimed = self._claim(free) if free > 0 else []
+                for row in claimed:
+                    self._submit(row)
+                timeout = self._next_due_in() if free > len(claimed) else Config.JOB_POLL_INTERVAL
+            except Exception:
+                logger.exception("Job dispatcher error")
+                timeout = Config.JOB_POLL_INTERVAL
+            finally:
+                db.release_connection()
+            self._wake.wait(timeout)
+
+    def _submit(self, row):
+        job_id, kind = row['id'], row['kind']
+        if kind not in _handlers:
+            self._finish(job_id, kind, row['attempts'] + 1, row['max_attempts'], None, error=f"No handler for {kind}")
+            return
+        handler, _ = _handlers[kind]
+        payload = json.loads(row['payload'])
+        with self._lock:
+            self._running += 1
+            pool = self.pool
+        try:
+            # The handler is pickled by reference, so the worker imports its module
+            future = pool.submit(handler, payload)
+        except BrokenProcessPool:
+            with self._lock:
+                self._running -= 1
+            self._requeue(job_id)
+            self._replace_pool(pool)
+            return
+        self.publish(job_id)
+        future.add_done_callback(
+            lambda f: self._on_done(f, pool, job_id, kind, payload, row['attempts'] + 1, row['max_attempts']))
+
+    def _requeue(self, job_id):
+        """Back to the queue, giving back the attempt _claim() charged."""
+        now = time.time()
+        db.execute('UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), run_after = ?, updated_at = ? '
+                   'WHERE id = ? AND status = ?', (QUEUED, now, now, job_id, RUNNING))
+        self.publish(job_id)
+
+    def _on_done(self, future, pool, job_id, kind, payload, attempts, max_attempts):
+        with self._lock:
+            self._running -= 1
+        try:
+            try:
+                result = future.result()
+                _, on_result = _handlers[kind]
+                if on_result is not None:
+                    on_result(payload, result)
+            except CancelledError:
+                # stop() dropped it before it ran
+                self._requeue(job_id)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                logger.warning("Job %s (%s) attempt %d lost: a worker process died", job_id, kind, attempts)
+                self._finish(job_id, kind, attempts, max_attempts, None, error="Worker process died")
+            except Exception as e:
+                logger.warning("Job %s (%s) attempt %d failed: %s", job_id, kind, attempts, e)
+                self._finish(job_id, kind, attempts, max_attempts, None, error=f"{type(e).__name__}: {e}")
+            else:
+                self._finish(job_id, kind, attempts, max_attempts, result)
+        finally:
+            db.release_connection()
+            self.wake()
+
+    def _finish(self, job_id, kind, attempts, max_attempts, result, error=None):
+        now = time.time()
+        if error is None:
+            db.execute('UPDATE jobs SET status = ?, result = ?, last_error = NULL, updated_at = ? WHERE id = ?',
+                       (DONE, json.dumps(result), now, job_id))
+        elif attempts < max_attempts:
+            delay = Config.JOB_RETRY_BASE_DELAY * (2 ** (attempts - 1)) * (1 + random.random() * 0.1)
+            db.execute('UPDATE jobs SET status = ?, run_after = ?, last_error = ?, updated_at = ? WHERE id = ?',
+                       (QUEUED, now + delay, error, now, job_id))
+        else:
+            db.execute('UPDATE jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?',
+                       (FAILED, error, now, job_id))
+            logger.error("Job %s (%s) failed after %d attempt(s): %s", job_id, kind, attempts, error)
+        self.publish(job_id)
+
+
+_dispatcher = None
+
+
+def start(socketio=None):
+    """Start the dispatcher + worker pool (once per server process)."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = Dispatcher(socketio)
+        _dispatcher.start()
+        logger.info("Job dispatcher started with %d worker process(es)", _dispatcher.workers)
+    return _dispatcher
+
+
+def stop(wait=True):
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop(wait=wait)
+        _dispatcher = None
@@ -0,0 +1,197 @@
+"""
+Byte-range aware file responses for recordings and other media.
+
+Flask's send_from_directory only understands a single range and wraps the
+file in a Python-level range iterator, which means the WSGI server can never
+use sendfile for seeks. `send_media` handles:
+
+- ETag / Last-Modified with If-None-Match, If-Modified-Since (304)
+- If-Match / If-Unmodified-Since (412) and If-Range
+- single ranges (206) and multiple ranges (206 multipart/byteranges)
+- zero-copy: whole files and single ranges go through the server's
+  wsgi.file_wrapper, so gunicorn & co. can sendfile() them
+"""
+
+import mimetypes
+import os
+import uuid
+from datetime import datetime, timezone
+
+from flask import Response, request
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.wsgi import FileWrapper, wrap_file
+
+COPY_BUFFER = 256 * 1024
+# More ranges than this in one request is almost certainly abuse; serve 200
+MAX_RANGES = 16
+
+
+class _FileSlice:
+    """Iterable over `length` bytes of an open file starting at `start`."""
+
+    def __init__(self, f, start, length, close_file=True):
+        self.f = f
+        self.start = start
+        self.remaining = length
+        self.close_file = close_file
+        f.seek(start)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        block = self.f.read(min(COPY_BUFFER, self.remaining))
+        if not block:
+            raise StopIteration
+        self.remaining -= len(block)
+        return block
+
+    def close(self):
+        if self.close_file:
+            self.f.close()
+
+
+def make_etag(stat_result):
+    return f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+
+
+def _server_file_wrapper():
+    """The WSGI server's own file wrapper (the one that can sendfile), if any."""
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    if wrapper is None or wrapper is FileWrapper:
+        return None
+    return wrapper
+
+
+def _resolve_ranges(ranges, size):
+    """Turn werkzeug's (start, stop) pairs into sorted, merged, in-bounds spans."""
+    spans = []
+    for start, stop in ranges:
+        if start < 0:
+            # Suffix range: "bytes=-500" means the last 500 bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append([start, stop])
+    spans.sort()
+
+    merged = []
+    for span in spans:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def _if_range_matches(etag, mtime):
+    if not request.headers.get('If-Range'):
+        return True
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(mtime) <= int(if_range.date.timestamp())
+    return False
+
+
+def _precondition_failed(etag, mtime):
+    if request.if_match and not request.if_match.star_tag and not request.if_match.contains(etag):
+        return True
+    since = request.if_unmodified_since
+    if since is not None and int(mtime) > int(since.timestamp()):
+        return True
+    return False
+
+
+def send_media(path, mimetype=None, max_age=3600, cache_control="public"):
+    """Return a conditional, range-aware Response for the file at `path`."""
+    st = os.stat(path)
+    size = st.st_size
+    etag = make_etag(st)
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': f'{cache_control}, max-age={max_age}',
+    }
+
+    if _precondition_failed(etag, st.st_mtime):
+        return Response(status=412, headers=headers)
+
+    last_modified = datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    # request.range is None when there is no Range header or it can't be parsed;
+    # either way the whole file is sent (RFC 7233)
+    spans = None
+    rng = request.range
+    if rng is not None and rng.units == 'bytes' and len(rng.ranges) <= MAX_RANGES \
+            and _if_range_matches(etag, st.st_mtime):
+        spans = _resolve_ranges(rng.ranges, size)
+        if not spans:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+
+    head_only = request.method == 'HEAD'
+    f = None if head_only else open(path, 'rb')
+
+    # Whole file (or a range covering all of it)
+    if not spans or (len(spans) == 1 and spans[0] == [0, size]):
+        body = None if head_only else wrap_file(request.environ, f, COPY_BUFFER)
+        resp = Response(body, status=200, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        resp.content_length = size
+        return resp
+
+    # Single range
+    if len(spans) == 1:
+        start, stop = spans[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        body = None
+        if not head_only:
+            server_wrapper = _server_file_wrapper()
+            if server_wrapper is not None:
+                # sendfile-capable servers start at tell() and stop at Content-Length
+                f.seek(start)
+                body = server_wrapper(f, COPY_BUFFER)
+            else:
+                body = _FileSlice(f, start, stop - start)
+        resp = Response(body, status=206, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        resp.content_length = stop - start
+        return resp
+
+    # Several ranges: multipart/byteranges
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, stop in spans:
+        part_header = (
+            f'--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+        ).encode('ascii')
+        parts.append((part_header, start, stop))
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    content_length = sum(len(h) + (stop - start) for h, start, stop in parts)
+    content_length += 2 * (len(parts) - 1) + len(closing)
+
+    def generate():
+        try:
+            for i, (part_header, start, stop) in enumerate(parts):
+                if i:
+                    yield b'\r\n'
+                yield part_header
+                yield from _FileSlice(f, start, stop - start, close_file=False)
+            yield closing
+        finally:
+            f.close()
+
+    resp = Response(None if head_only else generate(), status=206, headers=headers, direct_passthrough=True)
+    resp.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    resp.content_length = content_length
+    return resp
@@ -0,0 +1,285 @@
+"""
+Prometheus-style metrics without extra dependencies.
+
+    from services import metrics
+
+    UPLOADS = metrics.counter('webwatch_upload_bytes_total', 'Bytes received', ['kind'])
+    UPLOADS.inc(len(chunk), 'session')
+
+    DB_TIME = metrics.histogram('webwatch_db_query_seconds', 'Query time', ['op'])
+    with DB_TIME.time('query'):
+        ...
+
+    metrics.gauge('webwatch_rooms', 'Open rooms', fn=registry.room_count)
+
+Counters and histograms are sharded per thread: the hot path only touches a
+dict owned by the calling thread (no lock, no contention between request
+threads). A scrape of /metrics adds the shards up. Shards of threads that
+have exited are folded into a base total then dropped, both at a scrape and
+whenever the shard list has doubled since the last fold, so thread churn
+(a green thread per request) does not grow memory between scrapes. In the green-thread serving modes (see
+services/concurrency.py) a shard belongs to a green thread instead. Gauges are either set directly or read
+from a callback at scrape time (room counts, disk usage).
+
+render() produces the text exposition format (version 0.0.4).
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from services import concurrency
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_str(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _fmt(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _current_owner():
+    if concurrency.mode in ('eventlet', 'gevent'):
+        # Server-spawned green threads all look like one long-lived dummy thread
+        import greenlet
+        return greenlet.getcurrent()
+    return threading.current_thread()
+
+
+def _alive(owner):
+    return not owner.dead if hasattr(owner, 'dead') else owner.is_alive()
+
+
+class _Sharded:
+    """Per-thread value dicts, merged on collect."""
+
+    kind = None
+    # Fold dead shards once the list reaches this size (then twice the live ones)
+    FOLD_AT = 64
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (thread or greenlet, dict)
+        self._base = {}    # totals of exited threads
+        self._fold_at = self.FOLD_AT
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                if len(self._shards) >= self._fold_at:
+                    self._fold()
+                self._shards.append((_current_owner(), shard))
+        return shard
+
+    def _fold(self):
+        """Merge the shards of exited owners into the base total (lock held). Returns the live ones."""
+        alive = []
+        for owner, shard in self._shards:
+            if _alive(owner):
+                alive.append((owner, shard))
+            else:
+                self._merge_into(self._base, shard.copy())
+        self._shards = alive
+        # Amortized: a fold is only due again after as many new shards as are alive now
+        self._fold_at = max(self.FOLD_AT, 2 * len(alive))
+        return alive
+
+    def _merge_into(self, total, values):
+        raise NotImplementedError
+
+    def _collect(self):
+        with self._lock:
+            alive = self._fold()
+            total = {}
+            self._merge_into(total, self._base)
+            for _, shard in alive:
+                # dict.copy() is atomic under the GIL, the owner may keep writing
+                self._merge_into(total, shard.copy())
+        return total
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge_into(self, total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def samples(self):
+        values = self._collect()
+        if not values and not self.labelnames:
+            values = {(): 0}
+        for labels, value in sorted(values.items()):
+            yield self.name, labels, None, value
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # [per-bucket counts (last = +Inf), sum, count]
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _merge_into(self, total, values):
+        for key, (counts, sum_, count) in values.items():
+            entry = total.get(key)
+            if entry is None:
+                total[key] = [list(counts), sum_, count]
+            else:
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += sum_
+                entry[2] += count
+
+    def samples(self):
+        for labels, (counts, sum_, count) in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield self.name + '_bucket', labels, ('le', _fmt(float(bound))), cumulative
+            yield self.name + '_sum', labels, None, sum_
+            yield self.name + '_count', labels, None, count
+
+
+class Gauge:
+    """A value that is set directly, or read from `fn` at scrape time.
+    `fn` returns a number, or {label_values_tuple: number} for labelled gauges."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def samples(self):
+        if self.fn is not None:
+            value = self.fn()
+            values = value if isinstance(value, dict) else {(): value}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, labels, None, value
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, help_text, labelnames=()):
+    return _register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+def gauge(name, help_text, labelnames=(), fn=None):
+    return _register(Gauge(name, help_text, labelnames, fn))
+
+
+def render():
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        try:
+            for name, labels, extra, value in metric.samples():
+                lines.append(f'{name}{_label_str(metric.labelnames, labels, extra)} {_fmt(value)}')
+        except Exception as e:  # a failing callback must not break the whole scrape
+            lines.append(f'# {metric.name} unavailable: {type(e).__name__}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- metrics shared by several modules ---
+
+HTTP_REQUESTS = histogram('webwatch_http_request_seconds', 'HTTP request latency by endpoint and status',
+                          ['endpoint', 'method', 'status'])
+DB_QUERY = histogram('webwatch_db_query_seconds', 'SQLite statement time by call type', ['op'])
+UPLOAD_BYTES = counter('webwatch_upload_bytes_total', 'Recording bytes received', ['kind'])
+UPLOAD_SECONDS = histogram('webwatch_upload_seconds', 'Upload request latency', ['kind'],
+                           buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+SIGNALING_MESSAGES = counter('webwatch_signaling_messages_total', 'Relayed signaling messages by event', ['event'])
+SOCKET_CONNECTS = counter('webwatch_socket_connects_total', 'Socket.IO connections accepted')
+SOCKET_DISCONNECTS = counter('webwatch_socket_disconnects_total', 'Socket.IO disconnections')
+SOCKETS_CONNECTED = gauge('webwatch_sockets_connected', 'Socket.IO clients currently connected')
+
+
+def init_app(app):
+    """Time every HTTP request (by endpoint name, so path parameters don't explode the label set)."""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            HTTP_REQUESTS.observe(time.perf_counter() - start,
+                                  request.endpoint or 'unmatched', request.method, str(response.status_code))
+        return response
@@ -0,0 +1,198 @@
+"""
+Motion detection over uploaded recordings.
+
+Each new recording is decoded by ffmpeg at low resolution and frame rate,
+straight to raw grayscale frames on a pipe. Motion is scored with NumPy frame
+differencing: for each pair of consecutive frames, the fraction of pixels
+whose brightness changed by more than MOTION_PIXEL_DELTA. Seconds whose best
+score reaches MOTION_THRESHOLD are merged into intervals and stored in the
+motion_intervals table (see setup_db.py).
+
+The decode + scoring runs as a "motion" job in the job worker pool
+(services/jobs.py: CPU only, never on a request thread); only the small list
+of intervals comes back to the server process to be saved.
+Needs the `numpy` package and an `ffmpeg` binary on PATH; without them the
+analysis is skipped with a warning. A recording ffmpeg can't decode to the
+end fails the job (and is retried), instead of being saved as "no motion".
+"""
+
+import importlib.util
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from config import Config
+from services import db, events, jobs
+
+logger = logging.getLogger(__name__)
+
+# Frames are processed in blocks so memory stays flat for long recordings
+FRAMES_PER_BLOCK = 256
+
+
+class MotionError(Exception):
+    pass
+
+
+def decode_gray_frames(path, width, height, fps):
+    """
+    Yield (H, W) uint8 arrays from ffmpeg, `fps` frames per second of video.
+    Raises MotionError after the last frame if ffmpeg failed.
+    """
+    import numpy as np
+
+    cmd = [
+        Config.FFMPEG_BIN, '-v', 'error', '-nostdin', '-i', path,
+        '-vf', f'fps={fps},scale={width}:{height},format=gray',
+        '-f', 'rawvideo', '-',
+    ]
+    frame_size = width * height
+    # A file, not a pipe: nobody reads it until ffmpeg is done
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            while True:
+                buf = proc.stdout.read(frame_size)
+                if len(buf) < frame_size:
+                    break
+                yield np.frombuffer(buf, dtype=np.uint8).reshape(height, width)
+            proc.stdout.close()
+            code = proc.wait(timeout=60)
+        finally:
+            # Only still running if the consumer stopped early or the wait timed out
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+        if code != 0:
+            errors.seek(0)
+            message = errors.read().decode(errors='replace').strip()[-500:]
+            raise MotionError(f"ffmpeg exited with {code}: {message or 'no output'}")
+
+
+def frame_scores(frames, pixel_delta):
+    """
+    Motion score for every frame after the first: the fraction of pixels that
+    changed by more than `pixel_delta` since the previous frame. Vectorized per
+    block of frames; returns a 1-D float array.
+    """
+    import numpy as np
+
+    scores = []
+    prev = None
+    block = []
+
+    def flush(block, prev):
+        stack = np.stack(block).astype(np.int16)
+        if prev is not None:
+            stack = np.concatenate([prev[None], stack])
+        if len(stack) > 1:
+            changed = np.abs(np.diff(stack, axis=0)) > pixel_delta
+            scores.append(changed.mean(axis=(1, 2)))
+        return stack[-1]
+
+    for frame in frames:
+        block.append(frame)
+        if len(block) == FRAMES_PER_BLOCK:
+            prev = flush(block, prev)
+            block = []
+    if block:
+        flush(block, prev)
+    return np.concatenate(scores) if scores else np.zeros(0)
+
+
+def per_second(scores, fps):
+    """Collapse per-frame scores to the peak score of each second."""
+    import numpy as np
+
+    fps = max(1, int(fps))
+    seconds = -(-len(scores) // fps)
+    padded = np.zeros(seconds * fps)
+    padded[:len(scores)] = scores
+    return padded.reshape(seconds, fps).max(axis=1)
+
+
+def to_intervals(second_scores, threshold, max_gap=1):
+    """
+    Merge seconds at/above `threshold` into [(start_sec, end_sec, peak), ...].
+    Quiet gaps up to `max_gap` seconds inside motion are bridged.
+    """
+    import numpy as np
+
+    active = np.flatnonzero(second_scores >= threshold)
+    if active.size == 0:
+        return []
+    # Split where more than max_gap quiet seconds separate two active ones
+    breaks = np.flatnonzero(np.diff(active) > max_gap + 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [active.size - 1]])
+    intervals = []
+    for s, e in zip(starts, ends):
+        start_sec, end_sec = int(active[s]), int(active[e]) + 1
+        peak = float(second_scores[start_sec:end_sec].max())
+        intervals.append((start_sec, end_sec, round(peak, 4)))
+    return intervals
+
+
+def analyze_file(path):
+    """Worker-process entry point: decode `path` and return its motion intervals."""
+    import numpy as np
+
+    fps = Config.MOTION_FPS
+    frames = decode_gray_frames(path, Config.MOTION_WIDTH, Config.MOTION_HEIGHT, fps)
+    scores = frame_scores(frames, Config.MOTION_PIXEL_DELTA)
+    if len(scores) == 0:
+        return []
+    # scores[i] compares frames i and i+1; shift by one so index == frame number
+    scores = np.concatenate([[0.0], scores])
+    return to_intervals(per_second(scores, fps), Config.MOTION_THRESHOLD, Config.MOTION_MAX_GAP)
+
+
+def available():
+    # find_spec, not import: numpy is only loaded in the job worker processes
+    if importlib.util.find_spec('numpy') is None:
+        return False
+    return shutil.which(Config.FFMPEG_BIN) is not None
+
+
+def run_job(payload):
+    """Job handler (runs in a worker process)."""
+    return analyze_file(os.path.abspath(os.path.join(Config.RECORDINGS_DIR, payload['filename'])))
+
+
+def save_job_result(payload, intervals):
+    """Runs back in the server process once run_job has finished."""
+    if not save_intervals(payload['recording_id'], intervals):
+        return  # deleted while the job ran
+    if intervals:
+        events.record('motion', recording_id=payload['recording_id'], intervals=len(intervals),
+                      start_sec=intervals[0][0], peak_score=max(peak for _, _, peak in intervals))
+    logger.info("Motion analysis of %s: %d interval(s)", payload['filename'], len(intervals))
+
+
+def save_intervals(recording_id, intervals):
+    """Replace the recording's intervals. Returns False if the recording no longer exists."""
+    with db.transaction() as conn:
+        if conn.execute('SELECT 1 FROM recordings WHERE id = ?', (recording_id,)).fetchone() is None:
+            return False
+        conn.execute('DELETE FROM motion_intervals WHERE recording_id = ?', (recording_id,))
+        conn.executemany(
+            'INSERT INTO motion_intervals (recording_id, start_sec, end_sec, peak_score) VALUES (?, ?, ?, ?)',
+            [(recording_id, start, end, peak) for start, end, peak in intervals],
+        )
+    return True
+
+
+def submit(recording_id, filename):
+    """Queue a recording for analysis on the job queue; returns the job id."""
+    if not Config.MOTION_ANALYSIS:
+        return None
+    if not available():
+        logger.warning("Motion analysis skipped for %s: numpy or ffmpeg not available", filename)
+        return None
+    return jobs.enqueue('motion', {'recording_id': recording_id, 'filename': filename})
+
+
+jobs.register_handler('motion', run_job, on_result=save_job_result)
@@ -0,0 +1,218 @@
+"""
+Token-bucket rate limiting for Socket.IO events and HTTP routes.
+
+Every rule is (rate per second, burst). A bucket holds up to `burst` tokens,
+one call takes one, and tokens come back at `rate` per second. A client
+that stays under the rate never notices; a burst is fine up to `burst`; a
+flood is refused until the bucket has refilled.
+
+Buckets are keyed (rule, scope value): per socket id, per client IP, per
+room code. A handler is usually checked against several at once, e.g. an
+ice-candidate against the sender's `ice` bucket, its IP's `socket_ip`
+bucket (all sockets from one address together) and the room's `room_relay`
+bucket (everyone in the room together). All of them must have a token or
+none is taken, so a refused call doesn't drain the others. Streamed media
+(ingest_chunk) also spends a byte budget, one token per byte, sized for a
+camera's bitrate (check_bytes).
+
+State is one dict of key -> [tokens, last update] under one lock. Refill is
+lazy: tokens are topped up from the elapsed time when a bucket is touched,
+no timer per bucket. A bucket that has been idle long enough to be full
+again is the same as no bucket, so a sweep every RATE_LIMIT_EVICT_INTERVAL
+seconds (done by whichever call comes next, no thread) drops those; socket
+buckets also go on disconnect. Memory is bounded by the clients active in
+the last few seconds.
+
+Throttled calls get:
+- Socket.IO: the ack {"status": "throttled", "event", "retry_after_ms"}, and
+  a `throttled` event with the same payload (at most one per second per
+  socket, for handlers the client calls without an ack).
+- HTTP: 429 {"error", "retry_after"} with Retry-After.
+
+Rules and defaults are in config.py (RATE_LIMITS); RATE_LIMIT=False turns
+every check off.
+"""
+
+import functools
+import logging
+import math
+import threading
+import time
+
+from flask import jsonify, request
+from flask_socketio import emit
+
+from config import Config
+from services.metrics import counter, gauge
+from services.room_registry import registry
+
+logger = logging.getLogger(__name__)
+
+THROTTLED = counter('webwatch_throttled_total', 'Calls refused by the rate limiter, by rule', ['rule'])
+
+# One `throttled` event per second per socket, however hard it floods
+_NOTICE = (1.0, 1)
+
+
+class RateLimiter:
+    def __init__(self, rules, evict_interval):
+        self.rules = dict(rules)
+        self.rules.setdefault('notice', _NOTICE)
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._buckets = {}  # (rule, scope) -> [tokens, last update (monotonic)]
+        self._next_evict = time.monotonic() + evict_interval
+
+    def take(self, keys, cost=1):
+        """
+        Take `cost` tokens from every bucket in `keys` ((rule, scope) pairs),
+        or from none. Returns (None, 0) when allowed, else (rule that refused,
+        seconds until it has the tokens).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_evict:
+                self._evict(now)
+            levels = []
+            refused, wait = None, 0
+            for key in keys:
+                rate, burst = self.rules[key[0]]
+                bucket = self._buckets.get(key)
+                tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+                if tokens < cost:
+                    missing = (cost - tokens) / rate
+                    if missing > wait:
+                        refused, wait = key[0], missing
+                levels.append((key, tokens))
+            if refused is not None:
+                # Keep the refill so far; nothing is taken
+                for key, tokens in levels:
+                    self._buckets[key] = [tokens, now]
+                return refused, wait
+            for key, tokens in levels:
+                self._buckets[key] = [tokens - cost, now]
+        return None, 0
+
+    def refund(self, keys, cost=1):
+        """Give back tokens taken for a call that was then refused further on."""
+        with self._lock:
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket[0] = min(self.rules[key[0]][1], bucket[0] + cost)
+
+    def _evict(self, now):
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rules[key[0]][0] >= self.rules[key[0]][1]]
+        for key in full:
+            del self._buckets[key]
+        self._next_evict = now + self.evict_interval
+        if full:
+            logger.debug("Dropped %d idle rate limit bucket(s), %d left", len(full), len(self._buckets))
+
+    def forget(self, scope):
+        """Drop the per-socket buckets of `scope` (a sid that disconnected)."""
+        with self._lock:
+            for rule in self.rules:
+                self._buckets.pop((rule, scope), None)
+
+    def bucket_count(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+limiter = RateLimiter(Config.RATE_LIMITS, Config.RATE_LIMIT_EVICT_INTERVAL)
+gauge('webwatch_rate_limit_buckets', 'Rate limit buckets in memory', fn=limiter.bucket_count)
+
+
+def _retry_after_ms(wait):
+    return max(1, math.ceil(wait * 1000))
+
+
+def check_socket(event, rule, room=None):
+    """
+    Check the current Socket.IO event against `rule` for this socket, the
+    client's IP, and (for `room`) the room's relay budget. Returns None if
+    allowed, else the throttle payload (also pushed as a `throttled` event).
+    """
+    if not Config.RATE_LIMIT:
+        return None
+    keys = [(rule, request.sid), ('socket_ip', request.remote_addr)]
+    if room is not None:
+        keys.append(('room_relay', str(room)))
+    return _check(event, keys)
+
+
+def _byte_cost(rule, nbytes):
+    # A single payload larger than the burst would never fit: it empties the bucket instead
+    return min(nbytes, limiter.rules[rule][1])
+
+
+def check_bytes(event, rule, nbytes):
+    """
+    Spend `nbytes` of this socket's `rule` byte budget. Returns None if
+    allowed, else the throttle payload, like check_socket().
+    """
+    if not Config.RATE_LIMIT:
+        return None
+    return _check(event, [(rule, request.sid)], cost=_byte_cost(rule, nbytes))
+
+
+def refund_bytes(rule, nbytes):
+    """The payload check_bytes() let through was refused anyway (busy, out of order): it is resent later."""
+    if Config.RATE_LIMIT:
+        limiter.refund([(rule, request.sid)], _byte_cost(rule, nbytes))
+
+
+def _check(event, keys, cost=1):
+    refused, wait = limiter.take(keys, cost)
+    if refused is None:
+        return None
+    THROTTLED.inc(1, refused)
+    payload = {'status': 'throttled', 'event': event, 'rule': refused, 'retry_after_ms': _retry_after_ms(wait),
+               'message': 'Too many requests, slow down'}
+    if limiter.take([('notice', request.sid)])[0] is None:
+        emit('throttled', payload)
+        logger.info("Throttled %s from %s (%s, %s)", event, request.sid, refused, request.remote_addr)
+    return payload
+
+
+def throttled(event, rule, room_of=None):
+    """
+    Decorator for a Socket.IO handler: refused calls return the throttle
+    payload as their ack instead of running. `room_of(data)` names the room
+    whose budget the event also spends (relayed / broadcast events); only a
+    member of that room spends it, so a socket outside the room can't use
+    up the budget of the people in it (the handler refuses it anyway).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args):
+            room = None
+            if room_of is not None and args and isinstance(args[0], dict):
+                room = room_of(args[0])
+                if room is not None and str(room) not in registry.rooms_of(request.sid):
+                    room = None
+            refusal = check_socket(event, rule, room)
+            if refusal is not None:
+                return refusal
+            return handler(*args)
+        return wrapper
+    return decorator
+
+
+def limit_route(rule):
+    """Decorator for a Flask view: `rule` per client IP, 429 + Retry-After beyond it."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if Config.RATE_LIMIT:
+                refused, wait = limiter.take([(rule, request.remote_addr)])
+                if refused is not None:
+                    THROTTLED.inc(1, refused)
+                    retry_after = max(1, math.ceil(wait))
+                    return (jsonify({"error": "Too many requests, slow down", "retry_after": retry_after}),
+                            429, {'Retry-After': str(retry_after)})
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
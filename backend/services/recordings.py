@@ -0,0 +1,168 @@
+"""
+Recordings listing with keyset (cursor) pagination, and search.
+
+Pages are ordered newest first by (timestamp, id). Instead of OFFSET, the
+cursor carries the (timestamp, id) of the last row already sent, so fetching
+page 500 costs the same as page 1: one range scan on
+idx_recordings_time / idx_recordings_camera_time (see setup_db.py).
+
+Search (?q=) goes through recordings_fts, an FTS5 index over camera name,
+tags and notes that triggers keep in step with the table: the matching ids
+come from the index, the other filters and the page order from the indexes
+above.
+"""
+
+import base64
+import re
+from datetime import datetime, timezone
+
+from services import db
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def fts_query(text):
+    """Search box text -> FTS5 query: every word must match, as a prefix ("gar" finds "Garage")."""
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        raise InvalidQuery("q must contain at least one word")
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+_fts_available = None
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = db.query_one(
+            "SELECT 1 FROM sqlite_master WHERE name = 'recordings_fts'") is not None
+    return _fts_available
+
+
+def search_clause(column, text):
+    """(SQL, params) keeping rows whose recording `column` matches `text`."""
+    if not fts_available():
+        raise InvalidQuery("Search is not available (SQLite without FTS5)")
+    return f"{column} IN (SELECT rowid FROM recordings_fts WHERE recordings_fts MATCH ?)", [fts_query(text)]
+
+
+def parse_tags(value):
+    """List or comma separated string -> stored form "a,b" (None when empty)."""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(tag, str) for tag in value):
+        raise InvalidQuery("tags must be a list of strings")
+    tags = []
+    for tag in (tag.strip()[:50] for tag in value):
+        if tag and tag not in tags:
+            tags.append(tag)
+    return ','.join(tags) or None
+
+
+def encode_cursor(row):
+    raw = f"{row['timestamp']}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidQuery("Invalid cursor")
+
+
+def parse_time(value):
+    """Accept ISO 8601 and return SQLite's CURRENT_TIMESTAMP text format."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise InvalidQuery(f"Invalid time: {value}")
+    if parsed.tzinfo is not None:
+        # Stored timestamps are UTC (CURRENT_TIMESTAMP)
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _filters(camera_name=None, since=None, until=None, motion=None, q=None):
+    clauses, params = [], []
+    if q:
+        clause, clause_params = search_clause('id', q)
+        clauses.append(clause)
+        params.extend(clause_params)
+    if motion is not None:
+        # Served by idx_motion_intervals_recording
+        exists = "EXISTS (SELECT 1 FROM motion_intervals m WHERE m.recording_id = recordings.id)"
+        clauses.append(exists if motion else f"NOT {exists}")
+    if camera_name:
+        clauses.append("camera_name = ?")
+        params.append(camera_name)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(until)
+    return clauses, params
+
+
+def list_recordings(limit, cursor=None, camera_name=None, since=None, until=None, motion=None,
+                    with_count=False, q=None):
+    """
+    Return (rows, next_cursor, total). `total` is None unless with_count is set,
+    `next_cursor` is None on the last page. `motion` True/False keeps only
+    recordings with/without detected motion, `q` those matching the search.
+    """
+    since, until = parse_time(since), parse_time(until)
+    clauses, params = _filters(camera_name, since, until, motion, q)
+    total = None
+    if with_count:
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        total = db.query_one(f"SELECT COUNT(*) FROM recordings {where}", params)[0]
+
+    if cursor:
+        clauses.append("(timestamp, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    # Fetch one extra row to know whether there is a next page
+    rows = db.query(
+        f"SELECT * FROM recordings {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+        params + [limit + 1],
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor, total
+
+
+def motion_intervals(recording_id):
+    return db.query(
+        "SELECT start_sec, end_sec, peak_score FROM motion_intervals WHERE recording_id = ? ORDER BY start_sec",
+        (recording_id,),
+    )
+
+
+def update_metadata(recording_id, tags=None, notes=None):
+    """Set tags (list or "a,b") and / or notes; None leaves a field alone. False if there is no such recording."""
+    fields, params = [], []
+    if tags is not None:
+        fields.append("tags = ?")
+        params.append(parse_tags(tags))
+    if notes is not None:
+        if not isinstance(notes, str):
+            raise InvalidQuery("notes must be a string")
+        fields.append("notes = ?")
+        params.append(notes.strip()[:2000] or None)
+    if not fields:
+        raise InvalidQuery("Nothing to update: send tags and / or notes")
+    # The FTS triggers reindex the row
+    cursor = db.execute(f"UPDATE recordings SET {', '.join(fields)} WHERE id = ?", params + [recording_id])
+    return cursor.rowcount > 0
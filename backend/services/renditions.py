@@ -0,0 +1,116 @@
+"""
+Lower-bitrate renditions of recordings, and which one a viewer gets.
+
+services/transcode.py writes them next to the recording's file:
+
+    <name>.faststart.webm    same streams, remuxed with the seek index (Cues) up front
+    <name>.<rung>.webm       one per TRANSCODE_LADDER rung (e.g. 360p), VP9 / Opus
+    <name>.renditions.json   manifest, written last:
+                             {"source": {"kbps", "height", "duration"},
+                              "renditions": {"360p": {"kbps", "height", "size"}, ...}}
+
+Playback (routes/playback.py) keeps serving the original unless asked:
+
+- ?rendition=<name> serves that file ("original" for the upload itself).
+- ?rendition=auto (or ?max_kbps=N) picks one: the best rendition whose
+  bitrate fits the budget (max_kbps, else the Downlink client hint with some
+  headroom, or the smallest one for Save-Data: on), the fast-start copy
+  without a budget, the original when there are no renditions (yet). The
+  answer is a redirect to ?rendition=<name>, so the player's range requests
+  that follow all hit the same file even if the hint changes.
+
+Content-addressed recordings share one file, so they share its renditions.
+The files go when the original is unlinked (retention.on_unlink).
+"""
+
+import json
+import os
+
+from config import Config
+
+FASTSTART = 'faststart'
+ORIGINAL = 'original'
+AUTO = 'auto'
+EXT = '.webm'
+MANIFEST_SUFFIX = '.renditions.json'
+# Share of the reported downlink a rendition may use (the rest is headroom)
+DOWNLINK_HEADROOM = 0.8
+
+
+def parse_ladder(spec):
+    """"540p:540:1000,360p:360:500" -> [{"name", "height", "video_kbps"}, ...], best first."""
+    rungs = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            name, height, video_kbps = item.split(':')
+            rung = {'name': name, 'height': int(height), 'video_kbps': int(video_kbps)}
+        except ValueError:
+            raise ValueError(f"Bad TRANSCODE_LADDER entry {item!r}, expected name:height:video_kbps")
+        if name in (FASTSTART, ORIGINAL, AUTO) or not name.isalnum():
+            raise ValueError(f"Bad TRANSCODE_LADDER rung name {name!r}")
+        rungs.append(rung)
+    return sorted(rungs, key=lambda rung: -rung['video_kbps'])
+
+
+LADDER = parse_ladder(Config.TRANSCODE_LADDER)
+
+
+def rendition_path(path, name):
+    return f'{os.path.splitext(path)[0]}.{name}{EXT}'
+
+
+def manifest_path(path):
+    return os.path.splitext(path)[0] + MANIFEST_SUFFIX
+
+
+def load_manifest(path):
+    try:
+        with open(manifest_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(path, manifest):
+    target = manifest_path(path)
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, target)
+
+
+def available(path):
+    """{name: info} of the renditions of the original at `path` that are on disk."""
+    manifest = load_manifest(path)
+    if manifest is None:
+        return {}
+    return {name: info for name, info in manifest['renditions'].items()
+            if os.path.isfile(rendition_path(path, name))}
+
+
+def choose(path, budget_kbps=None):
+    """Name of the file to serve for the original at `path` (a rendition, or ORIGINAL)."""
+    found = available(path)
+    if not found:
+        return ORIGINAL
+    if budget_kbps is None:
+        return FASTSTART if FASTSTART in found else ORIGINAL
+    # The fast-start copy has the source's bitrate (unknown if it had no duration)
+    rated = [(info['kbps'], name) for name, info in found.items() if info.get('kbps')]
+    if not rated:
+        return FASTSTART if FASTSTART in found else ORIGINAL
+    fitting = [entry for entry in rated if entry[0] <= budget_kbps]
+    return max(fitting)[1] if fitting else min(rated)[1]
+
+
+def remove(path):
+    """Delete the renditions and manifest of the original at `path` (after it was unlinked)."""
+    manifest = load_manifest(path)
+    names = {FASTSTART} | {rung['name'] for rung in LADDER}
+    if manifest is not None:
+        names |= set(manifest['renditions'])
+    for target in [rendition_path(path, name) for name in sorted(names)] + [manifest_path(path)]:
+        try:
+            os.remove(target)
+        except FileNotFoundError:
+            pass
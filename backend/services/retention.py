@@ -0,0 +1,366 @@
+"""
+Storage retention for the recordings folder.
+
+Policies (config.py, 0 = off):
+- RETENTION_MAX_AGE_DAYS: recordings older than this are removed
+- RETENTION_CAMERA_MAX_BYTES: default byte quota per camera, overridable per
+  camera with RETENTION_CAMERA_QUOTAS ({"Front Door": 10737418240, ...})
+- RETENTION_MAX_BYTES: byte quota for all recordings together
+
+Eviction is oldest-first in batches of RETENTION_BATCH_SIZE: each batch is one
+transaction for the DB rows, then the files and their cached thumbnails are
+unlinked (a content-addressed file only once nothing else references it).
+Quotas count each recording's size, shared files included. Byte usage comes
+from a running size index (recordings.size_bytes, summed per camera once and
+then kept up to date on every add / delete), so a pass never re-stats the
+recordings folder.
+
+The byte quotas only count uploaded recordings. Streamed segments
+(services/ingest.py) expire by RETENTION_MAX_AGE_DAYS alone, and transcoded
+renditions go with their recording without being counted.
+
+A background thread runs a pass every RETENTION_INTERVAL seconds, and sooner
+when a new recording pushes a quota over; uploads only update the index.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+from services import blobs, db, events, metrics
+from services.concurrency import blocking
+
+logger = logging.getLogger(__name__)
+
+
+class SizeIndex:
+    """Bytes and recording count per camera, kept in step with the recordings table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cameras = None  # camera_name -> [bytes, count]
+
+    def _load(self):
+        if self._cameras is None:
+            rows = db.query(
+                'SELECT camera_name, COALESCE(SUM(size_bytes), 0), COUNT(*) FROM recordings GROUP BY camera_name')
+            self._cameras = {name: [total, count] for name, total, count in rows}
+        return self._cameras
+
+    # add / remove run after the row was inserted / deleted: if the totals are
+    # loaded only now, the DB sum already includes the change
+
+    def add(self, camera_name, size):
+        with self._lock:
+            if self._cameras is None:
+                self._load()
+                return
+            entry = self._cameras.setdefault(camera_name, [0, 0])
+            entry[0] += size or 0
+            entry[1] += 1
+
+    def remove(self, camera_name, size):
+        with self._lock:
+            if self._cameras is None:
+                self._load()
+                return
+            entry = self._cameras.get(camera_name)
+            if entry is None:
+                return
+            entry[0] -= size or 0
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._cameras[camera_name]
+
+    def camera_bytes(self, camera_name):
+        with self._lock:
+            return self._load().get(camera_name, (0, 0))[0]
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry[0] for entry in self._load().values())
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {'bytes': total, 'count': count} for name, (total, count) in self._load().items()}
+
+    def reset(self):
+        """Forget the totals; they are re-summed from the DB on next use."""
+        with self._lock:
+            self._cameras = None
+
+
+index = SizeIndex()
+
+# From the size index, so a scrape never walks the recordings folder
+metrics.gauge('webwatch_recordings_bytes', 'Bytes of finished recordings per camera', ['camera'],
+              fn=lambda: {(name, ): s['bytes'] for name, s in index.snapshot().items()})
+metrics.gauge('webwatch_recordings', 'Finished recordings per camera', ['camera'],
+              fn=lambda: {(name, ): s['count'] for name, s in index.snapshot().items()})
+metrics.gauge('webwatch_disk_free_bytes', 'Free space on the recordings filesystem',
+              fn=lambda: shutil.disk_usage(Config.RECORDINGS_DIR).free)
+metrics.gauge('webwatch_disk_total_bytes', 'Size of the recordings filesystem',
+              fn=lambda: shutil.disk_usage(Config.RECORDINGS_DIR).total)
+
+
+def camera_quota(camera_name):
+    return Config.RETENTION_CAMERA_QUOTAS.get(camera_name, Config.RETENTION_CAMERA_MAX_BYTES)
+
+
+def over_quota(camera_name=None):
+    if Config.RETENTION_MAX_BYTES and index.total_bytes() > Config.RETENTION_MAX_BYTES:
+        return True
+    if camera_name is not None:
+        quota = camera_quota(camera_name)
+        return bool(quota) and index.camera_bytes(camera_name) > quota
+    return False
+
+
+def recording_added(camera_name, size):
+    """Called when a recording is registered; wakes the scheduler if a quota is now exceeded."""
+    index.add(camera_name, size)
+    if _scheduler is not None and over_quota(camera_name):
+        _scheduler.wake()
+
+
+# Files derived from a recording's file (transcoded renditions), removed with it: fn(path)
+_unlink_hooks = []
+
+
+def on_unlink(fn):
+    if fn not in _unlink_hooks:
+        _unlink_hooks.append(fn)
+    return fn
+
+
+def _remove_files(paths):
+    """Unlinking large files can take a while; run through concurrency.blocking()."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove %s: %s", path, e)
+            continue
+        for hook in _unlink_hooks:
+            try:
+                hook(path)
+            except OSError as e:
+                logger.warning("Could not remove files derived from %s: %s", path, e)
+
+
+# Per-recording cleanup registered by other subsystems (cached thumbnails): fn(recording_id)
+_evict_hooks = []
+
+
+def on_evict(fn):
+    if fn not in _evict_hooks:
+        _evict_hooks.append(fn)
+    return fn
+
+
+def evict(rows, reason='evicted'):
+    """
+    Delete recordings (rows of _COLUMNS) in one transaction, then remove their
+    files and thumbnails. A content-addressed file (services/blobs.py) is only
+    removed once no recording references it. Returns bytes freed (recording
+    sizes, as counted by the size index).
+    """
+    if not rows:
+        return 0
+    with blobs.lock:
+        with db.transaction():
+            # Motion intervals go with the rows (ON DELETE CASCADE)
+            db.executemany('DELETE FROM recordings WHERE id = ?', [(row['id'],) for row in rows])
+            paths = blobs.release([row['blob_hash'] for row in rows if row['blob_hash']])
+        # Files from before content addressing belong to their one recording
+        paths += [os.path.join(Config.RECORDINGS_DIR, row['filename']) for row in rows if not row['blob_hash']]
+        blocking(_remove_files, paths)
+    freed = 0
+    for row in rows:
+        # The rows are gone already: a failing hook must not keep the rest of
+        # the batch out of the size index
+        for hook in _evict_hooks:
+            try:
+                hook(row['id'])
+            except Exception:
+                logger.exception("Cleanup hook %s failed for recording %s", getattr(hook, '__name__', hook),
+                                 row['id'])
+        events.record('delete', row['camera_name'], row['id'], reason=reason)
+        index.remove(row['camera_name'], row['size_bytes'])
+        freed += row['size_bytes'] or 0
+    return freed
+
+
+_COLUMNS = 'id, filename, camera_name, size_bytes, blob_hash'
+
+
+def delete_recording(recording_id):
+    """Remove one recording. Returns False if it does not exist."""
+    row = db.query_one(f'SELECT {_COLUMNS} FROM recordings WHERE id = ?', (recording_id,))
+    if row is None:
+        return False
+    evict([row], reason='deleted')
+    return True
+
+
+def _evict_until(where, params, excess):
+    """Evict oldest-first among rows matching `where` until `excess` bytes are freed."""
+    freed = removed = 0
+    while freed < excess:
+        rows = db.query(
+            f'SELECT {_COLUMNS} FROM recordings WHERE {where} ORDER BY timestamp, id LIMIT ?',
+            list(params) + [Config.RETENTION_BATCH_SIZE],
+        )
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            batch.append(row)
+            freed += row['size_bytes'] or 0
+            if freed >= excess:
+                break
+        evict(batch)
+        removed += len(batch)
+    return removed, freed
+
+
+def _expire_old():
+    cutoff = datetime.now(timezone.utc) - timedelta(days=Config.RETENTION_MAX_AGE_DAYS)
+    # recordings.timestamp is CURRENT_TIMESTAMP, i.e. UTC 'YYYY-MM-DD HH:MM:SS'
+    cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+    removed = freed = 0
+    while True:
+        rows = db.query(
+            f'SELECT {_COLUMNS} FROM recordings WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?',
+            (cutoff, Config.RETENTION_BATCH_SIZE),
+        )
+        if not rows:
+            return removed, freed
+        freed += evict(rows)
+        removed += len(rows)
+
+
+def _expire_old_segments():
+    """Streamed segments (services/ingest.py) follow the same max-age policy."""
+    cutoff = time.time() - Config.RETENTION_MAX_AGE_DAYS * 86400
+    removed = freed = 0
+    while True:
+        rows = db.query(
+            "SELECT id, filename, size_bytes FROM segments WHERE status = 'closed' AND start_time < ? "
+            "ORDER BY start_time LIMIT ?",
+            (cutoff, Config.RETENTION_BATCH_SIZE),
+        )
+        if not rows:
+            return removed, freed
+        db.executemany('DELETE FROM segments WHERE id = ?', [(row['id'],) for row in rows])
+        blocking(_remove_files, [os.path.join(Config.SEGMENTS_DIR, row['filename']) for row in rows])
+        for row in rows:
+            freed += row['size_bytes']
+        removed += len(rows)
+
+
+def run_once():
+    """One retention pass. Returns {"removed": n, "freed_bytes": n}."""
+    removed = freed = 0
+
+    if Config.RETENTION_MAX_AGE_DAYS:
+        n, b = _expire_old()
+        removed, freed = removed + n, freed + b
+        n, b = _expire_old_segments()
+        removed, freed = removed + n, freed + b
+
+    for camera_name, usage in index.snapshot().items():
+        quota = camera_quota(camera_name)
+        if quota and usage['bytes'] > quota:
+            n, b = _evict_until('camera_name = ?', (camera_name,), usage['bytes'] - quota)
+            removed, freed = removed + n, freed + b
+
+    if Config.RETENTION_MAX_BYTES:
+        excess = index.total_bytes() - Config.RETENTION_MAX_BYTES
+        if excess > 0:
+            n, b = _evict_until('1', (), excess)
+            removed, freed = removed + n, freed + b
+
+    if removed:
+        logger.info("Retention removed %d recording(s), %d bytes freed", removed, freed)
+    return {'removed': removed, 'freed_bytes': freed}
+
+
+def usage():
+    return {
+        'total_bytes': index.total_bytes(),
+        'max_bytes': Config.RETENTION_MAX_BYTES or None,
+        'max_age_days': Config.RETENTION_MAX_AGE_DAYS or None,
+        'cameras': {
+            name: dict(stats, quota=camera_quota(name) or None)
+            for name, stats in index.snapshot().items()
+        },
+    }
+
+
+class Scheduler:
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        # Only one pass at a time (scheduled, woken, or run from the API)
+        self.lock = threading.Lock()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop:
+            self._wake.clear()
+            try:
+                with self.lock:
+                    run_once()
+            except Exception:
+                logger.exception("Retention pass failed")
+            finally:
+                db.release_connection()
+            self._wake.wait(self.interval)
+
+
+_scheduler = None
+
+
+def run_now():
+    """Run a pass on the calling thread, serialized with the scheduled ones."""
+    if _scheduler is None:
+        return run_once()
+    with _scheduler.lock:
+        return run_once()
+
+
+def start():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(Config.RETENTION_INTERVAL)
+        _scheduler.start()
+        logger.info("Retention scheduler started (every %ds)", Config.RETENTION_INTERVAL)
+    return _scheduler
+
+
+def stop():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
@@ -0,0 +1,433 @@
+"""
+Room registry: who is in which 6-digit room, and as what (camera / viewer).
+
+The registry is a thin front over a pluggable state store, picked with
+ROOM_STATE_BACKEND in config.py:
+
+- "memory" (default): two dicts kept in step under one lock
+      rooms:  {"123456": {"sid_a": "viewer", "sid_b": "camera"}}
+      by_sid: {"sid_a": {"123456"}}
+  Fastest, but only valid for a single server process.
+
+- "sqlite": the same two indexes as a table in a shared SQLite file
+  (ROOM_STATE_PATH, primary key + sid index), so several worker processes on
+  one machine see the same rooms. Pair it with SOCKETIO_MESSAGE_QUEUE so
+  emit(..., room=...) reaches clients connected to the other workers.
+  Every row names the worker process that owns the socket, and each worker
+  holds a lease in `room_workers` that it renews every
+  ROOM_WORKER_HEARTBEAT seconds (start() / stop(), the `rooms` subsystem).
+  Rows of workers whose lease is older than ROOM_WORKER_TTL, i.e. that
+  crashed or were killed, are dropped by whichever worker renews next.
+  Issued pairing codes are reserved in `room_codes` too, so two workers
+  never hand out the same code (services/code_allocator.py).
+
+Either way join, leave and disconnect only touch the rooms the socket is in,
+never every room.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+
+from config import Config
+from services import metrics
+from services.code_allocator import allocator
+from services.concurrency import blocking
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryRoomStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rooms = {}
+        self._by_sid = {}
+
+    def join(self, code, sid, role):
+        with self._lock:
+            members = self._rooms.setdefault(code, {})
+            members[sid] = role
+            self._by_sid.setdefault(sid, set()).add(code)
+            return len(members)
+
+    def leave(self, code, sid):
+        with self._lock:
+            members = self._rooms.get(code)
+            if members is None or sid not in members:
+                return None
+            del members[sid]
+            codes = self._by_sid.get(sid)
+            if codes is not None:
+                codes.discard(code)
+                if not codes:
+                    del self._by_sid[sid]
+            if not members:
+                del self._rooms[code]
+                return 0
+            return len(members)
+
+    def remove_sid(self, sid):
+        with self._lock:
+            codes = self._by_sid.pop(sid, ())
+            result = []
+            for code in codes:
+                members = self._rooms.get(code)
+                if members is None:
+                    continue
+                members.pop(sid, None)
+                if not members:
+                    del self._rooms[code]
+                result.append((code, len(members)))
+            return result
+
+    def count(self, code):
+        with self._lock:
+            return len(self._rooms.get(code, ()))
+
+    def members(self, code):
+        with self._lock:
+            return dict(self._rooms.get(code, {}))
+
+    def role_of(self, code, sid):
+        with self._lock:
+            return self._rooms.get(code, {}).get(sid)
+
+    def rooms_of(self, sid):
+        with self._lock:
+            return set(self._by_sid.get(sid, ()))
+
+    def room_count(self):
+        with self._lock:
+            return len(self._rooms)
+
+    def member_count(self):
+        with self._lock:
+            return len(self._by_sid)
+
+
+class SqliteRoomStore:
+    """
+    Room state in a SQLite file shared by every worker process on the host.
+
+    Like services/db.py, the connection is looked up in the calling thread and
+    each call's statements (a whole transaction for writes) run through
+    concurrency.blocking(), so a query waiting on the file lock does not stall
+    the green-thread serving modes.
+    """
+
+    def __init__(self, path):
+        # Imported here so the memory backend does not pull in the DB layer
+        from services import db
+
+        self._connect = lambda: db.connect(path)
+        self._local = threading.local()
+        # Identifies rows owned by this process; a new process is a new worker,
+        # its predecessor's rows go when that one's lease expires
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{time.time():.0f}"
+        blocking(self._create_tables, self._conn())
+        self.heartbeat()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _run(self, fn, *args):
+        return blocking(fn, self._conn(), *args)
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS room_members (
+                code TEXT NOT NULL,
+                sid TEXT NOT NULL,
+                role TEXT NOT NULL,
+                worker TEXT NOT NULL,
+                joined_at REAL NOT NULL,
+                PRIMARY KEY (code, sid)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_room_members_sid ON room_members (sid)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_room_members_worker ON room_members (worker)')
+        # Pairing codes issued by some worker and not claimed by a room yet
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS room_codes (
+                code TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS room_workers (
+                worker TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+    @staticmethod
+    def _count(conn, code):
+        return conn.execute('SELECT COUNT(*) FROM room_members WHERE code = ?', (code,)).fetchone()[0]
+
+    @staticmethod
+    def _fetchone(conn, sql, params=()):
+        return conn.execute(sql, params).fetchone()
+
+    @staticmethod
+    def _fetchall(conn, sql, params=()):
+        return conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _execute(conn, sql, params=()):
+        conn.execute(sql, params)
+
+    def heartbeat(self, ttl=None):
+        """Renew this worker's lease, drop the rows of workers whose lease expired. Returns how many."""
+        now = time.time()
+        cutoff = now - (ttl if ttl is not None else Config.ROOM_WORKER_TTL)
+        return self._run(self._heartbeat, now, cutoff)
+
+    def _heartbeat(self, conn, now, cutoff):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT INTO room_workers (worker, seen_at) VALUES (?, ?) '
+                         'ON CONFLICT (worker) DO UPDATE SET seen_at = excluded.seen_at', (self.worker_id, now))
+            conn.execute('DELETE FROM room_workers WHERE seen_at < ?', (cutoff,))
+            # Also catches rows written before leases existed (no room_workers row at all)
+            cur = conn.execute('DELETE FROM room_members WHERE worker NOT IN (SELECT worker FROM room_workers)')
+            conn.execute('DELETE FROM room_codes WHERE expires_at <= ?', (now,))
+            return cur.rowcount
+
+    def close(self):
+        """Clean shutdown: this worker's sockets are gone, and so is its lease."""
+        self._run(self._close)
+
+    def _close(self, conn):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM room_members WHERE worker = ?', (self.worker_id,))
+            conn.execute('DELETE FROM room_workers WHERE worker = ?', (self.worker_id,))
+
+    def reserve_code(self, code, ttl):
+        """
+        Reserve a freshly drawn pairing code for `ttl` seconds, for every
+        worker. False if it is already reserved or its room is open.
+        """
+        return self._run(self._reserve_code, code, ttl)
+
+    @staticmethod
+    def _reserve_code(conn, code, ttl):
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM room_members WHERE code = ? LIMIT 1', (code,)).fetchone():
+                return False
+            conn.execute('DELETE FROM room_codes WHERE code = ? AND expires_at <= ?', (code, now))
+            cur = conn.execute('INSERT INTO room_codes (code, expires_at) VALUES (?, ?) '
+                               'ON CONFLICT (code) DO NOTHING', (code, now + ttl))
+            return cur.rowcount == 1
+
+    def claim_code(self, code):
+        self._run(self._execute, 'DELETE FROM room_codes WHERE code = ?', (code,))
+
+    def code_issued(self, code):
+        """True while some worker's reservation of `code` is unexpired, or its room is open."""
+        row = self._run(self._fetchone,
+                        'SELECT EXISTS (SELECT 1 FROM room_codes WHERE code = ? AND expires_at > ?) '
+                        'OR EXISTS (SELECT 1 FROM room_members WHERE code = ?)', (code, time.time(), code))
+        return bool(row[0])
+
+    def join(self, code, sid, role):
+        return self._run(self._join, code, sid, role)
+
+    def _join(self, conn, code, sid, role):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO room_members (code, sid, role, worker, joined_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (code, sid) DO UPDATE SET role = excluded.role',
+                (code, sid, role, self.worker_id, time.time()),
+            )
+            return self._count(conn, code)
+
+    def leave(self, code, sid):
+        return self._run(self._leave, code, sid)
+
+    def _leave(self, conn, code, sid):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            cur = conn.execute('DELETE FROM room_members WHERE code = ? AND sid = ?', (code, sid))
+            if cur.rowcount == 0:
+                return None
+            return self._count(conn, code)
+
+    def remove_sid(self, sid):
+        return self._run(self._remove_sid, sid)
+
+    def _remove_sid(self, conn, sid):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            codes = [row[0] for row in conn.execute('SELECT code FROM room_members WHERE sid = ?', (sid,))]
+            conn.execute('DELETE FROM room_members WHERE sid = ?', (sid,))
+            return [(code, self._count(conn, code)) for code in codes]
+
+    def count(self, code):
+        return self._run(self._count, code)
+
+    def members(self, code):
+        rows = self._run(self._fetchall,
+                         'SELECT sid, role FROM room_members WHERE code = ? ORDER BY joined_at', (code,))
+        return {sid: role for sid, role in rows}
+
+    def role_of(self, code, sid):
+        row = self._run(self._fetchone, 'SELECT role FROM room_members WHERE code = ? AND sid = ?', (code, sid))
+        return row[0] if row else None
+
+    def rooms_of(self, sid):
+        rows = self._run(self._fetchall, 'SELECT code FROM room_members WHERE sid = ?', (sid,))
+        return {row[0] for row in rows}
+
+    def room_count(self):
+        return self._run(self._fetchone, 'SELECT COUNT(DISTINCT code) FROM room_members')[0]
+
+    def member_count(self):
+        return self._run(self._fetchone, 'SELECT COUNT(DISTINCT sid) FROM room_members')[0]
+
+
+STORES = {
+    'memory': lambda: MemoryRoomStore(),
+    'sqlite': lambda: SqliteRoomStore(Config.ROOM_STATE_PATH),
+}
+
+
+class RoomRegistry:
+    """
+    Room membership front. Also keeps the pairing code allocator in step:
+    a code is claimed when its room opens and recycled when the room empties.
+    """
+
+    def __init__(self, store=None, codes=None):
+        self.store = store if store is not None else MemoryRoomStore()
+        self.codes = codes
+
+    def join(self, code, sid, role='viewer'):
+        """Add (or re-role) `sid` in room `code`. Returns the member count."""
+        total = self.store.join(code, sid, role)
+        if total == 1 and self.codes is not None:
+            self.codes.claim(code)
+        return total
+
+    def leave(self, code, sid):
+        """
+        Remove `sid` from room `code`.
+        Returns the remaining member count, 0 if the room was deleted,
+        or None if `sid` was not in the room.
+        """
+        remaining = self.store.leave(code, sid)
+        if remaining == 0 and self.codes is not None:
+            self.codes.release(code)
+        return remaining
+
+    def remove_sid(self, sid):
+        """Drop `sid` from every room it is in. Returns [(code, remaining), ...]."""
+        cleaned = self.store.remove_sid(sid)
+        if self.codes is not None:
+            for code, remaining in cleaned:
+                if remaining == 0:
+                    self.codes.release(code)
+        return cleaned
+
+    def exists(self, code):
+        return self.store.count(code) > 0
+
+    def count(self, code):
+        return self.store.count(code)
+
+    def members(self, code):
+        """Snapshot {sid: role} of the room (empty dict if it does not exist)."""
+        return self.store.members(code)
+
+    def role_of(self, code, sid):
+        return self.store.role_of(code, sid)
+
+    def rooms_of(self, sid):
+        return self.store.rooms_of(sid)
+
+    def room_count(self):
+        return self.store.room_count()
+
+    def member_count(self):
+        return self.store.member_count()
+
+
+def create_registry(backend=None):
+    backend = backend or Config.ROOM_STATE_BACKEND
+    if backend not in STORES:
+        raise ValueError(f"Unknown ROOM_STATE_BACKEND: {backend}")
+    store = STORES[backend]()
+    if isinstance(store, SqliteRoomStore):
+        # Workers share rooms, so they must not hand out the same code either
+        allocator.shared = store
+    return RoomRegistry(store, codes=allocator)
+
+
+# Shared instance used by the Socket.IO handlers (app.py, sockets/rooms.py)
+registry = create_registry()
+
+
+class Heartbeat:
+    """Renews the sqlite store's worker lease and expires dead workers' rows."""
+
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='room-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop:
+            self._wake.wait(self.interval)
+            if self._stop:
+                return
+            try:
+                removed = self.store.heartbeat()
+                if removed:
+                    logger.info("Dropped %d room membership(s) of expired workers", removed)
+            except Exception:
+                logger.exception("Room state heartbeat failed")
+
+
+_heartbeat = None
+
+
+def start():
+    """Keep this worker's lease alive (sqlite backend only; memory state dies with the process)."""
+    global _heartbeat
+    if _heartbeat is None and isinstance(registry.store, SqliteRoomStore):
+        registry.store.heartbeat()
+        _heartbeat = Heartbeat(registry.store, Config.ROOM_WORKER_HEARTBEAT)
+        _heartbeat.start()
+    return _heartbeat
+
+
+def stop():
+    global _heartbeat
+    if _heartbeat is not None:
+        _heartbeat.stop()
+        _heartbeat = None
+        registry.store.close()
+
+metrics.gauge('webwatch_rooms', 'Open rooms', fn=registry.room_count)
+metrics.gauge('webwatch_room_members', 'Sockets that are in at least one room', fn=registry.member_count)
@@ -0,0 +1,190 @@
+"""
+Snapshot relay: one upstream per camera, any number of viewers.
+
+A WebRTC viewer costs the phone one more encoder. In snapshot mode the
+camera instead pushes JPEG frames (a few per second, or one every few
+seconds) over its socket (`snapshot_frame`, sockets/snapshots.py), and the
+server fans them out:
+
+- GET /api/snapshots/<code>/latest        the newest frame (ETag per frame, 304 if unchanged)
+- GET /api/snapshots/<code>/stream        multipart/x-mixed-replace MJPEG, for <img src>
+- subscribe_snapshots {"code"}            `snapshot` events with the frame bytes
+
+Each room keeps its last SNAPSHOT_RING_SIZE frames in a ring (a deque with
+maxlen), so memory is bounded by rooms x ring x SNAPSHOT_MAX_BYTES. A frame
+is an immutable bytes object stored once: every HTTP response, MJPEG part
+and Socket.IO broadcast hands out that same object, so a frame costs one
+copy however many viewers there are. MJPEG streams wait on the room's
+Condition for the next frame, and a slow viewer skips frames instead of
+queueing them.
+
+Only the socket that joined the room as its camera may publish, and only
+the first one to do so: frames from a second camera socket in the same room
+are refused (409) while the ring has its publisher. The ring is dropped when
+that socket leaves the room or disconnects, which ends the open streams and
+lets the next camera (the reconnected phone) publish.
+
+Reading needs what joining the room needs: a valid token (AUTH_REQUIRED)
+and the room code. A socket subscriber must have joined the room; the HTTP
+routes have no socket to check, and take the token and code in the URL
+instead (see routes/snapshots.py).
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from config import Config
+from services.metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+JPEG_SOI = b'\xff\xd8'
+MIME_TYPE = 'image/jpeg'
+
+SNAPSHOT_FRAMES = counter('webwatch_snapshot_frames_total', 'Snapshot frames received from cameras')
+SNAPSHOT_BYTES_OUT = counter('webwatch_snapshot_bytes_out_total', 'Snapshot bytes sent to viewers', ['via'])
+
+
+class SnapshotError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class Frame:
+    __slots__ = ('seq', 'data', 'timestamp')
+
+    def __init__(self, seq, data, timestamp):
+        self.seq = seq
+        self.data = data
+        self.timestamp = timestamp
+
+    @property
+    def etag(self):
+        return f'{int(self.timestamp * 1000):x}-{self.seq}'
+
+    def info(self):
+        return {'seq': self.seq, 'timestamp': self.timestamp, 'size': len(self.data)}
+
+
+class Ring:
+    """A room's last frames, newest at the right, and the viewers waiting for the next one."""
+
+    def __init__(self, publisher, size):
+        self.publisher = publisher
+        self.frames = deque(maxlen=size)
+        self.changed = threading.Condition()
+        self.closed = False
+        self.last_push = 0.0
+
+    def latest(self):
+        return self.frames[-1] if self.frames else None
+
+
+class SnapshotRelay:
+    def __init__(self, ring_size):
+        self.ring_size = ring_size
+        self._lock = threading.Lock()
+        self._rings = {}       # room code -> Ring
+        self._by_sid = {}      # publisher sid -> room codes
+        self._seq = 0
+
+    def publish(self, code, sid, data):
+        """Store a frame from `sid` (the room's camera) in room `code`. Returns it."""
+        if not isinstance(data, (bytes, bytearray)) or not data.startswith(JPEG_SOI):
+            raise SnapshotError('Frame must be JPEG bytes')
+        if len(data) > Config.SNAPSHOT_MAX_BYTES:
+            raise SnapshotError(f'Frame larger than {Config.SNAPSHOT_MAX_BYTES} bytes', 413)
+        # The one copy: a bytes payload from the socket is kept as is
+        data = bytes(data)
+        now = time.time()
+        with self._lock:
+            ring = self._rings.get(code)
+            if ring is not None and ring.publisher != sid:
+                # The viewers keep the feed they have; it ends when its publisher goes
+                raise SnapshotError('Another camera is publishing in this room', 409)
+            if ring is None:
+                ring = self._rings[code] = Ring(sid, self.ring_size)
+                self._by_sid.setdefault(sid, set()).add(code)
+            if now - ring.last_push < Config.SNAPSHOT_MIN_INTERVAL_MS / 1000:
+                raise SnapshotError('busy', 429)
+            ring.last_push = now
+            self._seq += 1
+            frame = Frame(self._seq, data, now)
+        with ring.changed:
+            ring.frames.append(frame)
+            ring.changed.notify_all()
+        SNAPSHOT_FRAMES.inc()
+        return frame
+
+    def latest(self, code):
+        with self._lock:
+            ring = self._rings.get(code)
+        return ring.latest() if ring is not None else None
+
+    def recent(self, code):
+        """The frames in room `code`'s ring, oldest first."""
+        with self._lock:
+            ring = self._rings.get(code)
+        return list(ring.frames) if ring is not None else []
+
+    def wait(self, code, after_seq, timeout):
+        """
+        The newest frame of room `code` newer than `after_seq`, waiting up to
+        `timeout` seconds for one. None on timeout, or when the room's camera
+        is gone.
+        """
+        with self._lock:
+            ring = self._rings.get(code)
+        if ring is None:
+            return None
+        with ring.changed:
+            frame = ring.latest()
+            if (frame is None or frame.seq <= after_seq) and not ring.closed:
+                ring.changed.wait(timeout)
+                frame = ring.latest()
+            if ring.closed or frame is None or frame.seq <= after_seq:
+                return None
+            return frame
+
+    def is_active(self, code):
+        with self._lock:
+            return code in self._rings
+
+    def _close(self, code):
+        ring = self._rings.pop(code, None)
+        if ring is None:
+            return
+        codes = self._by_sid.get(ring.publisher)
+        if codes is not None:
+            codes.discard(code)
+            if not codes:
+                del self._by_sid[ring.publisher]
+        with ring.changed:
+            ring.closed = True
+            ring.changed.notify_all()
+        logger.debug("Snapshot ring of room %s closed", code)
+
+    def stop_publishing(self, code, sid):
+        """`sid` left room `code`: drop the ring if it was the publisher."""
+        with self._lock:
+            ring = self._rings.get(code)
+            if ring is not None and ring.publisher == sid:
+                self._close(code)
+
+    def forget(self, sid):
+        """Disconnect hook: drop the rings `sid` published."""
+        with self._lock:
+            for code in list(self._by_sid.get(sid, ())):
+                self._close(code)
+
+    def room_count(self):
+        with self._lock:
+            return len(self._rings)
+
+
+relay = SnapshotRelay(Config.SNAPSHOT_RING_SIZE)
+gauge('webwatch_snapshot_rooms', 'Rooms with a live snapshot feed', fn=relay.room_count)
@@ -0,0 +1,223 @@
+"""
+Poster frames and scrubbing sprites for recordings, with an on-disk LRU cache.
+
+Images are extracted once with ffmpeg and kept under THUMBNAIL_CACHE_DIR as
+    <recording_id>-<mtime_ns>-<kind>.jpg
+so a changed recording never serves a stale image. The cache is bounded by
+THUMBNAIL_CACHE_MAX_BYTES: an in-memory OrderedDict tracks entries in
+least-recently-used order (rebuilt from file access times on startup; hits
+set the atime explicitly, leaving mtime - and so the ETag - alone), and the
+oldest files are deleted when a new one pushes it over.
+
+kinds:
+- poster: one 320px-wide frame from ~1s in
+- sprite: SPRITE_COLUMNS x SPRITE_ROWS tiles of 160x90 frames spread evenly
+  over the recording, for hover-scrubbing in the dashboard
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+from services import jobs
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('poster', 'sprite')
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+class DiskLRU:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # name -> size, least recently used first
+        self._by_recording = {}        # recording_id -> set of names
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith('.jpg'):
+                st = entry.stat()
+                files.append((st.st_atime, entry.name, st.st_size))
+        for _, name, size in sorted(files):
+            self._add(name, size)
+
+    def _add(self, name, size):
+        self._entries[name] = size
+        self._by_recording.setdefault(name.split('-', 1)[0], set()).add(name)
+        self.total += size
+
+    def _remove(self, name):
+        size = self._entries.pop(name)
+        self.total -= size
+        recording_key = name.split('-', 1)[0]
+        names = self._by_recording.get(recording_key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._by_recording[recording_key]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        """Path of a cached entry (marking it recently used), or None."""
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = self.path(name)
+        try:
+            # Record the access for the next startup; mtime stays (it is the ETag)
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            with self._lock:
+                if name in self._entries:
+                    self._remove(name)
+            return None
+        return path
+
+    def put(self, name):
+        """Register a file already written into the cache dir and evict as needed."""
+        size = os.path.getsize(self.path(name))
+        with self._lock:
+            if name in self._entries:
+                self._remove_entry_only(name)
+            self._add(name, size)
+            while self.total > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove_entry_only(self, name):
+        self.total -= self._entries.pop(name)
+
+    def invalidate(self, recording_id):
+        with self._lock:
+            for name in list(self._by_recording.get(str(recording_id), ())):
+                self._remove(name)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+# One generation per key at a time; concurrent requests wait for it
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskLRU(Config.THUMBNAIL_CACHE_DIR, Config.THUMBNAIL_CACHE_MAX_BYTES)
+        return _cache
+
+
+def cache_name(recording_id, video_path, kind):
+    return f"{recording_id}-{os.stat(video_path).st_mtime_ns}-{kind}.jpg"
+
+
+def _probe_duration(video_path):
+    ffprobe = shutil.which(Config.FFPROBE_BIN)
+    if ffprobe is None:
+        return None
+    try:
+        out = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', video_path],
+            capture_output=True, text=True, timeout=30,
+        ).stdout.strip()
+        return float(out)
+    except (ValueError, subprocess.SubprocessError):
+        return None
+
+
+def extract(video_path, out_path, kind):
+    """Run ffmpeg to write the `kind` image for `video_path` to `out_path`."""
+    if kind == 'poster':
+        args = ['-ss', '1', '-i', video_path, '-frames:v', '1', '-vf', 'scale=320:-2']
+    else:
+        tiles = Config.SPRITE_COLUMNS * Config.SPRITE_ROWS
+        duration = _probe_duration(video_path) or tiles
+        interval = max(duration / tiles, 0.1)
+        args = ['-i', video_path, '-frames:v', '1', '-vf',
+                f'fps=1/{interval:.3f},scale=160:90,tile={Config.SPRITE_COLUMNS}x{Config.SPRITE_ROWS}']
+    tmp_path = out_path + '.tmp.jpg'
+    cmd = [Config.FFMPEG_BIN, '-v', 'error', '-nostdin', '-y'] + args + ['-q:v', '5', tmp_path]
+    result = subprocess.run(cmd, capture_output=True, timeout=120)
+    if (result.returncode != 0 or not os.path.exists(tmp_path)) and kind == 'poster':
+        # Clip shorter than 1s: take the very first frame instead
+        cmd[cmd.index('-ss') + 1] = '0'
+        result = subprocess.run(cmd, capture_output=True, timeout=120)
+    if result.returncode != 0 or not os.path.exists(tmp_path):
+        raise ThumbnailError(result.stderr.decode(errors='replace').strip() or "ffmpeg produced no image")
+    os.replace(tmp_path, out_path)
+
+
+def get_thumbnail(recording_id, video_path, kind='poster'):
+    """Return the path of the cached image, generating it on first use."""
+    if kind not in KINDS:
+        raise ThumbnailError(f"Unknown thumbnail kind: {kind}")
+    cache = get_cache()
+    name = cache_name(recording_id, video_path, kind)
+    path = cache.get(name)
+    if path is not None:
+        return path
+
+    with _inflight_lock:
+        lock = _inflight.setdefault(name, threading.Lock())
+    try:
+        with lock:
+            path = cache.get(name)
+            if path is None:
+                if shutil.which(Config.FFMPEG_BIN) is None:
+                    raise ThumbnailError("ffmpeg is not available")
+                extract(video_path, cache.path(name), kind)
+                cache.put(name)
+                path = cache.path(name)
+    finally:
+        # Also when ffmpeg failed, or the entry would stay forever. Only our
+        # own lock: a late waiter must not drop a newer caller's
+        with _inflight_lock:
+            if _inflight.get(name) is lock:
+                del _inflight[name]
+    return path
+
+
+def run_job(payload):
+    """Job handler (worker process): pre-render the poster right after upload."""
+    video_path = os.path.join(Config.RECORDINGS_DIR, payload['filename'])
+    name = cache_name(payload['recording_id'], video_path, 'poster')
+    os.makedirs(Config.THUMBNAIL_CACHE_DIR, exist_ok=True)
+    extract(video_path, os.path.join(Config.THUMBNAIL_CACHE_DIR, name), 'poster')
+    return name
+
+
+def register_job_result(payload, name):
+    get_cache().put(name)
+
+
+def submit(recording_id, filename):
+    if shutil.which(Config.FFMPEG_BIN) is None:
+        return None
+    return jobs.enqueue('thumbnail', {'recording_id': recording_id, 'filename': filename})
+
+
+def invalidate(recording_id):
+    get_cache().invalidate(recording_id)
+
+
+jobs.register_handler('thumbnail', run_job, on_result=register_job_result)
@@ -0,0 +1,317 @@
+"""
+Wall-clock timeline per camera: seek and clip export across recordings and
+streamed segments.
+
+Index:
+- recordings get start_time / end_time / duration_sec (epoch seconds) and
+  their video keyframes (keyframes table: offset in the file + byte position)
+  from an "index" job that runs ffprobe once after upload. start_time is set
+  at upload when the start is known (declared by the camera, or the first
+  chunk of a resumable upload, see services/upload_service.py) and end_time =
+  start_time + duration. Otherwise end_time is the upload time and
+  start_time = end_time - duration.
+- streamed segments (services/ingest.py) already carry start_time / end_time,
+  and each one starts on a keyframe.
+
+seek(camera, t) answers "which file, which offset, which byte" for one instant.
+export(camera, start, end) streams a window as one Matroska file: ffmpeg's
+concat demuxer stitches the overlapping files with inpoint / outpoint and
+`-c copy`, cutting on keyframes, so nothing is re-encoded. Where files
+overlap (an uploaded clip and the streamed segments of the same camera) each
+one starts where the previous one ended, at its first keyframe from there,
+so no stretch of time is exported twice. The first block is read before the
+response starts, so an ffmpeg that fails outright is a 502, not an empty 200.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+from config import Config
+from services import db, jobs
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK = 256 * 1024
+
+
+class TimelineError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def parse_epoch(value):
+    """Epoch seconds or ISO 8601 (naive = UTC). None for empty values; ValueError if invalid."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _sqlite_epoch(timestamp):
+    """recordings.timestamp ('YYYY-MM-DD HH:MM:SS', UTC) -> epoch seconds."""
+    return datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+# --- indexing (job) ---
+
+def probe_keyframes(path):
+    """Return (duration, [(offset_sec, byte_pos), ...]) for the first video stream."""
+    cmd = [
+        Config.FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,pos,flags', '-of', 'csv=p=0', path,
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True, timeout=300, check=True).stdout
+    duration = 0.0
+    keyframes = []
+    for line in out.splitlines():
+        fields = line.split(',')
+        if len(fields) < 3:
+            continue
+        try:
+            t = float(fields[0])
+        except ValueError:
+            continue  # N/A
+        duration = max(duration, t)
+        if 'K' in fields[2]:
+            pos = int(fields[1]) if fields[1].isdigit() else None
+            keyframes.append((round(t, 3), pos))
+    return duration, keyframes
+
+
+def run_job(payload):
+    """Job handler (worker process)."""
+    duration, keyframes = probe_keyframes(os.path.join(Config.RECORDINGS_DIR, payload['filename']))
+    return {'duration': duration, 'keyframes': keyframes}
+
+
+def save_job_result(payload, result):
+    recording_id = payload['recording_id']
+    row = db.query_one('SELECT timestamp, start_time FROM recordings WHERE id = ?', (recording_id,))
+    if row is None:
+        return  # deleted while the job ran
+    if row['start_time'] is not None:
+        start_time = row['start_time']
+        end_time = start_time + result['duration']
+    else:
+        end_time = _sqlite_epoch(row['timestamp'])
+        start_time = end_time - result['duration']
+    with db.transaction() as conn:
+        conn.execute('UPDATE recordings SET duration_sec = ?, start_time = ?, end_time = ? WHERE id = ?',
+                     (result['duration'], start_time, end_time, recording_id))
+        conn.execute('DELETE FROM keyframes WHERE recording_id = ?', (recording_id,))
+        conn.executemany('INSERT OR REPLACE INTO keyframes (recording_id, offset_sec, byte_pos) VALUES (?, ?, ?)',
+                         [(recording_id, t, pos) for t, pos in result['keyframes']])
+
+
+def available():
+    return shutil.which(Config.FFPROBE_BIN) is not None
+
+
+def submit(recording_id, filename):
+    if not available():
+        return None
+    return jobs.enqueue('index', {'recording_id': recording_id, 'filename': filename})
+
+
+def backfill():
+    """Queue indexing for recordings that were uploaded before the timeline existed."""
+    if not available():
+        return 0
+    pending = {job['payload']['recording_id'] for job in jobs.list_jobs(status=jobs.QUEUED, kind='index', limit=100000)}
+    # start_time may already be known from the upload; the duration only comes from here
+    rows = db.query('SELECT id, filename FROM recordings WHERE duration_sec IS NULL')
+    queued = 0
+    for row in rows:
+        if row['id'] not in pending:
+            submit(row['id'], row['filename'])
+            queued += 1
+    db.release_connection()
+    if queued:
+        logger.info("Queued timeline indexing for %d existing recording(s)", queued)
+    return queued
+
+
+jobs.register_handler('index', run_job, on_result=save_job_result)
+
+
+# --- queries ---
+
+def sources(camera_name, start, end):
+    """
+    Files of `camera_name` overlapping [start, end], in time order:
+    [{"kind", "id", "filename", "path", "start_time", "end_time"}, ...]
+    """
+    rows = db.query(
+        'SELECT id, filename, start_time, end_time FROM recordings '
+        'WHERE camera_name = ? AND end_time IS NOT NULL AND start_time <= ? AND end_time >= ?',
+        (camera_name, end, start),
+    )
+    found = [{'kind': 'recording', 'id': row['id'], 'filename': row['filename'],
+              'path': os.path.join(Config.RECORDINGS_DIR, row['filename']),
+              'start_time': row['start_time'], 'end_time': row['end_time']} for row in rows]
+    rows = db.query(
+        'SELECT id, filename, start_time, end_time FROM segments '
+        'WHERE camera_name = ? AND start_time <= ? AND end_time >= ?',
+        (camera_name, end, start),
+    )
+    found += [{'kind': 'segment', 'id': row['id'], 'filename': row['filename'],
+               'path': os.path.join(Config.SEGMENTS_DIR, row['filename']),
+               'start_time': row['start_time'], 'end_time': row['end_time']} for row in rows]
+    found.sort(key=lambda s: (s['start_time'], s['kind'], s['id']))
+    return found
+
+
+def keyframe_before(source, offset):
+    """(offset_sec, byte_pos) of the last keyframe at or before `offset` in the file."""
+    if source['kind'] == 'segment':
+        return 0.0, 0  # segments are cut on keyframes
+    row = db.query_one(
+        'SELECT offset_sec, byte_pos FROM keyframes WHERE recording_id = ? AND offset_sec <= ? '
+        'ORDER BY offset_sec DESC LIMIT 1',
+        (source['id'], offset),
+    )
+    return (row['offset_sec'], row['byte_pos']) if row else (0.0, 0)
+
+
+def keyframe_after(source, offset):
+    """offset_sec of the first keyframe at or after `offset` in the file, None if unknown."""
+    if source['kind'] == 'segment':
+        return None  # only the one at 0 is known
+    row = db.query_one(
+        'SELECT offset_sec FROM keyframes WHERE recording_id = ? AND offset_sec >= ? '
+        'ORDER BY offset_sec LIMIT 1',
+        (source['id'], offset),
+    )
+    return row['offset_sec'] if row else None
+
+
+def seek(camera_name, at):
+    """Where `camera_name`'s footage for instant `at` lives, or None."""
+    found = sources(camera_name, at, at)
+    if not found:
+        return None
+    source = found[-1]  # latest file wins if two overlap
+    offset = max(0.0, at - source['start_time'])
+    keyframe_offset, byte_pos = keyframe_before(source, offset)
+    return {
+        'kind': source['kind'],
+        'id': source['id'],
+        'filename': source['filename'],
+        'start_time': source['start_time'],
+        'end_time': source['end_time'],
+        'offset_sec': round(offset, 3),
+        'keyframe_offset_sec': keyframe_offset,
+        'byte_offset': byte_pos,
+    }
+
+
+def _concat_list(parts):
+    lines = ['ffconcat version 1.0']
+    for path, inpoint, outpoint in parts:
+        escaped = os.path.abspath(path).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+        if inpoint > 0:
+            lines.append(f'inpoint {inpoint:.3f}')
+        if outpoint is not None:
+            lines.append(f'outpoint {outpoint:.3f}')
+    return '\n'.join(lines) + '\n'
+
+
+def export(camera_name, start, end):
+    """
+    Stream [start, end] of `camera_name` as Matroska bytes (a generator).
+    Raises TimelineError if the window is invalid or has no footage.
+    """
+    if end <= start:
+        raise TimelineError("end must be after start")
+    if end - start > Config.EXPORT_MAX_SECONDS:
+        raise TimelineError(f"Export window is limited to {Config.EXPORT_MAX_SECONDS} seconds")
+    if shutil.which(Config.FFMPEG_BIN) is None:
+        raise TimelineError("ffmpeg is not available", 503)
+
+    parts = []
+    covered = start  # exported up to here
+    for source in sources(camera_name, start, end):
+        if not os.path.exists(source['path']) or source['end_time'] <= covered:
+            continue
+        inpoint = 0.0
+        if covered > start and covered > source['start_time']:
+            # Overlaps the previous file: pick up where it ended
+            offset = covered - source['start_time']
+            inpoint = keyframe_after(source, offset)
+            if inpoint is None:
+                inpoint = offset
+            if source['start_time'] + inpoint >= min(end, source['end_time']):
+                continue
+        elif start > source['start_time']:
+            inpoint, _ = keyframe_before(source, start - source['start_time'])
+        outpoint = end - source['start_time'] if end < source['end_time'] else None
+        parts.append((source['path'], inpoint, outpoint))
+        covered = min(end, source['end_time'])
+    if not parts:
+        raise TimelineError("No footage in that window", 404)
+
+    list_file = tempfile.NamedTemporaryFile('w', suffix='.ffconcat', delete=False)
+    list_file.write(_concat_list(parts))
+    list_file.close()
+    cmd = [
+        Config.FFMPEG_BIN, '-v', 'error', '-nostdin', '-f', 'concat', '-safe', '0', '-i', list_file.name,
+        '-c', 'copy', '-f', 'matroska', '-',
+    ]
+    # A file, not a pipe: nobody reads it until ffmpeg is done
+    errors = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+
+    def finish(complete):
+        proc.stdout.close()
+        if not complete:
+            proc.kill()  # the client went away
+        try:
+            code = proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            code = proc.wait()
+        os.remove(list_file.name)
+        errors.seek(0)
+        message = errors.read().decode(errors='replace').strip()[-500:]
+        errors.close()
+        return code, message
+
+    first = proc.stdout.read(EXPORT_CHUNK)
+    if not first:
+        code, message = finish(True)
+        logger.error("Export of %s [%s, %s] failed (ffmpeg exit %s): %s", camera_name, start, end, code, message)
+        raise TimelineError("Export failed", 502)
+
+    def stream():
+        done = False
+        try:
+            yield first
+            while True:
+                block = proc.stdout.read(EXPORT_CHUNK)
+                if not block:
+                    break
+                yield block
+            done = True
+        finally:
+            # Also when the client went away (GeneratorExit), which ends here
+            code, message = finish(done)
+        if code != 0:
+            logger.error("Export of %s [%s, %s] failed mid-stream (ffmpeg exit %s): %s",
+                         camera_name, start, end, code, message)
+            # The 200 is already sent: break the transfer so the client sees a truncated file
+            raise TimelineError("Export failed", 502)
+
+    return stream()
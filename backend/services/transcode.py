@@ -0,0 +1,163 @@
+"""
+Background transcoding of new recordings into a bitrate ladder.
+
+One `transcode` job per recording (services/jobs.py, so the encoding runs on
+the worker processes, never on a request thread):
+
+1. Remux the original with the seek index up front (stream copy, cheap):
+   MediaRecorder files have no Cues and no duration, so players can't seek
+   them until the whole file is downloaded.
+2. Probe that copy for duration and height; the source bitrate is size / duration.
+3. Encode every TRANSCODE_LADDER rung that is smaller than the source (no
+   upscaling, no rung within 80% of the source bitrate) with libvpx-vp9 in
+   realtime mode / Opus, TRANSCODE_THREADS threads each.
+4. Write the manifest (services/renditions.py) that makes them visible to playback.
+
+Every output is written to a temporary name and renamed, so a file that
+exists is complete: a retried job (JOB_MAX_ATTEMPTS) skips what is done, and
+the second recording of a shared content-addressed file finds the manifest
+and does nothing.
+"""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+
+from config import Config
+from services import jobs, renditions
+
+logger = logging.getLogger(__name__)
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def _run(cmd):
+    result = subprocess.run(cmd, capture_output=True, timeout=Config.TRANSCODE_TIMEOUT)
+    if result.returncode != 0:
+        raise TranscodeError(result.stderr.decode(errors='replace').strip()[-500:] or f"{cmd[0]} failed")
+
+
+def _write(dst, args):
+    """Run ffmpeg with `args` into a temporary file, then move it to `dst`."""
+    tmp_path = f'{dst}.{os.getpid()}.tmp'
+    try:
+        _run([Config.FFMPEG_BIN, '-v', 'error', '-nostdin', '-y'] + args + ['-f', 'webm', '-cues_to_front', '1', tmp_path])
+        if not os.path.exists(tmp_path):
+            raise TranscodeError("ffmpeg produced no file")
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def probe(path):
+    """(duration seconds or None, video height or None)."""
+    result = subprocess.run(
+        [Config.FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+         'stream=height:format=duration', '-of', 'json', path],
+        capture_output=True, text=True, timeout=60,
+    )
+    try:
+        info = json.loads(result.stdout)
+    except ValueError:
+        return None, None
+    try:
+        duration = float(info.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+    streams = info.get('streams') or [{}]
+    return duration, streams[0].get('height')
+
+
+def faststart(src, dst):
+    _write(dst, ['-i', src, '-map', '0', '-c', 'copy'])
+
+
+def encode(src, dst, rung):
+    kbps = rung['video_kbps']
+    _write(dst, [
+        '-i', src, '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', f"scale=-2:{rung['height']}",
+        '-c:v', 'libvpx-vp9', '-b:v', f'{kbps}k', '-maxrate', f'{kbps * 3 // 2}k', '-bufsize', f'{kbps * 2}k',
+        '-deadline', 'realtime', '-cpu-used', '8', '-row-mt', '1', '-threads', str(Config.TRANSCODE_THREADS),
+        '-c:a', 'libopus', '-b:a', f'{Config.TRANSCODE_AUDIO_KBPS}k',
+    ])
+
+
+def transcode(path):
+    """Produce the fast-start copy and ladder renditions of `path`. Returns the manifest."""
+    if not os.path.exists(path):
+        # Deleted before the job ran
+        return None
+    manifest = renditions.load_manifest(path)
+    if manifest is not None and manifest.get('ladder') == Config.TRANSCODE_LADDER:
+        return manifest
+
+    made = {}
+    fast_path = renditions.rendition_path(path, renditions.FASTSTART)
+    try:
+        if not os.path.exists(fast_path):
+            faststart(path, fast_path)
+        made[renditions.FASTSTART] = {'size': os.path.getsize(fast_path)}
+    except TranscodeError as e:
+        # Not fatal: the ladder is encoded from the original instead
+        logger.warning("Fast-start remux of %s failed: %s", path, e)
+
+    duration, height = probe(fast_path if made else path)
+    size = os.path.getsize(path)
+    source_kbps = round(size * 8 / duration / 1000) if duration else None
+    if made:
+        made[renditions.FASTSTART].update(kbps=source_kbps, height=height)
+
+    for rung in renditions.LADDER:
+        kbps = rung['video_kbps'] + Config.TRANSCODE_AUDIO_KBPS
+        if height and rung['height'] >= height:
+            continue
+        if source_kbps and kbps >= source_kbps * 0.8:
+            continue
+        out_path = renditions.rendition_path(path, rung['name'])
+        if not os.path.exists(out_path):
+            encode(fast_path if made else path, out_path, rung)
+        made[rung['name']] = {'kbps': kbps, 'height': rung['height'], 'size': os.path.getsize(out_path)}
+
+    manifest = {
+        'ladder': Config.TRANSCODE_LADDER,
+        'source': {'kbps': source_kbps, 'height': height, 'duration': duration},
+        'renditions': made,
+    }
+    if not os.path.exists(path):
+        # Deleted while it was being encoded
+        renditions.remove(path)
+        return None
+    renditions.write_manifest(path, manifest)
+    return manifest
+
+
+def run_job(payload):
+    """Job handler (worker process)."""
+    manifest = transcode(os.path.join(Config.RECORDINGS_DIR, payload['filename']))
+    return sorted(manifest['renditions']) if manifest else []
+
+
+def save_job_result(payload, names):
+    logger.info("Transcoded %s: %s", payload['filename'], ', '.join(names) or 'nothing to do')
+
+
+def available():
+    return shutil.which(Config.FFMPEG_BIN) is not None and shutil.which(Config.FFPROBE_BIN) is not None
+
+
+def submit(recording_id, filename):
+    if not Config.TRANSCODE:
+        return None
+    if not available():
+        logger.warning("Transcoding skipped for %s: ffmpeg / ffprobe not available", filename)
+        return None
+    return jobs.enqueue('transcode', {'recording_id': recording_id, 'filename': filename})
+
+
+jobs.register_handler('transcode', run_job, on_result=save_job_result)
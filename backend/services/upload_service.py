@@ -0,0 +1,359 @@
+"""
+Chunked / resumable recording uploads.
+
+A phone opens an upload session, then sends the recording as a series of
+ordered chunks. Every chunk is streamed from the request body straight into
+the session's partial file (no multipart parsing, no temp-file spooling), and
+the current offset is simply the size of that file. If the connection drops,
+the client asks for the offset and carries on from there. Committing a session
+moves the partial file into the recordings folder and adds the DB row.
+
+Every upload is hashed while it streams in (for sessions, the SHA-256 state
+is carried from chunk to chunk in memory; after a restart the partial file is
+re-read once at commit) and stored content-addressed (services/blobs.py): a
+retried upload of the same clip returns the recording that already exists.
+A client may declare the hash up front ("sha256"): a session for a clip that
+is already stored is not opened at all, and a commit whose bytes don't match
+the declared hash is refused.
+
+Where the recording sits on the camera's timeline (services/timeline.py)
+comes from its start: "started_at" (epoch seconds) if the client sends it,
+else for a session the arrival of its first chunk, which is right for a
+phone that uploads while it records. Without either, the index job falls
+back to upload time minus duration.
+
+What happens to a new recording after that (motion analysis, thumbnails,
+timeline index) is up to the subsystems that are enabled: each registers
+itself with on_recording() (see app.py), so this module imports none of them.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+from services import blobs, db, events, retention
+from services.concurrency import blocking
+from services.metrics import UPLOAD_BYTES, UPLOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# One lock per active session so two requests can't append to the same file
+_session_locks = {}
+_session_locks_guard = threading.Lock()
+
+# session_id -> [bytes hashed, hasher], in step with the partial file
+_hashers = {}
+
+
+class UploadError(Exception):
+    """Raised for client-visible upload problems; carries the HTTP status."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+def _partial_dir():
+    os.makedirs(Config.UPLOAD_PARTIAL_DIR, exist_ok=True)
+    return Config.UPLOAD_PARTIAL_DIR
+
+
+def _paths(session_id):
+    if not _SESSION_ID_RE.match(session_id or ''):
+        raise UploadError("Upload session not found", 404)
+    base = os.path.join(_partial_dir(), session_id)
+    return base + '.part', base + '.json'
+
+
+def _lock_for(session_id):
+    with _session_locks_guard:
+        lock = _session_locks.get(session_id)
+        if lock is None:
+            lock = _session_locks[session_id] = threading.Lock()
+        return lock
+
+
+def _drop_lock(session_id):
+    with _session_locks_guard:
+        _session_locks.pop(session_id, None)
+
+
+def _read_meta(session_id):
+    part_path, meta_path = _paths(session_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise UploadError("Upload session not found", 404)
+    meta['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return meta
+
+
+def _write_meta(session_id, meta):
+    _, meta_path = _paths(session_id)
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({k: v for k, v in meta.items() if k != 'offset'}, f)
+    os.replace(tmp_path, meta_path)
+
+
+def temp_path():
+    """A fresh file name for a single-request upload before it is stored."""
+    return os.path.join(_partial_dir(), uuid.uuid4().hex + '.upload')
+
+
+_recording_hooks = []
+
+
+def on_recording(fn):
+    """Call fn(recording_id, filename) for every new recording, once its row exists."""
+    if fn not in _recording_hooks:
+        _recording_hooks.append(fn)
+    return fn
+
+
+def parse_started_at(value):
+    """Client-declared recording start (epoch seconds) -> float, None if absent; UploadError if invalid."""
+    if value in (None, ''):
+        return None
+    try:
+        started_at = float(value)
+    except (TypeError, ValueError):
+        raise UploadError("started_at must be epoch seconds", 400)
+    # A little clock skew is fine, a start in the future is not
+    if not 0 < started_at <= time.time() + 60:
+        raise UploadError("started_at is out of range", 400)
+    return started_at
+
+
+def find_duplicate(digest, camera_name):
+    """The recording `camera_name` already stored with content `digest`, or None."""
+    if not blobs.is_digest(digest):
+        raise UploadError("sha256 must be 64 lowercase hex digits", 400)
+    return db.query_one('SELECT id, filename FROM recordings WHERE blob_hash = ? AND camera_name = ?',
+                        (digest, camera_name))
+
+
+def store_upload(tmp_path, digest, size, camera_name, started_at=None):
+    """
+    Store the uploaded file at `tmp_path` (content hash `digest`) and register
+    it as a recording of `camera_name` that started at `started_at` (epoch, if
+    known), then queue its processing. If this camera already uploaded the
+    same content, that recording is returned and nothing is added.
+    Returns {"id", "filename", "sha256", "duplicate"}.
+    """
+    filename = blobs.blob_filename(digest)
+    with blobs.lock:
+        existing = find_duplicate(digest, camera_name)
+        if existing is None:
+            try:
+                # The row goes in first: if the blob can't be placed, nothing is left behind
+                with db.transaction():
+                    cursor = db.execute(
+                        'INSERT INTO recordings (filename, camera_name, size_bytes, blob_hash, start_time) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (filename, camera_name, size, digest, started_at))
+                    blobs.add_reference(digest, size, tmp_path)
+            except sqlite3.IntegrityError:
+                # Another worker process stored the same retry first
+                existing = find_duplicate(digest, camera_name)
+                if existing is None:
+                    raise
+    if existing is not None:
+        os.remove(tmp_path)
+        return {'id': existing['id'], 'filename': existing['filename'], 'sha256': digest, 'duplicate': True}
+
+    recording_id = cursor.lastrowid
+    retention.recording_added(camera_name, size)
+    events.record('upload', camera_name, recording_id, size=size, sha256=digest)
+    for hook in _recording_hooks:
+        try:
+            hook(recording_id, filename)
+        except Exception:
+            # The recording is saved either way; a failed submit only loses that processing
+            logger.exception("Post-upload hook %s failed for %s", hook.__name__, filename)
+    return {'id': recording_id, 'filename': filename, 'sha256': digest, 'duplicate': False}
+
+
+def create_session(camera_name, total_size=None, sha256=None, started_at=None):
+    """Open a new upload session and return its public state."""
+    if total_size is not None:
+        total_size = int(total_size)
+        if total_size < 0 or total_size > Config.UPLOAD_MAX_BYTES:
+            raise UploadError("Declared size is over the upload limit", 413)
+    if sha256 is not None and not blobs.is_digest(sha256):
+        raise UploadError("sha256 must be 64 lowercase hex digits", 400)
+    started_at = parse_started_at(started_at)
+
+    cleanup_expired_sessions()
+
+    session_id = uuid.uuid4().hex
+    part_path, _ = _paths(session_id)
+    open(part_path, 'wb').close()
+
+    meta = {
+        'session_id': session_id,
+        'camera_name': camera_name,
+        'total_size': total_size,
+        'sha256': sha256,
+        'started_at': started_at,
+        'created_at': time.time(),
+    }
+    _write_meta(session_id, meta)
+    _hashers[session_id] = [0, blobs.new_hasher()]
+    logger.info("Upload session %s opened for %s", session_id, camera_name)
+    return get_session(session_id)
+
+
+def get_session(session_id):
+    meta = _read_meta(session_id)
+    return {
+        'session_id': session_id,
+        'camera_name': meta['camera_name'],
+        'offset': meta['offset'],
+        'total_size': meta.get('total_size'),
+    }
+
+
+def append_chunk(session_id, offset, stream, length=None):
+    """
+    Stream one chunk from `stream` onto the end of the session file.
+
+    `offset` must equal the number of bytes already stored, otherwise the
+    client is out of sync and gets the real offset back (409) so it can resume.
+    Returns the new offset.
+    """
+    part_path, _ = _paths(session_id)
+    lock = _lock_for(session_id)
+    if not lock.acquire(blocking=False):
+        raise UploadError("Another chunk is still being written for this session", 409)
+
+    started = time.perf_counter()
+    written = 0
+    hashed = None
+    try:
+        meta = _read_meta(session_id)
+        current = meta['offset']
+        if offset != current:
+            raise UploadError("Offset mismatch", 409, offset=current)
+        hashed = _hashers.get(session_id)
+        if hashed is not None and hashed[0] != current:
+            # Out of step with the file (e.g. a write failed halfway): commit re-reads it
+            del _hashers[session_id]
+            hashed = None
+
+        limit = meta.get('total_size') or Config.UPLOAD_MAX_BYTES
+        if length is not None and current + length > limit:
+            raise UploadError("Chunk goes past the end of the upload", 413, offset=current)
+        if current == 0 and meta.get('started_at') is None:
+            # No declared start: the first chunk's arrival marks it (kept across resumes)
+            meta['started_at'] = time.time()
+            _write_meta(session_id, meta)
+
+        with open(part_path, 'ab') as f:
+            while True:
+                want = Config.UPLOAD_COPY_BUFFER
+                if length is not None:
+                    want = min(want, length - written)
+                    if want <= 0:
+                        break
+                block = stream.read(want)
+                if not block:
+                    break
+                if current + written + len(block) > limit:
+                    f.truncate(current + written)
+                    raise UploadError("Chunk goes past the end of the upload", 413, offset=current + written)
+                f.write(block)
+                written += len(block)
+                if hashed is not None:
+                    hashed[1].update(block)
+                    hashed[0] = current + written
+        return current + written
+    finally:
+        lock.release()
+        UPLOAD_BYTES.inc(written, 'session')
+        UPLOAD_SECONDS.observe(time.perf_counter() - started, 'session')
+
+
+def commit_session(session_id):
+    """
+    Store the completed partial file and register it (see store_upload()).
+    Returns {"id", "filename", "sha256", "duplicate"}.
+    """
+    part_path, meta_path = _paths(session_id)
+    lock = _lock_for(session_id)
+    with lock:
+        meta = _read_meta(session_id)
+        total_size = meta.get('total_size')
+        if total_size is not None and meta['offset'] != total_size:
+            raise UploadError("Upload is incomplete", 409, offset=meta['offset'])
+        if meta['offset'] == 0:
+            raise UploadError("Upload is empty", 400)
+
+        hashed = _hashers.get(session_id)
+        if hashed is not None and hashed[0] == meta['offset']:
+            digest = hashed[1].hexdigest()
+        else:
+            digest = blocking(blobs.hash_file, part_path)
+        if meta.get('sha256') and meta['sha256'] != digest:
+            raise UploadError("Upload does not match the declared sha256", 422, sha256=digest)
+
+        result = store_upload(part_path, digest, meta['offset'], meta['camera_name'], meta.get('started_at'))
+        os.remove(meta_path)
+        _hashers.pop(session_id, None)
+    _drop_lock(session_id)
+
+    logger.info("Upload session %s committed as %s (%d bytes%s)", session_id, result['filename'], meta['offset'],
+                ', already stored' if result['duplicate'] else '')
+    return result
+
+
+def abort_session(session_id):
+    part_path, meta_path = _paths(session_id)
+    with _lock_for(session_id):
+        _read_meta(session_id)
+        for path in (part_path, meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        _hashers.pop(session_id, None)
+    _drop_lock(session_id)
+
+
+def cleanup_expired_sessions():
+    """Remove sessions that have not been touched for UPLOAD_SESSION_TTL seconds."""
+    cutoff = time.time() - Config.UPLOAD_SESSION_TTL
+    directory = _partial_dir()
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.upload'):
+            # A single-request upload that died before it was stored
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+            continue
+        if not entry.name.endswith('.json'):
+            continue
+        session_id = entry.name[:-len('.json')]
+        part_path = os.path.join(directory, session_id + '.part')
+        try:
+            last_touched = max(entry.stat().st_mtime,
+                               os.path.getmtime(part_path) if os.path.exists(part_path) else 0)
+        except OSError:
+            continue
+        if last_touched < cutoff:
+            try:
+                abort_session(session_id)
+                logger.info("Upload session %s expired", session_id)
+            except UploadError:
+                pass
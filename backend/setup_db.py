@@ -1,14 +1,17 @@
-import sqlite3
 import os
+import sqlite3
+
+from config import Config
+from services import auth, db
 
 def init_db():
     # 1. Create the folder to store actual video files
-    if not os.path.exists('recordings'):
-        os.makedirs('recordings')
-        print("📁 Created 'recordings' folder.")
+    if not os.path.exists(Config.RECORDINGS_DIR):
+        os.makedirs(Config.RECORDINGS_DIR)
+        print(f"📁 Created '{Config.RECORDINGS_DIR}' folder.")
 
-    # 2. Connect to DB
-    conn = sqlite3.connect('webwatch.db')
+    # 2. Connect to DB (WAL mode is persistent, so it is switched on here once)
+    conn = db.connect()
     cursor = conn.cursor()
     
     print("⚙️ Updating Database Tables...")
@@ -32,14 +35,238 @@ def init_db():
         )
     ''')
 
-    # Add Admin User (admin / 123)
+    # Columns added after the first release; older databases are migrated here.
+    # size_bytes feeds the retention size index (services/retention.py) and is
+    # backfilled from disk once. duration_sec / start_time / end_time (epoch)
+    # are filled by the timeline "index" job (services/timeline.py); start_time
+    # is set at upload already when the recording's start is known
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(recordings)")]
+    for column, sql_type in (('duration_sec', 'REAL'), ('start_time', 'REAL'), ('end_time', 'REAL')):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE recordings ADD COLUMN {column} {sql_type}")
+    if 'size_bytes' not in columns:
+        cursor.execute("ALTER TABLE recordings ADD COLUMN size_bytes INTEGER")
+        rows = cursor.execute("SELECT id, filename FROM recordings").fetchall()
+        sizes = []
+        for rid, filename in rows:
+            path = os.path.join(Config.RECORDINGS_DIR, filename)
+            sizes.append((os.path.getsize(path) if os.path.exists(path) else 0, rid))
+        cursor.execute("BEGIN")
+        cursor.executemany("UPDATE recordings SET size_bytes = ? WHERE id = ?", sizes)
+        cursor.execute("COMMIT")
+        print(f"📏 Recorded file sizes for {len(sizes)} existing recording(s).")
+
+    # Content-addressed storage (services/blobs.py): blob_hash is NULL for
+    # recordings stored before it, which own their file outright
+    if 'blob_hash' not in columns:
+        cursor.execute("ALTER TABLE recordings ADD COLUMN blob_hash TEXT")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            refcount INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # One recording per clip and camera: a retried upload finds the first one
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_recordings_blob_camera
+        ON recordings (blob_hash, camera_name)
+    ''')
+
+    # Operator metadata, searchable with the full-text index below
+    for column in ('tags', 'notes'):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE recordings ADD COLUMN {column} TEXT")
+
+    # Full-text index over camera name, tags (comma separated) and notes
+    # (/api/recordings?q=, /api/events?q=). External content: the text lives
+    # in recordings only, triggers keep the index in step. Skipped when
+    # SQLite is built without FTS5; search then answers 400
     try:
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", ('admin', '123'))
+        has_fts = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'recordings_fts'").fetchone() is not None
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS recordings_fts USING fts5 (
+                camera_name, tags, notes, content='recordings', content_rowid='id'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS recordings_fts_insert AFTER INSERT ON recordings BEGIN
+                INSERT INTO recordings_fts (rowid, camera_name, tags, notes)
+                VALUES (new.id, new.camera_name, new.tags, new.notes);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS recordings_fts_delete AFTER DELETE ON recordings BEGIN
+                INSERT INTO recordings_fts (recordings_fts, rowid, camera_name, tags, notes)
+                VALUES ('delete', old.id, old.camera_name, old.tags, old.notes);
+            END
+        ''')
+        # Only the indexed columns: size / duration updates don't touch the index
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS recordings_fts_update AFTER UPDATE OF camera_name, tags, notes
+            ON recordings BEGIN
+                INSERT INTO recordings_fts (recordings_fts, rowid, camera_name, tags, notes)
+                VALUES ('delete', old.id, old.camera_name, old.tags, old.notes);
+                INSERT INTO recordings_fts (rowid, camera_name, tags, notes)
+                VALUES (new.id, new.camera_name, new.tags, new.notes);
+            END
+        ''')
+        if not has_fts:
+            cursor.execute("INSERT INTO recordings_fts (recordings_fts) VALUES ('rebuild')")
+            print("🔎 Built the recordings search index.")
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ Recordings search disabled: {e}")
+
+    # Indexes for the paginated /api/recordings listing (newest first, optionally per camera)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recordings_time
+        ON recordings (timestamp DESC, id DESC)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recordings_camera_time
+        ON recordings (camera_name, timestamp DESC, id DESC)
+    ''')
+
+    # Timeline lookups: recordings of one camera overlapping a time window
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recordings_camera_span
+        ON recordings (camera_name, start_time)
+    ''')
+
+    # Keyframes Table (offset + byte position of every video keyframe, for seek / export)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS keyframes (
+            recording_id INTEGER NOT NULL REFERENCES recordings (id) ON DELETE CASCADE,
+            offset_sec REAL NOT NULL,
+            byte_pos INTEGER,
+            PRIMARY KEY (recording_id, offset_sec)
+        ) WITHOUT ROWID
+    ''')
+
+    # Motion Intervals Table (filled by services/motion.py after each upload)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS motion_intervals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recording_id INTEGER NOT NULL REFERENCES recordings (id) ON DELETE CASCADE,
+            start_sec REAL NOT NULL,
+            end_sec REAL NOT NULL,
+            peak_score REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_motion_intervals_recording
+        ON motion_intervals (recording_id, start_sec)
+    ''')
+
+    # Jobs Table (durable queue for services/jobs.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after REAL NOT NULL,
+            last_error TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after
+        ON jobs (status, run_after)
+    ''')
+
+    # Segments Table (time index of footage streamed via services/ingest.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            camera_name TEXT NOT NULL,
+            stream_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            start_time REAL NOT NULL,
+            end_time REAL NOT NULL,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_segments_camera_time
+        ON segments (camera_name, start_time)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_segments_time
+        ON segments (start_time)
+    ''')
+
+    # Cameras Table (last known state of services/camera_service.py, flushed in batches)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cameras (
+            name TEXT PRIMARY KEY,
+            online INTEGER NOT NULL DEFAULT 0,
+            room_code TEXT,
+            recording INTEGER NOT NULL DEFAULT 0,
+            last_heartbeat REAL,
+            stats TEXT,
+            registered_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+    # Events Table (joins, disconnects, uploads, motion, deletions; services/events.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time REAL NOT NULL,
+            kind TEXT NOT NULL,
+            camera_name TEXT,
+            room_code TEXT,
+            recording_id INTEGER,
+            detail TEXT
+        )
+    ''')
+    # /api/events filters: by time, by camera or kind within a time range, by recording
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_time ON events (time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_camera_time ON events (camera_name, time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_kind_time ON events (kind, time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_recording ON events (recording_id)')
+
+    # token_version is in every token; a password change bumps it (services/auth.py)
+    if 'token_version' not in [row[1] for row in cursor.execute("PRAGMA table_info(users)")]:
+        cursor.execute("ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0")
+
+    # Revoked Tokens Table (logout; see services/auth.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # revoked_at: other processes pick up only the revocations since their last look
+    if 'revoked_at' not in [row[1] for row in cursor.execute("PRAGMA table_info(revoked_tokens)")]:
+        cursor.execute("ALTER TABLE revoked_tokens ADD COLUMN revoked_at REAL")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens (revoked_at)')
+
+    # Add Admin User (admin / 123) - change it with POST /api/auth/password
+    cursor.execute("SELECT 1 FROM users WHERE username = ?", ('admin',))
+    if cursor.fetchone() is None:
+        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", ('admin', auth.hash_password('123')))
         print("✅ Admin user created.")
-    except:
-        pass
 
-    conn.commit()
+    # Passwords stored in plaintext by older versions are hashed in place
+    plaintext = [(auth.hash_password(password), uid)
+                 for uid, password in cursor.execute("SELECT id, password FROM users").fetchall()
+                 if not auth.is_hashed(password)]
+    if plaintext:
+        cursor.executemany("UPDATE users SET password = ? WHERE id = ?", plaintext)
+        print(f"🔒 Hashed {len(plaintext)} plaintext password(s).")
+
     conn.close()
     print("🎉 Database & Recording System Ready!")
 
@@ -1,34 +1,92 @@
+"""
+Socket.IO server setup and the connection lifecycle.
+
+init_socketio() builds the server for the selected serving mode
+(services/concurrency.py). register_basic_events() owns the one `connect`
+and one `disconnect` handler (Flask-SocketIO keeps a single handler per
+event), so subsystems that care about connections register hooks instead:
+
+    basic.on_connect(fn)      # fn(auth_data), may raise ConnectionRefusedError
+    basic.on_disconnect(fn)   # fn(sid), cleanup (rooms, signaling, ingest)
+
+Connect hooks run before the connection limit is checked (an unauthenticated
+client never takes a slot); disconnect hooks run after it is given back.
+"""
+
+import logging
+
 from flask_socketio import SocketIO, emit
 from flask import request
 
-socketio = None
+from config import Config
+from services import concurrency, metrics
+from services.ratelimit import throttled
+
+logger = logging.getLogger(__name__)
+
+_connect_hooks = []
+_disconnect_hooks = []
+
 
-def init_socketio(app):
-    global socketio
-    # ⚠️ THIS FIXES THE 400 ERROR (Increases limit to 10MB)
-    socketio = SocketIO(
-        app, 
-        cors_allowed_origins="*", 
-        max_http_buffer_size=1e7,  # 👈 CRITICAL FIX
+def on_connect(fn):
+    if fn not in _connect_hooks:  # create_app() may run more than once per process
+        _connect_hooks.append(fn)
+    return fn
+
+
+def on_disconnect(fn):
+    if fn not in _disconnect_hooks:  # create_app() may run more than once per process
+        _disconnect_hooks.append(fn)
+    return fn
+
+
+def init_socketio(app, config=Config):
+    return SocketIO(
+        app,
+        cors_allowed_origins=config.CORS_ORIGINS,
+        async_mode=concurrency.mode,
+        # ⚠️ THIS FIXES THE 400 ERROR: streamed recording chunks (sockets/ingest.py)
+        # arrive as socket messages
+        max_http_buffer_size=config.SOCKETIO_MAX_BUFFER,
         ping_timeout=60,
-        ping_interval=25
+        ping_interval=25,
+        message_queue=config.SOCKETIO_MESSAGE_QUEUE  # fan-out across worker processes
     )
-    return socketio
+
 
 def register_basic_events(socketio_instance):
     @socketio_instance.on('connect')
-    def handle_connect():
-        print(f"[SUCCESS] Client connected! Socket ID: {request.sid}")
+    def handle_connect(auth_data=None):
+        for hook in _connect_hooks:
+            hook(auth_data)
+        # SOCKETIO_MAX_CONNECTIONS, and no new clients while shutting down
+        if not concurrency.sockets.acquire():
+            raise ConnectionRefusedError("Server busy" if not concurrency.draining() else "Server is shutting down")
+        metrics.SOCKET_CONNECTS.inc()
+        metrics.SOCKETS_CONNECTED.inc()
+        logger.debug("Client connected: %s", request.sid)
         emit('connected', {'status': 'ok'})
-    
+
     @socketio_instance.on('disconnect')
     def handle_disconnect():
-        print(f"[INFO] Client disconnected! Socket ID: {request.sid}")
+        concurrency.sockets.release()
+        metrics.SOCKET_DISCONNECTS.inc()
+        metrics.SOCKETS_CONNECTED.dec()
+        sid = request.sid
+        for hook in _disconnect_hooks:
+            try:
+                hook(sid)
+            except Exception:
+                # One failing cleanup must not skip the others
+                logger.exception("Disconnect hook %s failed for %s", hook.__name__, sid)
+        logger.debug("Client disconnected: %s", sid)
 
     @socketio_instance.on('ping')
-    def handle_ping(data):
+    @throttled('ping', 'message')
+    def handle_ping(data=None):
         emit('pong', {'status': 'ok'})
-    
+
     @socketio_instance.on('message')
+    @throttled('message', 'message')
     def handle_message(data):
-        emit('message_response', {'echo': data})
\ No newline at end of file
+        emit('message_response', {'echo': data})
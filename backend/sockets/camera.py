@@ -0,0 +1,44 @@
+from flask import request
+from flask_socketio import join_room, leave_room
+
+from config import Config
+from services.camera_service import CAMERAS_ROOM, registry
+from services.code_allocator import parse_code
+from services.ratelimit import throttled
+
+
+def register_camera_events(socketio):
+    """
+    Camera presence (services/camera_service.py):
+
+        camera_heartbeat {"camera_name": "...", "recording": true,
+                          "battery": 87, "charging": false, "bitrate": 1200000}
+
+    "room_code" is optional (defaults to the room the socket joined as a
+    camera). The ack carries the interval to send the next one at.
+    """
+    registry.socketio = socketio
+
+    @socketio.on('camera_heartbeat')
+    @throttled('camera_heartbeat', 'heartbeat')
+    def handle_camera_heartbeat(data=None):
+        data = data if isinstance(data, dict) else {}
+        name = str(data.get('camera_name') or '').strip()
+        if not name:
+            return {'status': 'error', 'message': 'camera_name required'}
+        room_code = parse_code(data['room_code']) if data.get('room_code') is not None else None
+        state = registry.heartbeat(request.sid, name[:100], str(room_code) if room_code else None,
+                                   data.get('recording'), data)
+        return {'status': 'ok', 'online': state['online'], 'interval': Config.CAMERA_HEARTBEAT_INTERVAL}
+
+    # Dashboards subscribe to camera_update pushes instead of polling /api/camera/status
+    @socketio.on('subscribe_cameras')
+    @throttled('subscribe_cameras', 'room')
+    def handle_subscribe_cameras(data=None):
+        join_room(CAMERAS_ROOM)
+        return {'status': 'ok', 'cameras': registry.list()}
+
+    @socketio.on('unsubscribe_cameras')
+    def handle_unsubscribe_cameras(data=None):
+        leave_room(CAMERAS_ROOM)
+        return {'status': 'ok'}
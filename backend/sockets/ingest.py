@@ -0,0 +1,55 @@
+from flask import request
+
+from config import Config
+from services.ingest import IngestError, ingest
+from services.ratelimit import check_bytes, refund_bytes, throttled
+
+
+def register_ingest_events(socketio):
+    """
+    Continuous recording over the socket (services/ingest.py):
+
+        ingest_start {"camera_name": "...", "mime_type": "video/webm"}
+        ingest_chunk {"seq": 0, "data": <MediaRecorder blob>, "keyframe": false}
+        ingest_stop
+
+    Every event is acknowledged. A chunk ack of {"status": "busy"} means the
+    server's buffer for this camera is full, and {"status": "throttled"} that
+    the camera sends more than its bitrate budget (RATE_LIMITS ingest_bytes):
+    either way, wait retry_after_ms and send the same seq again. Keep at most
+    a few chunks in flight.
+    """
+
+    @socketio.on('ingest_start')
+    @throttled('ingest_start', 'room')
+    def handle_ingest_start(data=None):
+        data = data if isinstance(data, dict) else {}
+        stream = ingest.open(request.sid, data.get('camera_name') or 'Unknown Camera', data.get('mime_type'))
+        return {
+            'status': 'ok',
+            'stream_id': stream.stream_id,
+            'segment_seconds': stream.segment_seconds,
+            'max_buffer_bytes': Config.INGEST_MAX_BUFFER_BYTES,
+        }
+
+    @socketio.on('ingest_chunk')
+    @throttled('ingest_chunk', 'ingest_chunk')
+    def handle_ingest_chunk(data):
+        if not isinstance(data, dict) or not isinstance(data.get('data'), (bytes, bytearray)):
+            return {'status': 'error', 'message': 'Chunk must be an object with binary "data"'}
+        seq = data.get('seq')
+        refusal = check_bytes('ingest_chunk', 'ingest_bytes', len(data['data']))
+        if refusal is not None:
+            return dict(refusal, seq=seq)
+        try:
+            buffered = ingest.push(request.sid, seq, bytes(data['data']), data.get('keyframe', False))
+        except IngestError as e:
+            # Not written: the resend pays for it
+            refund_bytes('ingest_bytes', len(data['data']))
+            status = 'busy' if e.message == 'busy' else 'error'
+            return dict(e.extra, status=status, message=e.message, seq=seq)
+        return {'status': 'ok', 'seq': seq, 'buffered': buffered}
+
+    @socketio.on('ingest_stop')
+    def handle_ingest_stop(data=None):
+        return {'status': 'ok', 'stream_id': ingest.close(request.sid)}
@@ -0,0 +1,16 @@
+from flask_socketio import join_room, leave_room
+
+from services.jobs import JOBS_ROOM
+
+
+def register_job_events(socketio):
+    # Dashboards subscribe to push updates instead of polling /api/jobs
+    @socketio.on('subscribe_jobs')
+    def handle_subscribe_jobs(data=None):
+        join_room(JOBS_ROOM)
+        return {'status': 'ok'}
+
+    @socketio.on('unsubscribe_jobs')
+    def handle_unsubscribe_jobs(data=None):
+        leave_room(JOBS_ROOM)
+        return {'status': 'ok'}
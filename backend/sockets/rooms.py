@@ -6,17 +6,59 @@ Concepts:
 - Socket.IO rooms: Clients को groups में organize करने का तरीका
 - join_room(): Client को specific room में add करता है
 - leave_room(): Client को room से remove करता है
-- In-memory storage: Dictionary में rooms और connected clients store करते हैं
+- In-memory storage: RoomRegistry (services/room_registry.py) में rooms और connected clients store करते हैं
+- Disconnect cleanup: sockets/basic.py का disconnect hook (cleanup_sid)
 """
 
+import logging
+
 from flask_socketio import emit, join_room, leave_room
 from flask import request
 
-# In-memory storage: Rooms dictionary
-# Format: {"123456": ["socket_id_1", "socket_id_2"]}
-# Key = 6-digit room code
-# Value = List of socket IDs in that room
-rooms = {}
+from services import events
+from services.code_allocator import allocator, parse_code
+from services.ratelimit import throttled
+from services.room_registry import registry
+from services.snapshots import relay
+
+logger = logging.getLogger(__name__)
+
+# Room membership lives in the shared registry:
+# {"123456": {"socket_id_1": "viewer", "socket_id_2": "camera"}}
+# plus a socket_id -> rooms reverse index, so disconnect cleanup is O(1)
+
+
+def _room_code(data):
+    """6-digit code from the event payload ("123456" or 123456) as a string, or None."""
+    if not isinstance(data, dict):
+        return None
+    code = parse_code(data.get('code', ''))
+    return str(code) if code is not None else None
+
+
+def cleanup_sid(sid):
+    """
+    जब client disconnect होता है, automatically सभी rooms से remove करते हैं
+    (registered as a disconnect hook, see sockets/basic.py)
+    """
+    # Reverse index से सिर्फ उन्हीं rooms को touch करते हैं जिनमें यह socket था
+    cleaned = registry.remove_sid(sid)
+    for room_code, remaining in cleaned:
+        events.record('disconnect', room_code=room_code, sid=sid)
+        if remaining == 0:
+            logger.info("Room %s deleted (client disconnected)", room_code)
+        else:
+            # बाकी clients को notify करते हैं
+            emit('room_update', {
+                'message': 'Ek client disconnect ho gaya',
+                'room_code': room_code,
+                'total_clients': remaining,
+                'status': 'ok'
+            }, to=room_code)
+    events.log.forget(sid)
+    if cleaned:
+        logger.debug("Cleaned up socket %s from %d room(s)", sid, len(cleaned))
+
 
 def register_room_events(socketio_instance):
     """
@@ -24,81 +66,87 @@ def register_room_events(socketio_instance):
     """
     
     @socketio_instance.on('join_room')
+    @throttled('join_room', 'room')
     def handle_join_room(data):
         """
         Client room में join करने के लिए यह event use करता है
         
         Expected data format:
         {
-            "code": "123456",  # 6-digit room code
-            "type": "camera" or "viewer"  # Device type
+            "code": "123456",  # 6-digit room code (string or number)
+            "type": "camera" or "viewer",  # Device type
+            "camera_name": "Garage"  # optional, camera का नाम (event log में दिखता है)
         }
+
+        Room के सभी clients को `join_room_success` मिलता है (dashboard को पता
+        चलता है कि camera आ गया), और caller को वही payload ack में।
         """
         try:
-            # Data extract करते हैं
-            room_code = data.get('code', '').strip()
-            device_type = data.get('type', 'viewer')  # Default: viewer
+            room_code = _room_code(data)
+            device_type = data.get('type', 'viewer') if isinstance(data, dict) else 'viewer'
             socket_id = request.sid  # Current client का socket ID
             
             # Validation: Code 6 digits होना चाहिए
-            if not room_code or len(room_code) != 6 or not room_code.isdigit():
-                emit('join_room_error', {
+            if room_code is None:
+                error = {
                     'message': 'Invalid room code! 6-digit code required.',
                     'status': 'error'
-                })
-                return
+                }
+                emit('join_room_error', error)
+                return error
             
-            # Special validation for camera devices
+            # Camera सिर्फ उसी code पर join कर सकता है जो dashboard ने generate
+            # किया है (अभी pending) या जिसका room पहले से खुला है
             if device_type == 'camera':
-                # Check if room exists (dashboard must create room first)
-                if room_code not in rooms or len(rooms[room_code]) == 0:
-                    emit('join_room_error', {
+                if not registry.exists(room_code) and not allocator.is_issued(room_code):
+                    error = {
                         'message': 'Room not found! Please check the code.',
                         'status': 'error'
-                    })
-                    return
-                
-                print(f"[INFO] Camera trying to join existing room {room_code} with {len(rooms[room_code])} clients")
+                    }
+                    emit('join_room_error', error)
+                    return error
             
             # Room में join करते हैं
             join_room(room_code)
             
-            # Rooms dictionary में add करते हैं
-            if room_code not in rooms:
-                rooms[room_code] = []
-            
-            # Socket ID add करते हैं (अगर पहले से नहीं है)
-            if socket_id not in rooms[room_code]:
-                rooms[room_code].append(socket_id)
-            
-            print(f"[SUCCESS] {device_type} joined room {room_code}. Socket ID: {socket_id}")
-            print(f"[INFO] Room {room_code} now has {len(rooms[room_code])} client(s)")
+            # Registry में add करते हैं (same socket दोबारा join करे तो सिर्फ role update होता है)
+            total_clients = registry.join(room_code, socket_id, device_type)
+            logger.info("%s joined room %s (%d client(s))", device_type, room_code, total_clients)
+            camera_name = data.get('camera_name') if device_type == 'camera' else None
+            events.record('join', str(camera_name)[:100] if camera_name else None, room_code=room_code,
+                          sid=socket_id, role=device_type)
             
-            # Success confirmation भेजते हैं
-            emit('join_room_success', {
+            # Success confirmation पूरे room को भेजते हैं
+            result = {
                 'message': f'Room {room_code} me successfully join ho gaya!',
                 'room_code': room_code,
                 'device_type': device_type,
-                'clients_in_room': len(rooms[room_code]),
+                'socket_id': socket_id,
+                'clients_in_room': total_clients,
                 'status': 'ok'
-            })
+            }
+            emit('join_room_success', result, to=room_code)
             
             # Same room के सभी clients को notify करते हैं
             socketio_instance.emit('room_update', {
                 'message': f'{device_type} ne room join kiya',
                 'room_code': room_code,
-                'total_clients': len(rooms[room_code]),
+                'total_clients': total_clients,
                 'status': 'ok'
             }, room=room_code)
+            return result
             
         except Exception as e:
-            print(f"[ERROR] Error in join_room: {e}")
-            emit('join_room_error', {
+            logger.exception("Error in join_room")
+            error = {
                 'message': f'Error: {str(e)}',
                 'status': 'error'
-            })
+            }
+            emit('join_room_error', error)
+            return error
     
     @socketio_instance.on('leave_room')
+    @throttled('leave_room', 'room')
     def handle_leave_room(data):
         """
         Client room से leave करने के लिए यह event use करता है
@@ -109,7 +157,7 @@ def register_room_events(socketio_instance):
         }
         """
         try:
-            room_code = data.get('code', '').strip()
+            room_code = _room_code(data)
             socket_id = request.sid
             
             if not room_code:
@@ -122,16 +170,16 @@ def register_room_events(socketio_instance):
             # Room से leave करते हैं
             leave_room(room_code)
             
-            # Rooms dictionary से remove करते हैं
-            if room_code in rooms and socket_id in rooms[room_code]:
-                rooms[room_code].remove(socket_id)
-                
-                # अगर room empty हो गया, तो delete कर देते हैं
-                if len(rooms[room_code]) == 0:
-                    del rooms[room_code]
-                    print(f"[INFO] Room {room_code} deleted (empty)")
+            # Registry से remove करते हैं (room empty हो गया तो registry उसे delete कर देता है)
+            remaining = registry.leave(room_code, socket_id)
+            # The room's snapshot feed ends with its camera
+            relay.stop_publishing(room_code, socket_id)
+            if remaining is not None:
+                events.record('leave', room_code=room_code, sid=socket_id)
+            if remaining == 0:
+                logger.info("Room %s deleted (empty)", room_code)
             
-            print(f"[INFO] Client left room {room_code}. Socket ID: {socket_id}")
+            logger.debug("Client %s left room %s", socket_id, room_code)
             
             # Success confirmation
             emit('leave_room_success', {
@@ -141,22 +189,23 @@ def register_room_events(socketio_instance):
             })
             
             # Same room के बाकी clients को notify करते हैं
-            if room_code in rooms:
+            if remaining:
                 socketio_instance.emit('room_update', {
                     'message': 'Ek client ne room leave kiya',
                     'room_code': room_code,
-                    'total_clients': len(rooms[room_code]),
+                    'total_clients': remaining,
                     'status': 'ok'
                 }, room=room_code)
                 
         except Exception as e:
-            print(f"[ERROR] Error in leave_room: {e}")
+            logger.exception("Error in leave_room")
             emit('leave_room_error', {
                 'message': f'Error: {str(e)}',
                 'status': 'error'
             })
     
     @socketio_instance.on('get_room_status')
+    @throttled('get_room_status', 'room_status')
     def handle_get_room_status(data):
         """
         Room की current status get करने के लिए
@@ -167,7 +216,7 @@ def register_room_events(socketio_instance):
         }
         """
         try:
-            room_code = data.get('code', '').strip()
+            room_code = _room_code(data)
             
             if not room_code:
                 emit('room_status_error', {
@@ -177,11 +226,13 @@ def register_room_events(socketio_instance):
                 return
             
             # Room status return करते हैं
-            if room_code in rooms:
+            members = registry.members(room_code)
+            if members:
                 emit('room_status', {
                     'room_code': room_code,
-                    'total_clients': len(rooms[room_code]),
-                    'clients': rooms[room_code],
+                    'total_clients': len(members),
+                    'clients': list(members),
+                    'roles': members,
                     'exists': True,
                     'status': 'ok'
                 })
@@ -195,38 +246,8 @@ def register_room_events(socketio_instance):
                 })
                 
         except Exception as e:
-            print(f"[ERROR] Error in get_room_status: {e}")
+            logger.exception("Error in get_room_status")
             emit('room_status_error', {
                 'message': f'Error: {str(e)}',
                 'status': 'error'
             })
-    
-    @socketio_instance.on('disconnect')
-    def handle_disconnect_cleanup():
-        """
-        जब client disconnect होता है, automatically सभी rooms से remove करते हैं
-        """
-        socket_id = request.sid
-        
-        # सभी rooms में से इस socket_id को remove करते हैं
-        rooms_to_cleanup = []
-        for room_code, clients in rooms.items():
-            if socket_id in clients:
-                clients.remove(socket_id)
-                rooms_to_cleanup.append(room_code)
-                
-                # अगर room empty हो गया, तो delete कर देते हैं
-                if len(clients) == 0:
-                    del rooms[room_code]
-                    print(f"[INFO] Room {room_code} deleted (client disconnected)")
-                else:
-                    # बाकी clients को notify करते हैं
-                    socketio_instance.emit('room_update', {
-                        'message': 'Ek client disconnect ho gaya',
-                        'room_code': room_code,
-                        'total_clients': len(clients),
-                        'status': 'ok'
-                    }, room=room_code)
-        
-        if rooms_to_cleanup:
-            print(f"🧹 Cleaned up socket {socket_id} from {len(rooms_to_cleanup)} room(s)")
@@ -1,36 +1,187 @@
+"""
+WebRTC signaling relay (offer / answer / ice-candidate).
+
+- Only members of a room (join_room) can signal in it.
+- Messages go straight to one peer when the sender names it with "to"
+  (a socket id in the same room). Without "to", they go to the rest of the
+  room as before.
+- Relayed payloads get a "from" field with the sender's socket id, so the
+  peer can reply directly.
+- Trickle ICE: peers that sent `signaling_hello {"ice_batching": true}` get
+  candidates coalesced over ICE_BATCH_WINDOW_MS as a single
+  `ice-candidates {"room_code", "from", "candidates": [...]}` event.
+  Everyone else keeps receiving one `ice-candidate` event per candidate.
+- Logging is level-gated (LOG_LEVEL). SDP bodies are never logged.
+"""
+
+import logging
+import threading
+
+from flask import request
 from flask_socketio import emit
 
+from config import Config
+from services.metrics import SIGNALING_MESSAGES
+from services.ratelimit import throttled
+from services.room_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Socket ids that understand batched "ice-candidates" events
+_batch_capable = set()
+_batcher = None
+
+
+class IceBatcher:
+    """Collects ICE candidates per (sender, target) and flushes them together."""
+
+    def __init__(self, socketio, window):
+        self.socketio = socketio
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}  # (from_sid, target) -> {"room_code": ..., "candidates": [...]}
+        self._flusher_running = False
+
+    def add(self, from_sid, target, room, payload):
+        with self._lock:
+            batch = self._pending.get((from_sid, target))
+            if batch is None:
+                batch = self._pending[(from_sid, target)] = {'room_code': room, 'candidates': []}
+            batch['candidates'].append(payload)
+            if not self._flusher_running:
+                self._flusher_running = True
+                self.socketio.start_background_task(self._flush_loop)
+
+    def _flush_loop(self):
+        # One flusher for all batches; it exits as soon as there is nothing left
+        while True:
+            self.socketio.sleep(self.window)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                if not pending:
+                    self._flusher_running = False
+                    return
+            for (from_sid, target), batch in pending.items():
+                self.socketio.emit('ice-candidates', {
+                    'room_code': batch['room_code'],
+                    'from': from_sid,
+                    'candidates': batch['candidates'],
+                }, to=target, skip_sid=from_sid)
+            logger.debug("Flushed %d ICE batch(es)", len(pending))
+
+    def forget(self, sid):
+        with self._lock:
+            for key in [k for k in self._pending if sid in k]:
+                del self._pending[key]
+
+
+def forget_peer(sid):
+    """Disconnect cleanup; called from the app's disconnect handler."""
+    _batch_capable.discard(sid)
+    if _batcher is not None:
+        _batcher.forget(sid)
+
+
+def _parse(event, data):
+    """Return (room, target_sid, payload) or None if the message can't be relayed."""
+    SIGNALING_MESSAGES.inc(1, event)
+    if not isinstance(data, dict):
+        logger.warning("%s from %s ignored: payload is not an object", event, request.sid)
+        return None
+
+    # Check for BOTH names to be safe
+    room = data.get("room_code") or data.get("room")
+    if not room:
+        logger.warning("%s from %s ignored: no room code", event, request.sid)
+        return None
+    room = str(room)
+    if room not in registry.rooms_of(request.sid):
+        logger.warning("%s from %s ignored: sender is not in room %s", event, request.sid, room)
+        return None
+
+    target = data.get("to")
+    if target is not None and room not in registry.rooms_of(target):
+        # The target must be in the room too: never relay outside it
+        logger.warning("%s from %s ignored: target %s is not in room %s", event, request.sid, target, room)
+        return None
+
+    payload = dict(data)
+    payload["from"] = request.sid
+    return room, target, payload
+
+
+def _relay(event, data):
+    parsed = _parse(event, data)
+    if parsed is None:
+        return
+    room, target, payload = parsed
+    if target is not None:
+        emit(event, payload, to=target)
+        logger.debug("%s %s -> %s", event, request.sid, target)
+    else:
+        emit(event, payload, room=room, include_self=False)
+        logger.debug("%s %s -> room %s", event, request.sid, room)
+
+
+def _room_of(data):
+    return data.get("room_code") or data.get("room")
+
+
 def register_signaling_events(socketio):
-    # 👇 THIS LINE PROVES THE CODE IS LOADED
-    print("\n🔥🔥🔥 V3 SIGNALING LOGIC LOADED SUCCESSFULLY 🔥🔥🔥\n")
+    global _batcher
+    _batcher = IceBatcher(socketio, Config.ICE_BATCH_WINDOW_MS / 1000)
+    logger.info("Signaling relay loaded (ICE batch window %d ms)", Config.ICE_BATCH_WINDOW_MS)
+
+    @socketio.on("signaling_hello")
+    @throttled("signaling_hello", "signaling")
+    def on_signaling_hello(data):
+        SIGNALING_MESSAGES.inc(1, "signaling_hello")
+        if isinstance(data, dict) and data.get("ice_batching"):
+            _batch_capable.add(request.sid)
+        else:
+            _batch_capable.discard(request.sid)
+        emit("signaling_hello", {"ice_batching": request.sid in _batch_capable, "status": "ok"})
 
     # 1. Handle WebRTC "Offer"
+    # Relayed messages also spend the room's budget: one noisy peer slows its own room only
     @socketio.on("offer")
+    @throttled("offer", "signaling", room_of=_room_of)
     def on_offer(data):
-        print(f"⚡ DEBUG: I received an OFFER! Data: {data}") # Debug print
-        
-        # Check for BOTH names to be safe
-        room = data.get("room_code") or data.get("room")
-        
-        if room:
-            print(f"✅ Forwarding OFFER to room: {room}")
-            emit("offer", data, room=room, include_self=False)
-        else:
-            print("❌ ERROR: No Room ID in offer data!")
+        _relay("offer", data)
 
     # 2. Handle WebRTC "Answer"
     @socketio.on("answer")
+    @throttled("answer", "signaling", room_of=_room_of)
     def on_answer(data):
-        print(f"⚡ DEBUG: I received an ANSWER! Data: {data}")
-        room = data.get("room_code") or data.get("room")
-        if room:
-            print(f"✅ Forwarding ANSWER to room: {room}")
-            emit("answer", data, room=room, include_self=False)
+        _relay("answer", data)
 
     # 3. Handle ICE Candidates
     @socketio.on("ice-candidate")
+    @throttled("ice-candidate", "ice", room_of=_room_of)
     def on_ice_candidate(data):
-        # We comment this out to keep logs clean, but it works same way
-        room = data.get("room_code") or data.get("room")
-        if room:
-            emit("ice-candidate", data, room=room, include_self=False)
\ No newline at end of file
+        parsed = _parse("ice-candidate", data)
+        if parsed is None:
+            return
+        room, target, payload = parsed
+        sender = request.sid
+
+        if target is not None:
+            if target in _batch_capable:
+                _batcher.add(sender, target, room, payload)
+            else:
+                emit("ice-candidate", payload, to=target)
+            return
+
+        peers = [sid for sid in registry.members(room) if sid != sender]
+        legacy = [sid for sid in peers if sid not in _batch_capable]
+        if not peers or len(legacy) == len(peers):
+            # Nobody batches (or the room is not tracked): one room-wide emit
+            emit("ice-candidate", payload, room=room, include_self=False)
+        elif not legacy:
+            _batcher.add(sender, room, room, payload)
+        else:
+            for sid in peers:
+                if sid in _batch_capable:
+                    _batcher.add(sender, sid, room, payload)
+                else:
+                    emit("ice-candidate", payload, to=sid)
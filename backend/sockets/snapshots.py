@@ -0,0 +1,69 @@
+from flask import request
+from flask_socketio import join_room, leave_room
+
+from services.code_allocator import parse_code
+from services.ratelimit import throttled
+from services.room_registry import registry
+from services.snapshots import SnapshotError, relay
+
+
+def _viewers_room(code):
+    return f'snapshots:{code}'
+
+
+def _code(data):
+    code = parse_code(data.get('code', '')) if isinstance(data, dict) else None
+    return str(code) if code is not None else None
+
+
+def register_snapshot_events(socketio):
+    """
+    Snapshot relay (services/snapshots.py):
+
+        camera:  snapshot_frame {"code": "123456", "data": <JPEG bytes>}
+        viewer:  subscribe_snapshots {"code": "123456"} -> `snapshot` events
+                 {"room_code", "seq", "timestamp", "data": <JPEG bytes>}
+                 unsubscribe_snapshots {"code": "123456"}
+
+    Both sides must have joined the room first (join_room). A frame ack of
+    {"status": "busy"} means the camera sends faster than
+    SNAPSHOT_MIN_INTERVAL_MS: the frame was dropped, send the next one later.
+    """
+
+    @socketio.on('snapshot_frame')
+    def handle_snapshot_frame(data):
+        code = _code(data)
+        if code is None:
+            return {'status': 'error', 'message': 'Invalid room code! 6-digit code required.'}
+        if registry.role_of(code, request.sid) != 'camera':
+            # Not (or no longer) the room's camera
+            relay.stop_publishing(code, request.sid)
+            return {'status': 'error', 'message': 'Join the room as its camera first'}
+        try:
+            frame = relay.publish(code, request.sid, data.get('data'))
+        except SnapshotError as e:
+            return {'status': 'busy' if e.message == 'busy' else 'error', 'message': e.message}
+        # One broadcast: the packet is encoded once for every subscribed viewer
+        socketio.emit('snapshot', dict(frame.info(), room_code=code, data=frame.data),
+                      room=_viewers_room(code))
+        return {'status': 'ok', 'seq': frame.seq}
+
+    @socketio.on('subscribe_snapshots')
+    # The ack carries the room's latest frame: members also spend the room's relay budget
+    @throttled('subscribe_snapshots', 'room', room_of=_code)
+    def handle_subscribe_snapshots(data):
+        code = _code(data)
+        if code is None or registry.role_of(code, request.sid) is None:
+            return {'status': 'error', 'message': 'Join the room first'}
+        join_room(_viewers_room(code))
+        # The current frame right away, instead of a blank view until the next push
+        frame = relay.latest(code)
+        latest = dict(frame.info(), data=frame.data) if frame is not None else None
+        return {'status': 'ok', 'room_code': code, 'latest': latest}
+
+    @socketio.on('unsubscribe_snapshots')
+    def handle_unsubscribe_snapshots(data):
+        code = _code(data)
+        if code is not None:
+            leave_room(_viewers_room(code))
+        return {'status': 'ok'}